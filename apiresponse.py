@@ -1,47 +1,230 @@
-from openai import OpenAI
-from dotenv import load_dotenv
-load_dotenv()
 
-from pydantic import BaseModel, ConfigDict
-from typing import List, Dict, Any
+from typing import TYPE_CHECKING, List, Dict, Any, Callable, Iterator, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
 import json
+import math
+import os
 import re
+import time
+import unicodedata
 
-# Create the Pydantic class
-class TravelPlan(BaseModel):
-    model_config = ConfigDict(extra="forbid")
+from clients import get_client, load_env
+from history import TokenBudgetHistory
+from prefetch import Prefetcher, get_prefetcher
+from schemas import json_schema
+from cache import LRUCache, SingleFlight, SQLiteCache, TieredCache
+from streaming import DeltaCallback, emit, print_stream
+from scheduler import INTERACTIVE, NORMAL, SPECULATIVE, get_scheduler, request
+from tracing import bind, record_cache, record_error, span, traced
+from vntext import budget_bucket, fold_diacritics, normalize_text, parse_budget_vnd, parse_duration_days
 
-    destination: str
-    duration: str
-    number_of_people: int
-    budget: str
-    activities: List[str]
-    accommodations: List[str]
-    transportation: List[str]
-    estimated_cost: str
+if TYPE_CHECKING:
+    from openai import OpenAI
+
+PRICE_FALLBACK = "Liên hệ để biết giá"
+
+# Phân loại cục bộ (trên văn bản đã bỏ dấu) để bỏ qua lần gọi model cho câu chào hỏi, xã giao
+SMALL_TALK_RE = re.compile(
+    r"(xin chao|chao|hello|hi|hey|alo|cam on|thanks?|thank you|ok|oke|okay|vang|da|tam biet|bye"
+    r"|ban la ai|ban ten gi|ban khoe khong)( ban| nhe| nha| nhieu| a| ad)*"
+)
+
+MODEL_NAMES = ("TravelPlan", "UserInputAnalysis", "ItemPrice", "TravelPlanPrices")
+
+def __getattr__(name: str) -> Any:
+    # apiresponse.TravelPlan...: chỉ import pydantic (models.py) khi thật sự cần
+    if name in MODEL_NAMES:
+        import models
+        return getattr(models, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+ANALYSIS_FIELDS = ("type", "intent", "sentiment")
+TRAVEL_INFO_FIELDS = ("destination", "duration", "number_of_people", "budget")
+DEFAULT_ANALYSIS = {"type": "general", "intent": "unknown", "sentiment": "neutral"}
+
+def pre_classify(text: str) -> Optional[Dict[str, Any]]:
+    """Phân loại nhanh không cần model; trả về None nếu cần model phân tích"""
+    folded = " ".join(re.findall(r"\w+", fold_diacritics(text)))
+    # Chỉ bỏ qua model khi chắc chắn là câu xã giao; câu ngắn như "Sapa thế nào?" vẫn cần phân tích
+    if not folded or SMALL_TALK_RE.fullmatch(folded):
+        analysis = dict(DEFAULT_ANALYSIS, intent="small_talk")
+        analysis.update(dict.fromkeys(TRAVEL_INFO_FIELDS))
+        return analysis
+    return None
 
 class UserInfo:
+    __slots__ = ("name", "preferences", "last_interaction", "travel_history")
+
     def __init__(self):
         self.name = None
         self.preferences = {}
         self.last_interaction = None
         self.travel_history = []
 
-class AgentMemory:
+    def to_state(self) -> Dict[str, Any]:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    @classmethod
+    def from_state(cls, state: Dict[str, Any]) -> "UserInfo":
+        info = cls()
+        info.name = state["name"]
+        info.preferences = dict(state["preferences"])
+        info.last_interaction = state["last_interaction"]
+        info.travel_history = list(state["travel_history"])
+        return info
+
+def plan_cache_key(travel_info: Dict[str, Any]) -> str:
+    """Chuẩn hóa khóa cache: bỏ dấu điểm đến, đổi thời gian ra số ngày, gom ngân sách theo khoảng"""
+    destination = normalize_text(str(travel_info.get('destination') or ''))
+    days = parse_duration_days(travel_info.get('duration'))
+    people = travel_info.get('number_of_people')
+    budget = budget_bucket(travel_info.get('budget'))
+    return f"{destination}|{days or '?'}d|{people or '?'}p|{budget}"
+
+def create_plan_cache():
+    """Tạo cache kế hoạch du lịch; đặt TRAVEL_PLAN_CACHE_PATH để dùng chung qua SQLite"""
+    ttl = float(os.getenv("TRAVEL_PLAN_CACHE_TTL", 24 * 3600))
+    memory_cache = LRUCache(max_size=int(os.getenv("TRAVEL_PLAN_CACHE_SIZE", 256)), ttl=ttl)
+    path = os.getenv("TRAVEL_PLAN_CACHE_PATH")
+    if not path:
+        return memory_cache
+    return TieredCache(memory_cache, SQLiteCache(path, ttl=ttl, max_size=10_000, table="travel_plans"))
+
+def price_cache_key(category: str, item: str) -> str:
+    """Khóa cache giá: loại mục + tên mục đã bỏ dấu, bỏ ký tự thừa"""
+    return f"{category}|{normalize_text(item)}"
+
+def create_price_cache():
+    """Tạo cache giá dùng chung giữa các kế hoạch; đặt PRICE_CACHE_PATH để lưu qua SQLite"""
+    ttl = float(os.getenv("PRICE_CACHE_TTL", 3 * 24 * 3600))
+    memory_cache = LRUCache(max_size=int(os.getenv("PRICE_CACHE_SIZE", 2048)), ttl=ttl)
+    path = os.getenv("PRICE_CACHE_PATH")
+    if not path:
+        return memory_cache
+    return TieredCache(memory_cache, SQLiteCache(path, ttl=ttl, max_size=100_000, table="prices"))
+
+def coalesced_cache_stats(cache, inflight: SingleFlight) -> Dict[str, Any]:
+    """Thống kê cache (hit/miss/eviction) kèm số lần gọi được gộp qua inflight"""
+    stats = cache.stats.snapshot()
+    stats["coalesced"] = inflight.coalesced
+    stats["in_flight"] = inflight.in_flight()
+    return stats
+
+# Câu chỉnh sửa kế hoạch đã có: "thêm 1 người", "tăng ngân sách lên 8 triệu", "đổi sang 4 ngày"
+# So khớp trên văn bản có dấu: bỏ dấu thì "thèm", "tặng", "đói", "đợi", "thấy" cũng thành từ chỉnh sửa
+REFINE_RE = re.compile(r"(?<!\w)(thêm|bớt|tăng|giảm|đổi|thay|sửa|chuyển)(?!\w)")
+# Người gõ không dấu: chỉ khi cả câu không có dấu
+REFINE_FOLDED_RE = re.compile(r"\b(them|bot|tang|giam|doi|thay|sua|chuyen)\b")
+RELATIVE_PEOPLE_RE = re.compile(r"\b(them|bot|giam) (\d+) (nguoi|ban|khach)\b")
+RELATIVE_DAYS_RE = re.compile(r"\b(them|bot|giam) (\d+) (ngay|dem)\b")
+
+# Thông tin phải có trước khi tạo sẵn kế hoạch: lượt lập kế hoạch tiếp theo luôn nêu các ô
+# này, nên đoán trước khi còn thiếu sẽ tạo kế hoạch với khóa không bao giờ được dùng
+PREFETCH_FIELDS = ("destination", "duration", "number_of_people")
+
+# Mục của kế hoạch cần tạo lại khi từng thông tin thay đổi; các mục khác giữ nguyên
+SECTIONS_BY_FIELD = {
+    "duration": ("activities", "accommodations", "estimated_cost"),
+    "number_of_people": ("accommodations", "transportation", "estimated_cost"),
+    "budget": ("accommodations", "estimated_cost"),
+}
+PLAN_SECTIONS = ("activities", "accommodations", "transportation", "estimated_cost")
+
+def _slot_value(field: str, value: Any) -> Any:
+    """Giá trị đã chuẩn hóa để so sánh hai lần trích xuất"""
+    if value is None:
+        return None
+    if field == "destination":
+        return normalize_text(str(value))
+    if field == "duration":
+        return parse_duration_days(value)
+    if field == "budget":
+        return parse_budget_vnd(value)
+    return value
+
+def affected_sections(changes: Dict[str, Any]) -> List[str]:
+    fields = set(changes)
+    return [section for section in PLAN_SECTIONS
+            if any(section in SECTIONS_BY_FIELD.get(field, PLAN_SECTIONS) for field in fields)]
+
+class PlanSession:
+    """Kế hoạch gần nhất của phiên, để các câu chỉnh sửa chỉ tạo lại phần bị ảnh hưởng
+
+    plan là cùng một object với bản trong cache kế hoạch (dùng chung giữa các phiên), không
+    được sửa tại chỗ; chỉnh sửa luôn tạo bản sao mới (xem refine_travel_plan).
+    """
+    __slots__ = ("travel_info", "plan", "refinements")
+
     def __init__(self):
-        self.conversation_history = []
-        self.travel_plans_cache = {}
+        self.travel_info: Dict[str, Any] = {}
+        self.plan: Optional[Dict[str, Any]] = None
+        self.refinements = 0
+
+    def update(self, travel_info: Dict[str, Any], plan: Dict[str, Any]):
+        self.travel_info = dict(travel_info)
+        self.plan = plan
+
+    def is_refinement(self, user_input: str, travel_info: Dict[str, Any]) -> bool:
+        if self.plan is None:
+            return False
+        destination = travel_info.get("destination")
+        if destination and _slot_value("destination", destination) != _slot_value("destination", self.travel_info.get("destination")):
+            return False
+        text = unicodedata.normalize("NFC", user_input).lower()
+        folded = fold_diacritics(text)
+        if folded == text:
+            return bool(REFINE_FOLDED_RE.search(folded))
+        return bool(REFINE_RE.search(text))
+
+    def merge(self, user_input: str, travel_info: Dict[str, Any]) -> Dict[str, Any]:
+        """Thông tin mới = kế hoạch cũ + các ô vừa nhắc tới; "thêm/bớt N người/ngày" tính theo kế hoạch cũ"""
+        merged = dict(self.travel_info)
+        merged.update({field: value for field, value in travel_info.items() if value is not None})
+        folded = fold_diacritics(user_input)
+        match = RELATIVE_PEOPLE_RE.search(folded)
+        if match and self.travel_info.get("number_of_people"):
+            sign = 1 if match.group(1) == "them" else -1
+            merged["number_of_people"] = max(1, int(self.travel_info["number_of_people"]) + sign * int(match.group(2)))
+        match = RELATIVE_DAYS_RE.search(folded)
+        days = parse_duration_days(self.travel_info.get("duration"))
+        if match and days:
+            sign = 1 if match.group(1) == "them" else -1
+            merged["duration"] = f"{max(1, days + sign * int(match.group(2)))} ngày"
+        return merged
+
+    def diff(self, travel_info: Dict[str, Any]) -> Dict[str, Tuple[Any, Any]]:
+        """Các ô thay đổi so với kế hoạch hiện tại: {field: (cũ, mới)}"""
+        return {
+            field: (self.travel_info.get(field), travel_info.get(field))
+            for field in TRAVEL_INFO_FIELDS
+            if _slot_value(field, travel_info.get(field)) != _slot_value(field, self.travel_info.get(field))
+        }
+
+class AgentMemory:
+    __slots__ = ("history", "travel_plans_cache", "user_info", "plan_session", "speculation")
+
+    def __init__(self, plan_cache=None):
+        # Lịch sử giới hạn theo token; các lượt cũ được gộp vào phần tóm tắt
+        self.history = TokenBudgetHistory(max_tokens=2000)
+        self.travel_plans_cache = plan_cache if plan_cache is not None else create_plan_cache()
         self.user_info = UserInfo()
+        self.plan_session = PlanSession()
+        # Thông tin của kế hoạch đang được tạo sẵn ở nền (xem TravelAgent.prefetch_plan)
+        self.speculation: Optional[Dict[str, Any]] = None
+
+    @property
+    def conversation_history(self) -> List[Dict[str, str]]:
+        return self.history.messages
 
     def add_to_history(self, role: str, content: str):
-        self.conversation_history.append({"role": role, "content": content})
+        self.history.add_message(role, content)
         self.user_info.last_interaction = content
 
     def get_recent_history(self, n: int = 5):
         return self.conversation_history[-n:]
 
     def cache_travel_plan(self, key: str, data: Dict[str, Any]):
-        self.travel_plans_cache[key] = data
+        self.travel_plans_cache.set(key, data)
 
     def get_cached_plan(self, key: str):
         return self.travel_plans_cache.get(key)
@@ -50,11 +233,87 @@ class AgentMemory:
         if name:
             self.user_info.name = name
 
+    def to_state(self) -> Dict[str, Any]:
+        """Dữ liệu thuần của phiên (không gồm cache kế hoạch dùng chung)
+
+        Kế hoạch còn nằm trong cache kế hoạch chỉ được lưu bằng khóa cache, không chép lại.
+        """
+        session = self.plan_session
+        plan, plan_key = session.plan, None
+        if plan is not None and session.travel_info:
+            key = plan_cache_key(session.travel_info)
+            if self.travel_plans_cache.get(key) == plan:
+                plan, plan_key = None, key
+        return {
+            "history": self.history.to_state(),
+            "user_info": self.user_info.to_state(),
+            "travel_info": session.travel_info,
+            "plan": plan,
+            "plan_key": plan_key,
+            "refinements": session.refinements,
+            "speculation": self.speculation,
+        }
+
+    @classmethod
+    def from_state(cls, state: Dict[str, Any], plan_cache=None) -> "AgentMemory":
+        memory = cls.__new__(cls)
+        memory.history = TokenBudgetHistory.from_state(state["history"])
+        memory.travel_plans_cache = plan_cache if plan_cache is not None else create_plan_cache()
+        memory.user_info = UserInfo.from_state(state["user_info"])
+        session = memory.plan_session = PlanSession()
+        session.travel_info = dict(state["travel_info"])
+        session.refinements = state["refinements"]
+        session.plan = state["plan"]
+        if state["plan_key"]:
+            # Dùng chung object trong cache; kế hoạch đã hết hạn thì lượt chỉnh sửa sau tạo lại từ đầu
+            session.plan = memory.travel_plans_cache.get(state["plan_key"])
+            record_cache("session_plan", session.plan is not None)
+        speculation = state.get("speculation")
+        memory.speculation = dict(speculation) if speculation else None
+        return memory
+
+def plan_prompt(travel_info: Dict[str, Any]) -> str:
+    """Câu yêu cầu tạo kế hoạch, chỉ nêu các thông tin khách đã cho"""
+    prompt = f"Tạo kế hoạch du lịch cho {travel_info.get('destination')}"
+    duration = travel_info.get('duration')
+    if duration:
+        duration = str(duration).strip()
+        prompt += f" trong {duration} ngày" if duration.isdigit() else f" trong {duration}"
+    if travel_info.get('number_of_people'):
+        prompt += f" cho {travel_info['number_of_people']} người"
+    if travel_info.get('budget'):
+        prompt += f" với ngân sách {travel_info['budget']}"
+    return prompt
+
 class TravelAgent:
-    def __init__(self):
-        self.client = OpenAI()
-        self.memory = AgentMemory()
-        self.schema = TravelPlan.model_json_schema()
+    def __init__(self, client: "OpenAI" = None, plan_cache=None, price_cache=None, price_executor: ThreadPoolExecutor = None, max_price_workers: int = 8, price_timeout: float = 15.0, pricing_mode: str = "per_item", prefetcher: Prefetcher = None, price_inflight: SingleFlight = None, plan_inflight: SingleFlight = None):
+        if pricing_mode not in ("per_item", "batch"):
+            raise ValueError(f"pricing_mode không hợp lệ: {pricing_mode}")
+
+        # None: dùng client chung, chỉ tạo ở lần gọi API đầu tiên
+        self._client = client
+        self.memory = AgentMemory(plan_cache)
+        # Schema tính sẵn, dùng chung cho mọi agent (xem schemas.py)
+        self.schema = json_schema("TravelPlan")
+        self.prices_schema = json_schema("TravelPlanPrices")
+        self.analysis_schema = json_schema("UserInputAnalysis")
+
+        # "per_item": mỗi mục một lần gọi, "batch": một lần gọi cho cả kế hoạch
+        self.pricing_mode = pricing_mode
+
+        # Tra giá song song: giới hạn số luồng và thời gian chờ cho mỗi lần gọi
+        self.max_price_workers = max_price_workers
+        self.price_timeout = price_timeout
+        self.price_executor = price_executor or ThreadPoolExecutor(max_workers=max_price_workers, thread_name_prefix="price")
+
+        # Cache giá theo tên mục, các lần tra trùng nhau đang chạy dùng chung một lần gọi;
+        # truyền cùng price_inflight/plan_inflight cho mọi agent để gộp cả giữa các phiên
+        self.price_cache = price_cache if price_cache is not None else create_price_cache()
+        self.price_inflight = price_inflight if price_inflight is not None else SingleFlight()
+
+        # Tạo sẵn kế hoạch ở nền sau câu hỏi về một điểm đến (thông tin đã đoán nằm trong memory)
+        self.prefetcher = prefetcher if prefetcher is not None else get_prefetcher()
+        self.plan_inflight = plan_inflight if plan_inflight is not None else SingleFlight()
         
         self.tools = [
             {
@@ -63,96 +322,279 @@ class TravelAgent:
             }
         ]
 
-    def extract_travel_info(self, text: str) -> Dict[str, Any]:
-        """Trích xuất thông tin du lịch từ câu hỏi"""
+    @property
+    def client(self) -> "OpenAI":
+        return self._client or get_client()
+
+    @client.setter
+    def client(self, client: "OpenAI"):
+        self._client = client
+
+    @traced()
+    def classify_and_extract(self, text: str) -> Dict[str, Any]:
+        """Phân loại câu hỏi và trích xuất thông tin du lịch trong một lần gọi"""
+        analysis = pre_classify(text)
+        if analysis is not None:
+            return analysis
+
         try:
-            response = self.client.chat.completions.create(
-                model="gpt-3.5-turbo",
+            # Bước phân loại nằm trên đường găng của mọi lượt: gửi bản sao nếu phản hồi chậm
+            response = request(
+                "chat.completions", self.client.chat.completions.create,
+                priority=INTERACTIVE, hedge=True,
+                model="gpt-4o-mini",
                 messages=[
-                    {"role": "system", "content": "Extract travel information from the text. Return a JSON with fields: 'destination', 'duration', 'number_of_people', 'budget'"},
+                    {"role": "system", "content": "Analyze the user input of a travel assistant. Return 'type' (planning/inquiry/general), 'intent' (what they want to know), 'sentiment' (positive/negative/neutral) and the travel information mentioned: 'destination', 'duration', 'number_of_people', 'budget' (null when not mentioned)."},
                     {"role": "user", "content": text}
-                ]
+                ],
+                response_format={
+                    "type": "json_schema",
+                    "json_schema": {
+                        "name": "user_input_analysis",
+                        "schema": self.analysis_schema,
+                        "strict": True
+                    }
+                }
             )
-            return json.loads(response.choices[0].message.content)
+            from models import UserInputAnalysis
+            return UserInputAnalysis.model_validate_json(response.choices[0].message.content).model_dump()
         except Exception as e:
-            return {}
+            record_error("classify_and_extract", e)
+            analysis = dict(DEFAULT_ANALYSIS)
+            analysis.update(dict.fromkeys(TRAVEL_INFO_FIELDS))
+            return analysis
+
+    def extract_travel_info(self, text: str) -> Dict[str, Any]:
+        """Trích xuất thông tin du lịch từ câu hỏi"""
+        result = self.classify_and_extract(text)
+        return {field: result[field] for field in TRAVEL_INFO_FIELDS if result.get(field) is not None}
 
     def analyze_user_input(self, text: str) -> Dict[str, Any]:
         """Phân tích input của người dùng"""
-        try:
-            response = self.client.chat.completions.create(
-                model="gpt-3.5-turbo",
-                messages=[
-                    {"role": "system", "content": "Analyze the user input and return a JSON with fields: 'type' (planning/inquiry/general), 'intent' (what they want to know), 'sentiment' (positive/negative/neutral)"},
-                    {"role": "user", "content": text}
-                ]
-            )
-            return json.loads(response.choices[0].message.content)
-        except Exception as e:
-            return {"type": "general", "intent": "unknown", "sentiment": "neutral"}
+        result = self.classify_and_extract(text)
+        return {field: result[field] for field in ANALYSIS_FIELDS}
 
     def plan_response(self, user_input: str) -> str:
         """Lập kế hoạch phản hồi"""
-        # Phân tích input
-        analysis = self.analyze_user_input(user_input)
-        travel_info = self.extract_travel_info(user_input)
+        return "".join(self.iter_response(user_input))
+
+    def iter_response(self, user_input: str) -> Iterator[str]:
+        """Lập kế hoạch phản hồi, trả ra từng phần ngay khi có"""
+        # Phân tích input và trích xuất thông tin trong cùng một lần gọi
+        result = self.classify_and_extract(user_input)
+        analysis = {field: result[field] for field in ANALYSIS_FIELDS}
+        travel_info = {field: result[field] for field in TRAVEL_INFO_FIELDS if result.get(field) is not None}
         
+        session = self.memory.plan_session
+        # Chỉnh sửa kế hoạch vừa tạo: chỉ tạo lại các phần bị ảnh hưởng
+        # (chỉ khi câu thật sự đổi ít nhất một thông tin của kế hoạch)
+        if session.is_refinement(user_input, travel_info):
+            merged = session.merge(user_input, travel_info)
+            changes = session.diff(merged)
+            if changes:
+                travel_plan = self.refine_travel_plan(merged, changes)
+                if travel_plan:
+                    session.update(merged, travel_plan)
+                yield from self.iter_travel_plan_response(travel_plan, analysis)
+                return
+
         # Xử lý theo loại câu hỏi
         if analysis["type"] == "planning":
+            self.settle_speculation(travel_info)
             if travel_info.get('destination'):
                 travel_plan = self.get_travel_plan(travel_info)
-                return self.create_travel_plan_response(travel_plan, analysis)
-            return "Bạn muốn đi du lịch ở đâu vậy?"
+                if travel_plan:
+                    session.update(travel_info, travel_plan)
+                yield from self.iter_travel_plan_response(travel_plan, analysis)
+                return
+            yield "Bạn muốn đi du lịch ở đâu vậy?"
         elif analysis["type"] == "inquiry":
-            return self.create_inquiry_response(travel_info, analysis)
+            yield self.create_inquiry_response(travel_info, analysis)
         else:
-            return self.create_general_response(user_input, analysis)
+            yield self.create_general_response(user_input, analysis)
+
+    def plan_request(self, travel_info: Dict[str, Any]) -> Dict[str, Any]:
+        """Tham số responses.create để tạo kế hoạch (dùng chung cho gọi trực tiếp và Batch API)"""
+        input_messages = [
+            {
+                "role": "user",
+                "content": [
+                    {
+                        "type": "input_text",
+                        "text": plan_prompt(travel_info)
+                    },
+                ]
+            }
+        ]
+        return {
+            "model": "gpt-4o-mini",
+            "instructions": "Create a detailed travel plan using web search results. Include activities, accommodations, transportation, and cost estimates.",
+            "input": input_messages,
+            "tools": self.tools,
+            "text": {
+                "format": {
+                    "type": "json_schema",
+                    "name": "travel_plan",
+                    "schema": self.schema,
+                    "strict": True
+                }
+            }
+        }
 
-    def get_travel_plan(self, travel_info: Dict[str, Any]) -> Dict[str, Any]:
+    @traced()
+    def get_travel_plan(self, travel_info: Dict[str, Any], priority: int = INTERACTIVE) -> Dict[str, Any]:
         """Lấy thông tin kế hoạch du lịch"""
-        cache_key = f"{travel_info.get('destination')}_{travel_info.get('duration')}_{travel_info.get('number_of_people')}"
+        cache_key = plan_cache_key(travel_info)
         cached_plan = self.memory.get_cached_plan(cache_key)
+        record_cache("travel_plan", bool(cached_plan))
         if cached_plan:
+            if priority != SPECULATIVE:
+                self.prefetcher.claim(cache_key)
             return cached_plan
-        
-        try:
-            input_messages = [
-                {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "input_text",
-                            "text": f"Tạo kế hoạch du lịch cho {travel_info.get('destination')} trong {travel_info.get('duration')} ngày cho {travel_info.get('number_of_people')} người với ngân sách {travel_info.get('budget')}"
-                        },
-                    ]
-                }
-            ]
 
-            response = self.client.responses.create(
-                model="gpt-4o-mini",
-                instructions="Create a detailed travel plan using web search results. Include activities, accommodations, transportation, and cost estimates.",
-                input=input_messages,
-                tools=self.tools,
-                text={
-                    "format": {
-                        "type": "json_schema",
-                        "name": "travel_plan",
-                        "schema": self.schema,
-                        "strict": True
-                    }
-                }
-            )
+        # Kế hoạch đang được đoán trước cho đúng thông tin này: nâng request của nó lên mức ưu
+        # tiên của lượt chat và chờ chung kết quả thay vì trả tiền gọi lần hai. Việc đoán trước
+        # chưa kịp chạy thì claim bỏ nó, lượt chat tự gọi.
+        joined = priority != SPECULATIVE and self.prefetcher.claim(cache_key)
+        if joined:
+            get_scheduler().promote(f"plan|{cache_key}", priority)
+        travel_plan = self.plan_inflight.do(cache_key, lambda: self._fetch_travel_plan(cache_key, travel_info, priority))
+        if travel_plan is None and joined:
+            # Lần gọi đoán trước lỗi: lượt chat tự gọi lại
+            travel_plan = self._fetch_travel_plan(cache_key, travel_info, priority)
+        return travel_plan
+
+    def _fetch_travel_plan(self, cache_key: str, travel_info: Dict[str, Any], priority: int) -> Optional[Dict[str, Any]]:
+        try:
+            # tag: lượt chat chờ chung kết quả có thể nâng mức ưu tiên của request này
+            response = request("responses", self.client.responses.create, priority=priority,
+                               tag=f"plan|{cache_key}", **self.plan_request(travel_info))
 
             travel_plan = json.loads(response.output_text)
             self.memory.cache_travel_plan(cache_key, travel_plan)
             return travel_plan
         except Exception as e:
+            record_error("get_travel_plan", e)
             return None
 
+    def prefetch_plan(self, travel_info: Dict[str, Any]) -> bool:
+        """Tạo sẵn ở nền kế hoạch và giá cho lượt lập kế hoạch nhiều khả năng sẽ tới
+
+        Chỉ dùng đúng thông tin khách đã nói, không tự đoán các ô còn thiếu, và chỉ khi đã đủ
+        PREFETCH_FIELDS: thiếu thì lượt lập kế hoạch gần như chắc chắn có khóa khác, kế hoạch
+        tạo sẵn sẽ không được dùng. Việc đoán trước cũ của phiên (thông tin khác) bị hủy.
+        """
+        info = dict(travel_info)
+        key = plan_cache_key(info)
+        speculation = self.memory.speculation
+        if speculation is not None and plan_cache_key(speculation) != key:
+            self.prefetcher.cancel(plan_cache_key(speculation))
+            self.memory.speculation = None
+        if not all(info.get(field) for field in PREFETCH_FIELDS):
+            return False
+        self.memory.speculation = info
+        return self.prefetcher.submit(
+            key,
+            lambda: self.get_travel_plan(info, priority=SPECULATIVE),
+            lambda: self._prefetch_prices(key),
+        )
+
+    def _prefetch_prices(self, cache_key: str):
+        plan = self.memory.travel_plans_cache.get(cache_key)
+        if not plan:
+            return
+        items = (plan.get("activities", []), plan.get("accommodations", []), plan.get("transportation", []))
+        if self.pricing_mode == "batch":
+            self.get_plan_prices(*items, priority=SPECULATIVE)
+            return
+        # Tra lần lượt ngay trong luồng của prefetcher, không chiếm price_executor của lượt chat
+        for lookup, item in self.price_lookups(*items):
+            lookup(item, priority=SPECULATIVE)
+
+    def settle_speculation(self, travel_info: Dict[str, Any]):
+        """Kết thúc lần đoán trước của phiên khi tới lượt lập kế hoạch
+
+        Kế hoạch tạo sẵn chỉ được dùng (qua cache) khi thông tin của lượt này trùng khớp với
+        thông tin đã đoán; không khớp thì hủy việc đoán trước.
+        """
+        speculation, self.memory.speculation = self.memory.speculation, None
+        if speculation is None:
+            return
+        key = plan_cache_key(speculation)
+        if plan_cache_key(travel_info) != key:
+            self.prefetcher.cancel(key)
+
+    def refine_request(self, plan: Dict[str, Any], changes: Dict[str, Tuple[Any, Any]],
+                       sections: List[str]) -> Dict[str, Any]:
+        """Tham số responses.create để sửa các mục sections của plan (không dùng web search)"""
+        properties = self.schema["properties"]
+        return {
+            "model": "gpt-4o-mini",
+            "instructions": "Update an existing travel plan after the traveller changed some details. Rewrite only the requested sections so they fit the new details; keep items that still fit unchanged and in the same wording.",
+            "input": json.dumps({
+                "plan": plan,
+                "changes": {field: {"old": old, "new": new} for field, (old, new) in changes.items()},
+                "sections": sections,
+            }, ensure_ascii=False),
+            "text": {
+                "format": {
+                    "type": "json_schema",
+                    "name": "travel_plan_update",
+                    "schema": {
+                        "type": "object",
+                        "properties": {section: properties[section] for section in sections},
+                        "required": sections,
+                        "additionalProperties": False,
+                    },
+                    "strict": True
+                }
+            }
+        }
+
+    @traced()
+    def refine_travel_plan(self, travel_info: Dict[str, Any], changes: Dict[str, Tuple[Any, Any]]) -> Dict[str, Any]:
+        """Kế hoạch cho travel_info dựa trên kế hoạch hiện tại của phiên, chỉ tạo lại phần thay đổi"""
+        base = self.memory.plan_session.plan
+        if not changes:
+            return base
+        cache_key = plan_cache_key(travel_info)
+        cached_plan = self.memory.get_cached_plan(cache_key)
+        record_cache("travel_plan", bool(cached_plan))
+        if cached_plan:
+            return cached_plan
+        if "destination" in changes or base is None:
+            return self.get_travel_plan(travel_info)
+
+        sections = affected_sections(changes)
+        try:
+            response = request("responses", self.client.responses.create, priority=INTERACTIVE,
+                               **self.refine_request(base, changes, sections))
+            updated = json.loads(response.output_text)
+            plan = dict(base)
+            for field in ("duration", "number_of_people", "budget"):
+                if field in changes and travel_info.get(field) is not None:
+                    plan[field] = travel_info[field] if field == "number_of_people" else str(travel_info[field])
+            plan.update({section: updated[section] for section in sections})
+            from models import TravelPlan
+            travel_plan = TravelPlan.model_validate(plan).model_dump()
+        except Exception as e:
+            record_error("refine_travel_plan", e)
+            return self.get_travel_plan(travel_info)
+
+        self.memory.plan_session.refinements += 1
+        self.memory.cache_travel_plan(cache_key, travel_plan)
+        return travel_plan
+
     def create_travel_plan_response(self, travel_plan: Dict[str, Any], analysis: Dict[str, Any]) -> str:
         """Tạo câu trả lời với kế hoạch du lịch"""
+        return "".join(self.iter_travel_plan_response(travel_plan, analysis))
+
+    @traced("travel_plan_response")
+    def iter_travel_plan_response(self, travel_plan: Dict[str, Any], analysis: Dict[str, Any]) -> Iterator[str]:
+        """Tạo câu trả lời với kế hoạch du lịch, trả ra từng dòng giá ngay khi tra xong"""
         if not travel_plan:
-            return "Xin lỗi, tôi không thể tạo kế hoạch du lịch lúc này."
+            yield "Xin lỗi, tôi không thể tạo kế hoạch du lịch lúc này."
+            return
 
         destination = travel_plan.get('destination', '')
         duration = travel_plan.get('duration', '')
@@ -163,31 +605,30 @@ class TravelAgent:
         transportation = travel_plan.get('transportation', [])
         estimated_cost = travel_plan.get('estimated_cost', '')
 
+        # Gửi toàn bộ yêu cầu tra giá trước, sau đó trả kết quả theo thứ tự; khách đang chờ
+        # các giá này nên chúng không chạy ở mức BACKGROUND (bị từ chối đầu tiên khi quá tải)
+        prices = self.iter_plan_prices(activities, accommodations, transportation, NORMAL)
+
         # Tạo câu trả lời
         response = f"Kế hoạch du lịch cho {destination}:\n\n"
         response += f"Thời gian: {duration}\n"
         response += f"Số người: {number_of_people}\n"
         response += f"Ngân sách: {budget}\n\n"
-        
-        response += "Các hoạt động đề xuất và giá:\n"
+        yield response
+
+        yield "Các hoạt động đề xuất và giá:\n"
         for i, activity in enumerate(activities, 1):
-            # Thêm giá cho mỗi hoạt động
-            activity_price = self.get_activity_price(activity)
-            response += f"{i}. {activity} - Giá: {activity_price}\n"
-        
-        response += "\nChỗ ở đề xuất và giá:\n"
+            yield f"{i}. {activity} - Giá: {next(prices)}\n"
+
+        yield "\nChỗ ở đề xuất và giá:\n"
         for i, accommodation in enumerate(accommodations, 1):
-            # Thêm giá cho mỗi chỗ ở
-            accommodation_price = self.get_accommodation_price(accommodation)
-            response += f"{i}. {accommodation} - Giá: {accommodation_price}\n"
-        
-        response += "\nPhương tiện di chuyển và giá:\n"
+            yield f"{i}. {accommodation} - Giá: {next(prices)}\n"
+
+        yield "\nPhương tiện di chuyển và giá:\n"
         for i, transport in enumerate(transportation, 1):
-            # Thêm giá cho mỗi phương tiện
-            transport_price = self.get_transport_price(transport)
-            response += f"{i}. {transport} - Giá: {transport_price}\n"
-        
-        response += f"\nChi phí ước tính tổng cộng: {estimated_cost}\n"
+            yield f"{i}. {transport} - Giá: {next(prices)}\n"
+
+        response = f"\nChi phí ước tính tổng cộng: {estimated_cost}\n"
         
         # Thêm lời khuyên
         response += "\nLời khuyên:\n"
@@ -196,13 +637,147 @@ class TravelAgent:
         response += "- Kiểm tra thời tiết trước khi đi\n"
         response += "- Chuẩn bị sẵn bản đồ và thông tin liên hệ khẩn cấp\n"
         response += "- Có thể thương lượng giá với các nhà cung cấp dịch vụ"
+        yield response
+
+    def iter_plan_prices(self, activities: List[str], accommodations: List[str], transportation: List[str],
+                         priority: int = NORMAL) -> Iterator[str]:
+        """Giá của các mục theo thứ tự hoạt động, chỗ ở, phương tiện"""
+        if self.pricing_mode == "batch":
+            return iter([price for prices in self.get_plan_prices(activities, accommodations, transportation, priority) for price in prices])
+
+        # Tra giá cho tất cả các mục cùng lúc thay vì lần lượt từng mục
+        return self.iter_prices(self.price_lookups(activities, accommodations, transportation), priority)
+
+    def price_lookups(self, activities: List[str], accommodations: List[str], transportation: List[str]) -> List[Tuple[Callable[..., str], str]]:
+        """Hàm tra giá và tên mục cho từng mục của kế hoạch, theo thứ tự hoạt động, chỗ ở, phương tiện"""
+        lookups = [(self.get_activity_price, item) for item in activities]
+        lookups += [(self.get_accommodation_price, item) for item in accommodations]
+        lookups += [(self.get_transport_price, item) for item in transportation]
+        return lookups
+
+    def get_plan_prices(self, activities: List[str], accommodations: List[str], transportation: List[str],
+                        priority: int = NORMAL) -> Tuple[List[str], List[str], List[str]]:
+        """Lấy giá cho toàn bộ kế hoạch trong một lần gọi"""
+        items = {
+            "activities": activities,
+            "accommodations": accommodations,
+            "transportation": transportation,
+        }
+        categories = {"activities": "activity", "accommodations": "accommodation", "transportation": "transport"}
+
+        # Chỉ hỏi model các mục chưa có trong cache giá
+        cached = {
+            section: [self.price_cache.get(price_cache_key(categories[section], name)) for name in names]
+            for section, names in items.items()
+        }
+        for prices in cached.values():
+            for price in prices:
+                record_cache("price", price is not None)
+        missing = {
+            section: [name for name, price in zip(names, cached[section]) if price is None]
+            for section, names in items.items()
+        }
+
+        priced = {}
+        if any(missing.values()):
+            try:
+                response = request(
+                    "responses", self.client.responses.create,
+                    priority=priority, deadline=self.price_timeout,
+                    model="gpt-4o-mini",
+                    instructions="Return the estimated price in VND format for every item. Activities and transportation are priced per person, accommodations per night. Keep the item text unchanged and the same order as the input.",
+                    input=json.dumps(missing, ensure_ascii=False),
+                    text={
+                        "format": {
+                            "type": "json_schema",
+                            "name": "travel_plan_prices",
+                            "schema": self.prices_schema,
+                            "strict": True
+                        }
+                    }
+                )
+                priced = json.loads(response.output_text)
+            except Exception as e:
+                record_error("get_plan_prices", e)
+                priced = {}
+
+        results = []
+        for section, names in items.items():
+            fetched = iter(self._match_prices(missing[section], priced.get(section, [])))
+            prices = []
+            for name, price in zip(names, cached[section]):
+                if price is None:
+                    price = next(fetched)
+                    if price != PRICE_FALLBACK:
+                        self.price_cache.set(price_cache_key(categories[section], name), price)
+                prices.append(price)
+            results.append(prices)
+        return tuple(results)
+
+    @staticmethod
+    def _match_prices(names: List[str], priced: List[Dict[str, str]]) -> List[str]:
+        """Ghép giá trả về với từng mục, ưu tiên theo tên rồi đến vị trí"""
+        by_name = {entry.get("item"): entry.get("price") for entry in priced}
+        prices = []
+        for i, name in enumerate(names):
+            price = by_name.get(name)
+            if not price and i < len(priced):
+                price = priced[i].get("price")
+            prices.append(price or PRICE_FALLBACK)
+        return prices
+
+    def iter_prices(self, lookups: List[Tuple[Callable[..., str], str]], priority: int = NORMAL) -> Iterator[str]:
+        """Gửi ngay toàn bộ yêu cầu tra giá, trả từng giá theo thứ tự khi có kết quả"""
+        if not lookups:
+            return iter(())
+
+        # bind: lần tra giá ở thread khác vẫn nằm dưới span của lượt hiện tại
+        futures = [self.price_executor.submit(bind(lookup), item, priority) for lookup, item in lookups]
+
+        # Các mục vượt quá số luồng phải xếp hàng nên hạn chót tính theo số đợt
+        rounds = math.ceil(len(futures) / self.max_price_workers)
+        deadline = time.monotonic() + self.price_timeout * rounds
+
+        def collect():
+            for future in futures:
+                try:
+                    yield future.result(timeout=max(0.0, deadline - time.monotonic()))
+                except Exception as e:
+                    record_error("price_lookup", e)
+                    future.cancel()
+                    yield PRICE_FALLBACK
+        return collect()
+
+    def _cached_price(self, category: str, item: str, fetch: Callable[..., str], priority: int = NORMAL) -> str:
+        """Tra giá qua cache; các lần tra trùng đang chạy đồng thời chỉ gọi API một lần"""
+        key = price_cache_key(category, item)
+        price = self.price_cache.get(key)
+        record_cache("price", price is not None)
+        if price is not None:
+            return price
 
-        return response
+        def fetch_and_store():
+            price = fetch(item, priority)
+            if price != PRICE_FALLBACK:
+                self.price_cache.set(key, price)
+            return price
 
-    def get_activity_price(self, activity: str) -> str:
+        if priority == SPECULATIVE:
+            # Không vào price_inflight: lượt chat tra trùng mục này không phải chờ việc đoán trước
+            return fetch_and_store()
+        return self.price_inflight.do(key, fetch_and_store)
+
+    def get_activity_price(self, activity: str, priority: int = NORMAL) -> str:
         """Lấy giá cho hoạt động"""
+        return self._cached_price("activity", activity, self._fetch_activity_price, priority)
+
+    @traced("fetch_activity_price")
+    def _fetch_activity_price(self, activity: str, priority: int = NORMAL) -> str:
+        """Hỏi model giá cho hoạt động"""
         try:
-            response = self.client.chat.completions.create(
+            response = request(
+                "chat.completions", self.client.chat.completions.create,
+                priority=priority, deadline=self.price_timeout,
                 model="gpt-3.5-turbo",
                 messages=[
                     {"role": "system", "content": "Return the estimated price for the activity in VND format"},
@@ -210,13 +785,21 @@ class TravelAgent:
                 ]
             )
             return response.choices[0].message.content
-        except:
-            return "Liên hệ để biết giá"
+        except Exception as e:
+            record_error("fetch_activity_price", e)
+            return PRICE_FALLBACK
 
-    def get_accommodation_price(self, accommodation: str) -> str:
+    def get_accommodation_price(self, accommodation: str, priority: int = NORMAL) -> str:
         """Lấy giá cho chỗ ở"""
+        return self._cached_price("accommodation", accommodation, self._fetch_accommodation_price, priority)
+
+    @traced("fetch_accommodation_price")
+    def _fetch_accommodation_price(self, accommodation: str, priority: int = NORMAL) -> str:
+        """Hỏi model giá cho chỗ ở"""
         try:
-            response = self.client.chat.completions.create(
+            response = request(
+                "chat.completions", self.client.chat.completions.create,
+                priority=priority, deadline=self.price_timeout,
                 model="gpt-3.5-turbo",
                 messages=[
                     {"role": "system", "content": "Return the estimated price for the accommodation in VND format per night"},
@@ -224,13 +807,21 @@ class TravelAgent:
                 ]
             )
             return response.choices[0].message.content
-        except:
-            return "Liên hệ để biết giá"
+        except Exception as e:
+            record_error("fetch_accommodation_price", e)
+            return PRICE_FALLBACK
 
-    def get_transport_price(self, transport: str) -> str:
+    def get_transport_price(self, transport: str, priority: int = NORMAL) -> str:
         """Lấy giá cho phương tiện di chuyển"""
+        return self._cached_price("transport", transport, self._fetch_transport_price, priority)
+
+    @traced("fetch_transport_price")
+    def _fetch_transport_price(self, transport: str, priority: int = NORMAL) -> str:
+        """Hỏi model giá cho phương tiện di chuyển"""
         try:
-            response = self.client.chat.completions.create(
+            response = request(
+                "chat.completions", self.client.chat.completions.create,
+                priority=priority, deadline=self.price_timeout,
                 model="gpt-3.5-turbo",
                 messages=[
                     {"role": "system", "content": "Return the estimated price for the transportation in VND format"},
@@ -238,13 +829,16 @@ class TravelAgent:
                 ]
             )
             return response.choices[0].message.content
-        except:
-            return "Liên hệ để biết giá"
+        except Exception as e:
+            record_error("fetch_transport_price", e)
+            return PRICE_FALLBACK
 
     def create_inquiry_response(self, travel_info: Dict[str, Any], analysis: Dict[str, Any]) -> str:
         """Tạo câu trả lời cho câu hỏi thông tin"""
         destination = travel_info.get('destination', '')
         if destination:
+            # Khách hỏi về một điểm đến thường hỏi tiếp kế hoạch: tạo sẵn ở nền
+            self.prefetch_plan(travel_info)
             return f"Tôi sẽ tìm kiếm thông tin về {destination} cho bạn. Bạn muốn biết thông tin gì cụ thể không? Ví dụ: địa điểm tham quan, khách sạn, nhà hàng, v.v."
         return "Bạn muốn tìm hiểu thông tin về địa điểm nào vậy?"
 
@@ -254,12 +848,24 @@ class TravelAgent:
 
     def process_user_input(self, user_input: str) -> str:
         """Xử lý input của người dùng"""
-        self.memory.add_to_history("user", user_input)
-        response = self.plan_response(user_input)
-        self.memory.add_to_history("assistant", response)
-        return response
+        with span("travel.turn"):
+            self.memory.add_to_history("user", user_input)
+            response = self.plan_response(user_input)
+            self.memory.add_to_history("assistant", response)
+            return response
+
+    def stream_user_input(self, user_input: str, on_delta: DeltaCallback = None) -> Iterator[str]:
+        """Xử lý input của người dùng, trả ra từng phần câu trả lời ngay khi có"""
+        with span("travel.turn", stream=True):
+            self.memory.add_to_history("user", user_input)
+            parts = []
+            for chunk in emit(self.iter_response(user_input), on_delta):
+                parts.append(chunk)
+                yield chunk
+            self.memory.add_to_history("assistant", "".join(parts))
 
 def main():
+    load_env()
     agent = TravelAgent()
     print("Xin chào! Tôi là AI Agent lên kế hoạch du lịch. Tôi có thể:")
     print("1. Lên kế hoạch du lịch chi tiết")
@@ -279,8 +885,7 @@ def main():
             print("Tạm biệt! Chúc bạn có những chuyến du lịch thú vị!")
             break
             
-        response = agent.process_user_input(user_input)
-        print("\nAI:", response)
+        print_stream(agent.stream_user_input(user_input))
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
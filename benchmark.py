@@ -0,0 +1,433 @@
+"""Benchmark các bot với client OpenAI giả lập (không gọi API thật)
+
+Ví dụ:
+    python benchmark.py pricing
+    python benchmark.py pricing --latency 0.8 --items 6
+    python benchmark.py load --concurrency 8 --sessions 32 --output base.json
+    python benchmark.py load --http --latency lognormal:0.6,0.4 --error-rate 0.02 --output new.json
+    python benchmark.py compare base.json new.json --threshold 0.1
+    python benchmark.py importtime --budget-ms 150
+
+load chạy các hội thoại mẫu (DEFAULT_CORPUS hoặc --corpus file.json cùng cấu trúc) qua
+TravelAgent.process_user_input, get_menu_response/process_order và StockAnalysis.analyze_stock;
+--http chạy qua MockServer với client OpenAI thật (gồm connection pool, retry của SDK).
+
+importtime đo thời gian import từng module bot bằng python -X importtime (trung vị nhiều
+lần chạy) và báo lỗi khi vượt ngân sách hoặc khi openai/pydantic/numpy... bị nạp ngay lúc import.
+"""
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+from mock_openai import MockOpenAI, MockServer, last_user_text
+from vntext import fold_diacritics
+
+# Mỗi bot: danh sách hội thoại, mỗi hội thoại là danh sách lượt của người dùng
+DEFAULT_CORPUS = {
+    "travel": [
+        ["Xin chào", "Tôi muốn đi du lịch Đà Lạt 3 ngày 2 đêm cho 2 người với ngân sách 5 triệu", "Cảm ơn bạn"],
+        ["Có gì thú vị ở Phú Quốc không?", "Kế hoạch du lịch Phú Quốc 4 ngày 3 đêm cho gia đình 4 người"],
+        ["Kế hoạch du lịch Hạ Long 2 ngày 1 đêm cho 3 người, ngân sách 6 triệu", "Ở Hạ Long ăn gì ngon?"],
+    ],
+    "menu": [
+        ["Cho mình xem menu", "Trà sữa trân châu giá bao nhiêu?", "Cho mình 2 trà sữa trân châu",
+         "Xác nhận đơn, có"],
+        ["Trà đào cam sả là gì?", "Lấy 1 trà đào cam sả ít đá", "Thôi hủy đơn nhé"],
+        ["Có những topping nào?", "Món nào ít ngọt mà dễ uống?", "Cho 1 trà sữa matcha thêm thạch phô mai"],
+    ],
+    "stock": [
+        ["Mức độ rủi ro của cổ phiếu này như thế nào?", "RSI hiện tại thế nào?"],
+        ["Dòng tiền từ hoạt động kinh doanh có ổn định không?", "Cổ phiếu này rủi ro ra sao?"],
+        ["Giá trị giao dịch khớp lệnh trung bình hàng ngày là bao nhiêu?", "Giá có được định giá cao hơn ngành?"],
+    ],
+}
+
+DESTINATIONS = ("Đà Lạt", "Phú Quốc", "Hạ Long", "Nha Trang", "Hội An", "Sa Pa")
+
+
+def price_plan_handler(request: Dict[str, Any]) -> Dict[str, Any]:
+    """Trả lời request tra giá gộp: giữ nguyên tên mục và gán giá giả lập"""
+    items = json.loads(request["input"])
+    return {
+        section: [{"item": name, "price": "500.000 VND"} for name in names]
+        for section, names in items.items()
+    }
+
+
+def travel_analysis_handler(request: Dict[str, Any]) -> Dict[str, Any]:
+    """Phân loại câu hỏi du lịch theo từ khóa, thay cho model gpt-4o-mini"""
+    text = last_user_text(request["messages"])
+    folded = fold_diacritics(text)
+    destination = next((d for d in DESTINATIONS if fold_diacritics(d) in folded), None)
+    duration = re.search(r"\d+ ngày( \d+ đêm)?", text)
+    people = re.search(r"(\d+) người", text)
+    budget = re.search(r"\d+ triệu", text)
+    if re.search(r"ke hoach|lich trinh|muon di|du lich .* ngay", folded):
+        kind = "planning"
+    elif destination:
+        kind = "inquiry"
+    else:
+        kind = "general"
+    return {
+        "type": kind,
+        "intent": "benchmark",
+        "sentiment": "neutral",
+        "destination": destination,
+        "duration": duration.group(0) if duration else None,
+        "number_of_people": int(people.group(1)) if people else None,
+        "budget": budget.group(0) if budget else None,
+    }
+
+
+def make_order_handler() -> Callable[[Dict[str, Any]], Optional[Dict[str, Any]]]:
+    """Trả về arguments cho update_order theo món được nhắc trong câu của khách"""
+    from menu_index import get_menu_index
+
+    def handler(request: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        text = last_user_text(request["input"])
+        folded = fold_diacritics(text)
+        delta = {"action": "none", "add": [], "remove": [], "special_requests": None}
+        if "xac nhan" in folded:
+            delta["action"] = "confirm"
+        elif "huy" in folded:
+            delta["action"] = "cancel"
+        elif re.search(r"\b(cho|lay|dat)\b", folded):
+            item = get_menu_index().find_item(text)
+            if item is None:
+                return None
+            quantity = re.search(r"\b(\d+)\b", text)
+            delta["action"] = "update"
+            delta["add"] = [{"name": item.name, "quantity": int(quantity.group(1)) if quantity else 1, "toppings": []}]
+        else:
+            return None
+        return delta
+
+    return handler
+
+
+def sample_plan(items: int) -> Dict[str, Any]:
+    return {
+        "destination": "Đà Lạt",
+        "duration": "3 ngày 2 đêm",
+        "number_of_people": 2,
+        "budget": "5 triệu",
+        "activities": [f"Hoạt động {i}" for i in range(1, items + 1)],
+        "accommodations": [f"Khách sạn {i}" for i in range(1, items // 2 + 2)],
+        "transportation": [f"Phương tiện {i}" for i in range(1, items // 2 + 2)],
+        "estimated_cost": "5.000.000 VND",
+    }
+
+
+def bench_pricing(args):
+    from apiresponse import TravelAgent
+
+    plan = sample_plan(args.items)
+    results = {}
+    for mode in ("per_item", "batch"):
+        client = MockOpenAI(latency=args.latency, jitter=args.jitter, handlers={"travel_plan_prices": price_plan_handler})
+        timings = []
+        for _ in range(args.runs):
+            # Mỗi lần chạy một agent mới để cache giá luôn nguội
+            agent = TravelAgent(client=client, pricing_mode=mode, max_price_workers=args.workers)
+            start = time.perf_counter()
+            agent.create_travel_plan_response(plan, {})
+            timings.append(time.perf_counter() - start)
+
+        stats = client.stats.snapshot()
+        results[mode] = {
+            "requests_per_plan": stats["requests"] / args.runs,
+            "tokens_per_plan": stats["total_tokens"] / args.runs,
+            "mean_latency_s": sum(timings) / len(timings),
+            "max_latency_s": max(timings),
+        }
+
+    print(f"{'mode':<10}{'requests':>10}{'tokens':>10}{'mean(s)':>10}{'max(s)':>10}")
+    for mode, row in results.items():
+        print(f"{mode:<10}{row['requests_per_plan']:>10.1f}{row['tokens_per_plan']:>10.0f}"
+              f"{row['mean_latency_s']:>10.3f}{row['max_latency_s']:>10.3f}")
+    return results
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Phân vị q (0-100), nội suy tuyến tính"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def make_conversation_runner(bot: str, client: Any) -> Callable[[List[str]], List[float]]:
+    """Hàm chạy một hội thoại của bot, trả về độ trễ từng lượt (giây)"""
+    if bot == "travel":
+        from apiresponse import TravelAgent
+
+        def run(turns: List[str]) -> List[float]:
+            agent = TravelAgent(client=client)
+            timings = []
+            for turn in turns:
+                start = time.perf_counter()
+                agent.process_user_input(turn)
+                timings.append(time.perf_counter() - start)
+            return timings
+        return run
+
+    if bot == "menu":
+        from datmon import ConversationHistory, Order, get_menu_response, process_order
+
+        def run(turns: List[str]) -> List[float]:
+            order, history = Order(), ConversationHistory()
+            timings = []
+            for turn in turns:
+                start = time.perf_counter()
+                history.add_message("user", turn)
+                try:
+                    history.add_message("assistant", get_menu_response(turn, order, history, client))
+                except Exception as e:
+                    history.add_message("assistant", f"Xin lỗi, có lỗi xảy ra: {e}")
+                if "xác nhận" in turn.lower() or "hủy" in turn.lower():
+                    process_order(turn, order)
+                timings.append(time.perf_counter() - start)
+            return timings
+        return run
+
+    if bot == "stock":
+        from giachungkhoan import StockAnalysis
+
+        # Một StockAnalysis cho mọi phiên (như server), để đo cả cache câu trả lời
+        analysis = StockAnalysis(client=client)
+
+        def run(turns: List[str]) -> List[float]:
+            timings = []
+            for turn in turns:
+                start = time.perf_counter()
+                analysis.analyze_stock(turn)
+                timings.append(time.perf_counter() - start)
+            return timings
+        return run
+
+    raise ValueError(f"Không có bot {bot}")
+
+
+def make_mock(args) -> MockOpenAI:
+    handlers = {
+        "user_input_analysis": travel_analysis_handler,
+        "travel_plan_prices": price_plan_handler,
+        "update_order": make_order_handler(),
+    }
+    return MockOpenAI(latency=args.latency, jitter=0.0, per_output_token=args.per_output_token,
+                      handlers=handlers, seed=args.seed, error_rate=args.error_rate, tool_latency=args.tool_latency)
+
+
+def bench_load(args):
+    # Menu mẫu để bot trà sữa có chỉ mục cục bộ như khi chạy thật
+    os.environ.setdefault("MENU_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "menu.example.json"))
+    corpus = DEFAULT_CORPUS
+    if args.corpus:
+        with open(args.corpus, encoding="utf-8") as f:
+            corpus = json.load(f)
+
+    results = {}
+    for bot in args.bots:
+        conversations = corpus.get(bot) or []
+        if not conversations:
+            continue
+        sessions = [conversations[i % len(conversations)] for i in range(args.sessions)]
+        mock = make_mock(args)
+        server = None
+        client: Any = mock
+        if args.http:
+            from openai import OpenAI
+
+            server = MockServer(mock).start()
+            client = OpenAI(base_url=server.url, api_key="mock", max_retries=args.retries)
+        try:
+            run = make_conversation_runner(bot, client)
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+                timings = [t for conversation in executor.map(run, sessions) for t in conversation]
+            elapsed = time.perf_counter() - start
+        finally:
+            if server:
+                client.close()
+                server.stop()
+
+        stats = mock.stats.snapshot()
+        turns = len(timings)
+        results[bot] = {
+            "conversations": len(sessions),
+            "turns": turns,
+            "p50_s": percentile(timings, 50),
+            "p95_s": percentile(timings, 95),
+            "p99_s": percentile(timings, 99),
+            "mean_s": sum(timings) / turns,
+            "throughput_turns_per_s": turns / elapsed,
+            "calls_per_turn": stats["requests"] / turns,
+            "tokens_per_turn": stats["total_tokens"] / turns,
+            "tool_calls": stats["tool_calls"],
+            "injected_errors": stats["errors"],
+            "by_endpoint": stats["by_endpoint"],
+        }
+
+    print(f"{'bot':<8}{'turns':>7}{'p50(s)':>9}{'p95(s)':>9}{'p99(s)':>9}{'turn/s':>9}{'calls':>8}{'tokens':>9}{'errors':>8}")
+    for bot, row in results.items():
+        print(f"{bot:<8}{row['turns']:>7}{row['p50_s']:>9.3f}{row['p95_s']:>9.3f}{row['p99_s']:>9.3f}"
+              f"{row['throughput_turns_per_s']:>9.2f}{row['calls_per_turn']:>8.2f}{row['tokens_per_turn']:>9.0f}"
+              f"{row['injected_errors']:>8}")
+    if args.output:
+        config = {k: v for k, v in vars(args).items() if k != "func"}
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"config": config, "results": results}, f, ensure_ascii=False, indent=2)
+    return results
+
+
+# Chỉ số so sánh: True nếu giá trị lớn hơn là tốt hơn
+COMPARED_METRICS = {
+    "p50_s": False, "p95_s": False, "p99_s": False,
+    "throughput_turns_per_s": True, "calls_per_turn": False, "tokens_per_turn": False,
+}
+
+
+def compare_results(args) -> int:
+    """So sánh hai file kết quả của load; trả về 1 nếu có chỉ số xấu đi quá ngưỡng"""
+    with open(args.base, encoding="utf-8") as f:
+        base = json.load(f)["results"]
+    with open(args.new, encoding="utf-8") as f:
+        new = json.load(f)["results"]
+
+    regressions = 0
+    print(f"{'bot':<8}{'metric':<24}{'base':>10}{'new':>10}{'change':>9}")
+    for bot in sorted(set(base) & set(new)):
+        for metric, higher_is_better in COMPARED_METRICS.items():
+            old_value, new_value = base[bot][metric], new[bot][metric]
+            change = (new_value - old_value) / old_value if old_value else 0.0
+            worse = -change if higher_is_better else change
+            flag = ""
+            if worse > args.threshold:
+                flag = "  REGRESSION"
+                regressions += 1
+            print(f"{bot:<8}{metric:<24}{old_value:>10.3f}{new_value:>10.3f}{change:>+9.1%}{flag}")
+    return 1 if regressions else 0
+
+
+STARTUP_MODULES = ("apiresponse", "datmon", "giachungkhoan", "server")
+# Gói nặng chỉ được nạp khi thật sự dùng (tạo client, kiểm tra output, tính chỉ báo)
+DEFERRED_PACKAGES = ("openai", "httpx", "pydantic", "numpy", "pandas", "tiktoken", "dotenv", "asyncio")
+# server là ứng dụng ASGI: cần asyncio và .env ngay khi khởi động
+EAGER_ALLOWED = {"server": ("asyncio", "dotenv")}
+
+
+def import_profile(module: str) -> Dict[str, Any]:
+    """Một lần chạy python -X importtime -c "import module" trong process mới"""
+    start = time.perf_counter()
+    # Danh sách module đã nạp lấy từ sys.modules (importtime ghi cả các lần import thất bại)
+    code = f"import {module}, sys; print(' '.join(sorted({{name.split('.')[0] for name in sys.modules}})))"
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", code],
+                          capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    wall = time.perf_counter() - start
+    if proc.returncode != 0:
+        raise RuntimeError(f"import {module} lỗi:\n{proc.stderr[-2000:]}")
+
+    # Dòng dạng "import time: self | cumulative | <thụt lề>tên", in theo thứ tự con trước cha
+    entries = []
+    for line in proc.stderr.splitlines():
+        match = re.match(r"import time:\s+(\d+) \|\s+(\d+) \| ( *)(\S+)", line)
+        if match:
+            entries.append((len(match.group(3)) // 2, match.group(4), int(match.group(2))))
+    end = max(i for i, (depth, name, _) in enumerate(entries) if depth == 0 and name == module)
+    start_index = max((i for i, (depth, _, _) in enumerate(entries[:end]) if depth == 0), default=-1) + 1
+    subtree = entries[start_index:end]
+    loaded = set(proc.stdout.split())
+    loaded -= set(EAGER_ALLOWED.get(module, ()))
+    return {
+        "import_ms": entries[end][2] / 1000,
+        "process_ms": wall * 1000,
+        "children": sorted(((name, us / 1000) for depth, name, us in subtree if depth == 1),
+                           key=lambda item: -item[1]),
+        "deferred_loaded": sorted(loaded & set(DEFERRED_PACKAGES)),
+    }
+
+
+def bench_importtime(args) -> int:
+    failures = 0
+    results = {}
+    for module in args.modules:
+        runs = [import_profile(module) for _ in range(args.runs)]
+        import_ms = statistics.median(run["import_ms"] for run in runs)
+        process_ms = statistics.median(run["process_ms"] for run in runs)
+        deferred = runs[-1]["deferred_loaded"]
+        over_budget = import_ms > args.budget_ms
+        failures += over_budget or bool(deferred)
+        results[module] = {"import_ms": import_ms, "process_ms": process_ms, "deferred_loaded": deferred}
+
+        flag = "  OVER BUDGET" if over_budget else ""
+        print(f"{module:<16}import {import_ms:7.1f} ms   process {process_ms:7.1f} ms{flag}")
+        for name, ms in runs[-1]["children"][:args.top]:
+            print(f"    {name:<28}{ms:7.1f} ms")
+        if deferred:
+            print(f"    nạp sớm: {', '.join(deferred)}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"budget_ms": args.budget_ms, "results": results}, f, ensure_ascii=False, indent=2)
+    return 1 if failures else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    pricing = subparsers.add_parser("pricing", help="So sánh tra giá từng mục và tra giá gộp")
+    pricing.add_argument("--items", type=int, default=6, help="Số hoạt động trong kế hoạch mẫu")
+    pricing.add_argument("--runs", type=int, default=3)
+    pricing.add_argument("--workers", type=int, default=8)
+    pricing.add_argument("--latency", type=float, default=0.5, help="Độ trễ giả lập mỗi request (giây)")
+    pricing.add_argument("--jitter", type=float, default=0.1)
+    pricing.set_defaults(func=bench_pricing)
+
+    load = subparsers.add_parser("load", help="Chạy hội thoại mẫu song song, đo độ trễ, số request và token")
+    load.add_argument("--bots", nargs="+", default=["travel", "menu", "stock"], choices=["travel", "menu", "stock"])
+    load.add_argument("--corpus", help="File JSON {bot: [[lượt, ...], ...]} thay cho hội thoại mẫu")
+    load.add_argument("--sessions", type=int, default=12, help="Số hội thoại mỗi bot")
+    load.add_argument("--concurrency", type=int, default=4)
+    load.add_argument("--latency", default="lognormal:0.4,0.3", help='Giây hoặc phân phối, ví dụ "uniform:0.2,0.6"')
+    load.add_argument("--per-output-token", type=float, default=0.001)
+    load.add_argument("--tool-latency", type=float, default=0.5, help="Thời gian thêm cho web/file search")
+    load.add_argument("--error-rate", type=float, default=0.0)
+    load.add_argument("--seed", type=int, default=0)
+    load.add_argument("--http", action="store_true", help="Chạy qua MockServer với client OpenAI thật")
+    load.add_argument("--retries", type=int, default=2, help="max_retries của client khi dùng --http")
+    load.add_argument("--output", help="Ghi kết quả ra file JSON để so sánh")
+    load.set_defaults(func=bench_load)
+
+    compare = subparsers.add_parser("compare", help="So sánh hai lần chạy load, báo chỉ số xấu đi")
+    compare.add_argument("base")
+    compare.add_argument("new")
+    compare.add_argument("--threshold", type=float, default=0.1, help="Tỉ lệ xấu đi tối đa cho phép")
+    compare.set_defaults(func=compare_results)
+
+    importtime = subparsers.add_parser("importtime", help="Đo thời gian import các module bot so với ngân sách")
+    importtime.add_argument("modules", nargs="*", default=list(STARTUP_MODULES))
+    importtime.add_argument("--budget-ms", type=float, default=150.0, help="Thời gian import tối đa mỗi module")
+    importtime.add_argument("--runs", type=int, default=5)
+    importtime.add_argument("--top", type=int, default=5, help="Số import con tốn thời gian nhất được in ra")
+    importtime.add_argument("--output", help="Ghi kết quả ra file JSON")
+    importtime.set_defaults(func=bench_importtime)
+
+    args = parser.parse_args()
+    result = args.func(args)
+    if args.command in ("compare", "importtime"):
+        sys.exit(result)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,368 @@
+"""Các backend cache dùng chung: LRU trong bộ nhớ, SQLite trên đĩa, cache hai tầng và
+cache câu trả lời theo độ giống nhau của câu hỏi
+
+Mọi backend có cùng giao diện get/set/delete/clear và thống kê hit/miss/eviction.
+Giá trị lưu trên đĩa phải serialize được bằng JSON (hoặc bằng serializer truyền vào
+SQLiteCache, ví dụ bytes đã đóng gói sẵn của session_state.py).
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple
+
+from vntext import tokenize
+
+
+class CacheStats:
+    """Đếm hit/miss/eviction của một cache"""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.sets = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def incr(self, name: str, amount: int = 1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + amount)
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "sets": self.sets,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "hit_rate": self.hit_rate,
+            }
+
+
+class LRUCache:
+    """Cache LRU trong bộ nhớ, giới hạn số phần tử và thời gian sống (giây)"""
+    def __init__(self, max_size: int = 256, ttl: Optional[float] = None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.stats = CacheStats()
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.stats.incr("misses")
+                return default
+            expires_at, value = entry
+            if expires_at is not None and expires_at <= time.time():
+                del self._data[key]
+                self.stats.incr("expirations")
+                self.stats.incr("misses")
+                return default
+            self._data.move_to_end(key)
+            self.stats.incr("hits")
+            return value
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.time() + ttl if ttl else None
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            self.stats.incr("sets")
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self.stats.incr("evictions")
+
+    def delete(self, key: str):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __contains__(self, key: str) -> bool:
+        with self._lock:
+            entry = self._data.get(key)
+            return entry is not None and (entry[0] is None or entry[0] > time.time())
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class SQLiteCache:
+    """Cache trên đĩa bằng SQLite, dùng chung giữa các process và sau khi khởi động lại"""
+    def __init__(self, path: str, ttl: Optional[float] = None, max_size: Optional[int] = None, table: str = "cache",
+                 serializer: Optional[Tuple[Callable[[Any], Any], Callable[[Any], Any]]] = None):
+        self.path = path
+        self.ttl = ttl
+        self.max_size = max_size
+        self.table = table
+        # (dumps, loads); mặc định JSON
+        self._dumps, self._loads = serializer or (lambda value: json.dumps(value, ensure_ascii=False), json.loads)
+        self.stats = CacheStats()
+        self._local = threading.local()
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {table} ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL, accessed_at REAL NOT NULL)"
+            )
+            conn.execute(f"CREATE INDEX IF NOT EXISTS {table}_accessed ON {table} (accessed_at)")
+
+    def _connect(self) -> sqlite3.Connection:
+        # Mỗi luồng một kết nối; WAL cho phép nhiều process đọc/ghi đồng thời
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key: str, default: Any = None) -> Any:
+        conn = self._connect()
+        row = conn.execute(f"SELECT value, expires_at FROM {self.table} WHERE key = ?", (key,)).fetchone()
+        now = time.time()
+        if row is None:
+            self.stats.incr("misses")
+            return default
+        if row[1] is not None and row[1] <= now:
+            with conn:
+                conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+            self.stats.incr("expirations")
+            self.stats.incr("misses")
+            return default
+        with conn:
+            conn.execute(f"UPDATE {self.table} SET accessed_at = ? WHERE key = ?", (now, key))
+        self.stats.incr("hits")
+        return self._loads(row[0])
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        ttl = self.ttl if ttl is None else ttl
+        now = time.time()
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                f"INSERT OR REPLACE INTO {self.table} (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, self._dumps(value), now + ttl if ttl else None, now),
+            )
+            self.stats.incr("sets")
+            if self.max_size:
+                evicted = conn.execute(
+                    f"DELETE FROM {self.table} WHERE key IN (SELECT key FROM {self.table} "
+                    "ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                    (self.max_size,),
+                ).rowcount
+                if evicted > 0:
+                    self.stats.incr("evictions", evicted)
+
+    def delete(self, key: str):
+        conn = self._connect()
+        with conn:
+            conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+
+    def clear(self):
+        conn = self._connect()
+        with conn:
+            conn.execute(f"DELETE FROM {self.table}")
+
+    def __contains__(self, key: str) -> bool:
+        row = self._connect().execute(
+            f"SELECT 1 FROM {self.table} WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)",
+            (key, time.time()),
+        ).fetchone()
+        return row is not None
+
+    def __len__(self) -> int:
+        return self._connect().execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+
+
+class TieredCache:
+    """Cache hai tầng: LRU trong bộ nhớ phía trước, backend bền vững phía sau"""
+    def __init__(self, front: LRUCache, back: Any):
+        self.front = front
+        self.back = back
+        self.stats = CacheStats()
+
+    def get(self, key: str, default: Any = None) -> Any:
+        value = self.front.get(key)
+        if value is None:
+            value = self.back.get(key)
+            if value is None:
+                self.stats.incr("misses")
+                return default
+            self.front.set(key, value)
+        self.stats.incr("hits")
+        return value
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        self.front.set(key, value, ttl)
+        self.back.set(key, value, ttl)
+        self.stats.incr("sets")
+
+    def delete(self, key: str):
+        self.front.delete(key)
+        self.back.delete(key)
+
+    def clear(self):
+        self.front.clear()
+        self.back.clear()
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.front or key in self.back
+
+    def __len__(self) -> int:
+        return len(self.back)
+
+
+class SingleFlight:
+    """Gộp các lần gọi trùng khóa đang chạy đồng thời thành một lần gọi duy nhất"""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.coalesced = 0
+
+    def do(self, key: str, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = {"event": threading.Event(), "result": None, "error": None}
+                self._calls[key] = call
+                leader = True
+            else:
+                self.coalesced += 1
+                leader = False
+
+        if not leader:
+            call["event"].wait()
+            if call["error"] is not None:
+                raise call["error"]
+            return call["result"]
+
+        try:
+            call["result"] = fn()
+            return call["result"]
+        except BaseException as e:
+            call["error"] = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call["event"].set()
+
+    def running(self, key: str) -> bool:
+        with self._lock:
+            return key in self._calls
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._calls)
+
+
+def numeric_terms(question: str) -> Iterable[str]:
+    """Các âm tiết có chữ số ("quy 1" -> "1", "ma20"): phải khớp đúng, không so gần đúng"""
+    return [term for term in tokenize(question) if any(ch.isdigit() for ch in term)]
+
+
+def _ngrams(token: str, n: int = 3) -> set:
+    padded = f" {token} "
+    return {padded[i:i + n] for i in range(max(1, len(padded) - n + 1))}
+
+
+class SemanticCache:
+    """Cache câu trả lời theo độ giống nhau của câu hỏi (n-gram ký tự), chia theo nhóm
+
+    Mỗi nhóm (ví dụ "VNM|2024-05-10": mã + thời điểm dữ liệu) giữ tối đa max_per_group
+    câu hỏi. Câu hỏi được bỏ dấu, bỏ các từ đệm trong stopwords; hai câu có độ tương
+    đồng Jaccard trên n-gram từ threshold trở lên được xem là cùng một câu, với điều kiện
+    các từ neo (anchors, mặc định: số) giống hệt nhau: "quý 1" và "quý 2" luôn là hai câu khác.
+    """
+    def __init__(self, threshold: float = 0.8, ttl: Optional[float] = None, max_groups: int = 256,
+                 max_per_group: int = 64, stopwords: Optional[set] = None,
+                 anchors: Callable[[str], Iterable[str]] = numeric_terms):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_groups = max_groups
+        self.max_per_group = max_per_group
+        self.stopwords = set(stopwords or ())
+        self.anchors = anchors
+        self.stats = CacheStats()
+        self._groups = OrderedDict()
+        self._lock = threading.Lock()
+
+    def terms(self, question: str) -> list:
+        return [t for t in tokenize(question) if t not in self.stopwords]
+
+    def key(self, question: str) -> str:
+        """Khóa chuẩn hóa của câu hỏi (không phụ thuộc thứ tự từ), dùng để gộp request trùng"""
+        return " ".join(sorted(set(self.terms(question))))
+
+    def _grams(self, question: str) -> frozenset:
+        return frozenset(g for term in self.terms(question) for g in _ngrams(term))
+
+    def get(self, group: str, question: str, default: Any = None) -> Any:
+        grams = self._grams(question)
+        anchors = frozenset(self.anchors(question))
+        now = time.time()
+        with self._lock:
+            entries = self._groups.get(group)
+            best, best_score = None, 0.0
+            if entries is not None:
+                self._groups.move_to_end(group)
+                for entry in list(entries):
+                    if entry["expires_at"] is not None and entry["expires_at"] <= now:
+                        entries.remove(entry)
+                        self.stats.incr("expirations")
+                        continue
+                    if entry["anchors"] != anchors:
+                        continue
+                    union = len(grams | entry["grams"])
+                    score = len(grams & entry["grams"]) / union if union else 1.0
+                    if score > best_score:
+                        best, best_score = entry, score
+            if best is None or best_score < self.threshold:
+                self.stats.incr("misses")
+                return default
+            self.stats.incr("hits")
+            return best["value"]
+
+    def set(self, group: str, question: str, value: Any, ttl: Optional[float] = None):
+        ttl = self.ttl if ttl is None else ttl
+        entry = {"grams": self._grams(question), "anchors": frozenset(self.anchors(question)), "value": value, "expires_at": time.time() + ttl if ttl else None}
+        with self._lock:
+            entries = self._groups.setdefault(group, [])
+            self._groups.move_to_end(group)
+            entries.append(entry)
+            self.stats.incr("sets")
+            if len(entries) > self.max_per_group:
+                entries.pop(0)
+                self.stats.incr("evictions")
+            while len(self._groups) > self.max_groups:
+                _, evicted = self._groups.popitem(last=False)
+                self.stats.incr("evictions", len(evicted))
+
+    def invalidate(self, prefix: str):
+        """Xóa các nhóm có tên bắt đầu bằng prefix (ví dụ khi mã có dữ liệu phiên mới)"""
+        with self._lock:
+            for group in [g for g in self._groups if g.startswith(prefix)]:
+                del self._groups[group]
+
+    def clear(self):
+        with self._lock:
+            self._groups.clear()
+
+    def __len__(self) -> int:
+        return sum(len(entries) for entries in self._groups.values())
@@ -0,0 +1,233 @@
+"""Client OpenAI dùng chung cho mọi bot và thread
+
+Client chỉ được tạo ở lần dùng đầu tiên (import module không tạo client) và dùng
+chung một connection pool httpx. Cấu hình qua biến môi trường:
+
+    OPENAI_MAX_CONNECTIONS   số kết nối tối đa trong pool (mặc định 100)
+    OPENAI_MAX_KEEPALIVE     số kết nối keep-alive giữ lại (mặc định 20)
+    OPENAI_KEEPALIVE_EXPIRY  thời gian giữ kết nối nhàn rỗi, giây (mặc định 30)
+    OPENAI_TIMEOUT           timeout mỗi request, giây (mặc định 60)
+    OPENAI_CONNECT_TIMEOUT   timeout khi mở kết nối, giây (mặc định 5)
+    OPENAI_MAX_RETRIES       số lần SDK tự thử lại (mặc định 0: scheduler.py đã lo việc
+                             thử lại có backoff và giới hạn tốc độ)
+    OPENAI_HTTP2             bật HTTP/2 khi đã cài gói h2 (mặc định 1)
+
+httpx, openai và .env chỉ được nạp ở lần tạo client đầu tiên, import module này gần như
+không tốn thời gian.
+"""
+import os
+import threading
+import time
+import weakref
+from collections import deque
+from typing import TYPE_CHECKING, Any, Dict, Optional, Tuple
+
+from scheduler import observe_rate_limit_headers
+from tracing import note_http_attempt
+
+if TYPE_CHECKING:
+    from openai import AsyncOpenAI, OpenAI
+
+_lock = threading.Lock()
+_client: Optional["OpenAI"] = None
+_async_client: Optional["AsyncOpenAI"] = None
+_env_loaded = False
+_transports: Optional[Tuple[type, type]] = None
+
+
+def load_env():
+    """Nạp .env một lần; gọi ở đầu main() của các CLI và khi tạo client"""
+    global _env_loaded
+    if not _env_loaded:
+        from dotenv import load_dotenv
+        load_dotenv()
+        _env_loaded = True
+
+
+class ConnectionMetrics:
+    """Thống kê tái sử dụng kết nối và độ trễ (tới khi nhận header) của từng request"""
+    def __init__(self, window: int = 2048):
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=window)
+        self._seen_streams = weakref.WeakSet()
+        self.requests = 0
+        self.errors = 0
+        self.new_connections = 0
+        self.reused_connections = 0
+
+    def record(self, latency: float, network_stream: Any = None):
+        with self._lock:
+            self.requests += 1
+            self._latencies.append(latency)
+            if network_stream is None:
+                return
+            # Cùng một network stream nghĩa là request đi trên kết nối đã mở sẵn
+            try:
+                reused = network_stream in self._seen_streams
+                self._seen_streams.add(network_stream)
+            except TypeError:
+                return
+            if reused:
+                self.reused_connections += 1
+            else:
+                self.new_connections += 1
+
+    def record_error(self):
+        with self._lock:
+            self.errors += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            latencies = sorted(self._latencies)
+            connections = self.new_connections + self.reused_connections
+
+        def percentile(p: float) -> Optional[float]:
+            if not latencies:
+                return None
+            return latencies[min(len(latencies) - 1, int(p * len(latencies)))]
+
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "new_connections": self.new_connections,
+            "reused_connections": self.reused_connections,
+            "reuse_rate": self.reused_connections / connections if connections else 0.0,
+            "latency_p50_s": percentile(0.50),
+            "latency_p95_s": percentile(0.95),
+            "latency_p99_s": percentile(0.99),
+        }
+
+
+metrics = ConnectionMetrics()
+
+
+def _transport_classes() -> Tuple[type, type]:
+    """(InstrumentedTransport, AsyncInstrumentedTransport), định nghĩa khi httpx được nạp"""
+    global _transports
+    if _transports is not None:
+        return _transports
+    import httpx
+
+    class InstrumentedTransport(httpx.HTTPTransport):
+        def handle_request(self, request: httpx.Request) -> httpx.Response:
+            note_http_attempt()
+            start = time.perf_counter()
+            try:
+                response = super().handle_request(request)
+            except Exception:
+                metrics.record_error()
+                raise
+            metrics.record(time.perf_counter() - start, response.extensions.get("network_stream"))
+            observe_rate_limit_headers(response.headers)
+            return response
+
+    class AsyncInstrumentedTransport(httpx.AsyncHTTPTransport):
+        async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+            note_http_attempt()
+            start = time.perf_counter()
+            try:
+                response = await super().handle_async_request(request)
+            except Exception:
+                metrics.record_error()
+                raise
+            metrics.record(time.perf_counter() - start, response.extensions.get("network_stream"))
+            observe_rate_limit_headers(response.headers)
+            return response
+
+    _transports = (InstrumentedTransport, AsyncInstrumentedTransport)
+    return _transports
+
+
+def _http2_enabled() -> bool:
+    if os.getenv("OPENAI_HTTP2", "1").lower() in ("0", "false", "no"):
+        return False
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def _pool_settings() -> Dict[str, Any]:
+    import httpx
+
+    limits = httpx.Limits(
+        max_connections=int(os.getenv("OPENAI_MAX_CONNECTIONS", 100)),
+        max_keepalive_connections=int(os.getenv("OPENAI_MAX_KEEPALIVE", 20)),
+        keepalive_expiry=float(os.getenv("OPENAI_KEEPALIVE_EXPIRY", 30)),
+    )
+    timeout = httpx.Timeout(
+        float(os.getenv("OPENAI_TIMEOUT", 60)),
+        connect=float(os.getenv("OPENAI_CONNECT_TIMEOUT", 5)),
+    )
+    return {"limits": limits, "timeout": timeout, "http2": _http2_enabled()}
+
+
+def get_client() -> "OpenAI":
+    """Client OpenAI đồng bộ dùng chung, tạo ở lần gọi đầu tiên"""
+    global _client
+    if _client is None:
+        with _lock:
+            if _client is None:
+                import httpx
+                from openai import OpenAI
+
+                load_env()
+                settings = _pool_settings()
+                transport_class = _transport_classes()[0]
+                http_client = httpx.Client(
+                    transport=transport_class(limits=settings["limits"], http2=settings["http2"]),
+                    timeout=settings["timeout"],
+                )
+                _client = OpenAI(
+                    http_client=http_client,
+                    timeout=settings["timeout"],
+                    max_retries=int(os.getenv("OPENAI_MAX_RETRIES", 0)),
+                )
+    return _client
+
+
+def get_async_client() -> "AsyncOpenAI":
+    """Client AsyncOpenAI dùng chung (trong một event loop), tạo ở lần gọi đầu tiên"""
+    global _async_client
+    if _async_client is None:
+        with _lock:
+            if _async_client is None:
+                import httpx
+                from openai import AsyncOpenAI
+
+                load_env()
+                settings = _pool_settings()
+                transport_class = _transport_classes()[1]
+                http_client = httpx.AsyncClient(
+                    transport=transport_class(limits=settings["limits"], http2=settings["http2"]),
+                    timeout=settings["timeout"],
+                )
+                _async_client = AsyncOpenAI(
+                    http_client=http_client,
+                    timeout=settings["timeout"],
+                    max_retries=int(os.getenv("OPENAI_MAX_RETRIES", 0)),
+                )
+    return _async_client
+
+
+def close_clients():
+    """Đóng client đồng bộ; client async cần được đóng bằng aclose_clients()"""
+    global _client
+    with _lock:
+        if _client is not None:
+            _client.close()
+            _client = None
+
+
+async def aclose_clients():
+    global _async_client
+    close_clients()
+    with _lock:
+        client, _async_client = _async_client, None
+    if client is not None:
+        await client.close()
+
+
+def client_metrics() -> Dict[str, Any]:
+    return metrics.snapshot()
@@ -1,114 +1,382 @@
-from openai import OpenAI
-from dotenv import load_dotenv
 from datetime import datetime
-load_dotenv()
+import json
+import re
+from typing import TYPE_CHECKING, Any, Dict, Iterator, Optional
 
-client = OpenAI()
+from clients import get_client, load_env
+from history import TokenBudgetHistory
+from menu_index import MenuIndex, get_menu_index
+import scheduler
+from schemas import json_schema
+from streaming import DeltaCallback, print_stream, stream_response
+from tracing import record_cache, record_error, traced
+from vntext import fold_diacritics
+
+if TYPE_CHECKING:
+    from openai import OpenAI
+
+    from models import OrderDelta
 
 class Order:
+    __slots__ = ("items", "total", "special_requests")
+
     def __init__(self):
         self.items = []
         self.total = 0
         self.special_requests = ""
 
     def add_item(self, name: str, price: float, quantity: int = 1):
-        self.items.append({
-            "name": name,
-            "price": price,
-            "quantity": quantity
-        })
+        # Cùng món cùng giá thì cộng dồn số lượng
+        for item in self.items:
+            if item["name"] == name and item["price"] == price:
+                item["quantity"] += quantity
+                break
+        else:
+            self.items.append({
+                "name": name,
+                "price": price,
+                "quantity": quantity
+            })
         self.total += price * quantity
 
+    def remove_item(self, name: str, quantity: int = 0) -> bool:
+        """Bớt số lượng (0: bỏ hẳn) của món có tên name; trả về False nếu không có trong đơn"""
+        for item in self.items:
+            if item["name"] == name:
+                removed = item["quantity"] if quantity <= 0 else min(quantity, item["quantity"])
+                item["quantity"] -= removed
+                self.total -= item["price"] * removed
+                if item["quantity"] == 0:
+                    self.items.remove(item)
+                return True
+        return False
+
     def add_special_request(self, request: str):
         self.special_requests = request
 
-class ConversationHistory:
-    def __init__(self):
-        self.messages = []
-        self.max_history = 5  # Lưu 5 câu hỏi gần nhất
+    def reset(self):
+        self.items = []
+        self.total = 0
+        self.special_requests = ""
+
+    def to_state(self) -> Dict[str, Any]:
+        return {"items": self.items, "total": self.total, "special_requests": self.special_requests}
+
+    @classmethod
+    def from_state(cls, state: Dict[str, Any]) -> "Order":
+        order = cls()
+        order.items = [dict(item) for item in state["items"]]
+        order.total = state["total"]
+        order.special_requests = state["special_requests"]
+        return order
+
+ORDER_TOOL = {
+    "type": "function",
+    "name": "update_order",
+    "description": "Ghi lại thay đổi đơn hàng trong lượt này: món thêm (add), món bớt (remove, quantity 0 là bỏ hẳn), yêu cầu đặc biệt, hoặc khách xác nhận (confirm) / hủy (cancel) đơn.",
+    "parameters": json_schema("OrderDelta"),
+    "strict": True
+}
+
+class ConversationHistory(TokenBudgetHistory):
+    """Lịch sử hỏi đáp của khách: giới hạn theo token, lượt cũ được tóm tắt lại"""
+    __slots__ = ()
+
+    def __init__(self, max_tokens: int = 1500, chain_responses: bool = False):
+        super().__init__(max_tokens=max_tokens, keep_recent=4, chain_responses=chain_responses)
+
+MENU_INSTRUCTIONS = "Bạn là nhân viên phục vụ trà sữa. Hãy trả lời câu hỏi của khách hàng dựa trên menu trà sữa và lịch sử câu hỏi trước đó. Nếu khách hàng hỏi về giá, hãy nêu rõ giá. Nếu hỏi về mô tả, hãy mô tả chi tiết món trà sữa đó. Nếu khách hàng muốn đặt món, hãy hướng dẫn họ cách đặt."
+ORDER_INSTRUCTIONS = "Khi khách đặt thêm, bớt món, nêu yêu cầu đặc biệt, xác nhận hoặc hủy đơn, hãy gọi hàm update_order với đúng thay đổi của lượt này (dùng tên món như trong menu) và vẫn trả lời khách bằng văn bản. Không tự tính tổng tiền."
 
-    def add_message(self, role: str, content: str):
-        self.messages.append({"role": role, "content": content})
-        if len(self.messages) > self.max_history * 2:  # Mỗi cặp Q&A là 2 messages
-            self.messages = self.messages[-self.max_history * 2:]
+# Câu đặt món (trên văn bản đã bỏ dấu): động từ đặt/lấy/cho/thêm kèm số lượng
+ORDER_INTENT_RE = re.compile(
+    r"\b(dat|lay|cho|them|mua|order)\b.*\b(\d+|mot|hai|ba|bon|nam|sau|bay|tam|chin|muoi|ly|coc)\b"
+)
 
-    def get_messages(self):
-        return self.messages
+def answer_from_menu(user_input: str, menu_index: MenuIndex = None) -> Optional[str]:
+    """Trả lời ngay từ menu cục bộ các câu hỏi giá/mô tả/danh sách món, không gọi API
 
-def get_menu_response(user_input: str, current_order: Order = None, history: ConversationHistory = None) -> str:
+    Câu đặt món luôn đi qua model để update_order ghi nhận thay đổi đơn hàng.
+    """
+    if ORDER_INTENT_RE.search(" ".join(re.findall(r"\w+", fold_diacritics(user_input)))):
+        record_cache("menu_answer", False)
+        return None
+    answer = (menu_index or get_menu_index()).answer(user_input)
+    record_cache("menu_answer", answer is not None)
+    return answer
+
+def describe_order(current_order: Order = None) -> str:
+    if not current_order or not current_order.items:
+        return "Đơn hàng hiện tại: trống."
+    lines = [f"- {item['name']} x{item['quantity']}" for item in current_order.items]
+    if current_order.special_requests:
+        lines.append(f"Yêu cầu đặc biệt: {current_order.special_requests}")
+    return "Đơn hàng hiện tại:\n" + "\n".join(lines)
+
+def build_menu_request(user_input: str, history: ConversationHistory = None, menu_index: MenuIndex = None,
+                       current_order: Order = None) -> dict:
     # Tạo input messages với lịch sử
     input_messages = []
-    if history:
+    options = {}
+    if history is not None:
         input_messages.extend(history.get_messages())
-    input_messages.append({
-        "role": "user",
-        "content": user_input
-    })
+        options = history.request_options()
+    # Câu hỏi hiện tại thường đã được lưu vào lịch sử trước khi gọi
+    if not input_messages or input_messages[-1] != {"role": "user", "content": user_input}:
+        input_messages.append({
+            "role": "user",
+            "content": user_input
+        })
+
+    # Trích xuất thay đổi đơn hàng trong cùng lần gọi qua hàm update_order
+    instructions = f"{MENU_INSTRUCTIONS} {ORDER_INSTRUCTIONS}\n\n{describe_order(current_order)}"
+
+    # Có menu cục bộ: đưa các món liên quan vào prompt, không cần file_search
+    menu_index = menu_index or get_menu_index()
+    if len(menu_index):
+        snippets = menu_index.snippets(user_input, k=5)
+        return {
+            "model": "gpt-4o-mini",
+            "instructions": f"{instructions}\n\nThông tin menu liên quan:\n{snippets or 'Không tìm thấy món phù hợp trong menu.'}",
+            "input": input_messages,
+            "tools": [ORDER_TOOL],
+            **options
+        }
 
     tools = [
         {
             "type": "file_search",
             "vector_store_ids": ["vs_67eb86b4070881919f5fd74d2b39b844"],
             "max_num_results": 2
-        }
+        },
+        ORDER_TOOL
     ]
 
-    response = client.responses.create(
-        model="gpt-4o-mini",
-        instructions="Bạn là nhân viên phục vụ trà sữa. Hãy trả lời câu hỏi của khách hàng dựa trên menu trà sữa và lịch sử câu hỏi trước đó. Nếu khách hàng hỏi về giá, hãy nêu rõ giá. Nếu hỏi về mô tả, hãy mô tả chi tiết món trà sữa đó. Nếu khách hàng muốn đặt món, hãy hướng dẫn họ cách đặt.",
-        input=input_messages,
-        tools=tools,
-        include=["file_search_call.results"]
-    )
-
-    # Xử lý kết quả tìm kiếm
-    menu_info = ""
-    for output_item in response.output:
-        if output_item.type == "file_search_call":
-            for result in output_item.results:
-                menu_info = result.text  # Chỉ lấy kết quả đầu tiên
-                break
-            break
-
-    # Tạo câu trả lời dựa trên thông tin menu
-    final_response = response.output_text
+    return {
+        "model": "gpt-4o-mini",
+        "instructions": instructions,
+        "input": input_messages,
+        "tools": tools,
+        "include": ["file_search_call.results"],
+        **options
+    }
 
+def format_order_summary(user_input: str, current_order: Order = None, force: bool = False) -> str:
     # Xử lý đặt món
-    if "đặt món" in user_input.lower() or "order" in user_input.lower():
+    summary = ""
+    if force or "đặt món" in user_input.lower() or "order" in user_input.lower():
         if current_order and current_order.items:
-            final_response += "\n\nĐơn hàng hiện tại của bạn:\n"
+            summary += "\n\nĐơn hàng hiện tại của bạn:\n"
             for item in current_order.items:
-                final_response += f"- {item['name']} x{item['quantity']}: {item['price']*item['quantity']:,}đ\n"
-            final_response += f"Tổng cộng: {current_order.total:,}đ\n"
+                summary += f"- {item['name']} x{item['quantity']}: {item['price']*item['quantity']:,}đ\n"
+            summary += f"Tổng cộng: {current_order.total:,}đ\n"
             if current_order.special_requests:
-                final_response += f"Yêu cầu đặc biệt: {current_order.special_requests}\n"
-            final_response += "\nBạn có muốn xác nhận đơn hàng không? (có/không)"
+                summary += f"Yêu cầu đặc biệt: {current_order.special_requests}\n"
+            summary += "\nBạn có muốn xác nhận đơn hàng không? (có/không)"
+    return summary
+
+def order_tool_call(response: Any) -> Any:
+    """Lời gọi hàm update_order trong response (nếu có)"""
+    for output_item in getattr(response, "output", None) or []:
+        if output_item.type == "function_call" and output_item.name == "update_order":
+            return output_item
+    return None
 
-    return final_response
+def extract_order_delta(response: Any) -> Optional["OrderDelta"]:
+    """Lấy thay đổi đơn hàng từ lời gọi hàm update_order trong response (nếu có)"""
+    call = order_tool_call(response)
+    if call is None:
+        return None
+    from models import OrderDelta
+    try:
+        return OrderDelta.model_validate_json(call.arguments)
+    except ValueError as e:
+        record_error("extract_order_delta", e)
+        return None
+
+def order_followup(request: dict, response: Any, reply: str, result: str, current_order: Order = None,
+                   history: ConversationHistory = None) -> Optional[dict]:
+    """Gửi kết quả lời gọi update_order lại cho model
+
+    Model đã trả lời khách bằng văn bản: kết quả được gửi kèm lượt sau (khi nối response),
+    trả về None. Response chỉ có lời gọi hàm: trả về request gửi kết quả để lấy câu trả lời;
+    gọi history.record_response với response của request đó.
+    """
+    if history is not None:
+        history.record_response(response)
+    call = order_tool_call(response)
+    if call is None:
+        return None
+    output = {
+        "type": "function_call_output",
+        "call_id": call.call_id,
+        "output": json.dumps({"result": result.strip() or "ok", "order": describe_order(current_order)},
+                             ensure_ascii=False),
+    }
+    if reply.strip():
+        if history is not None:
+            history.add_tool_output(output)
+        return None
+    return {
+        "model": request["model"],
+        "instructions": request["instructions"],
+        "previous_response_id": response.id,
+        "input": [output],
+        "tools": request["tools"],
+        "tool_choice": "none",
+    }
+
+def apply_order_delta(delta: "OrderDelta", current_order: Order, menu_index: MenuIndex = None) -> str:
+    """Gộp thay đổi vào đơn hàng; giá luôn lấy từ menu cục bộ, không lấy từ model"""
+    if delta.action == "cancel":
+        return "\n\n" + cancel_order(current_order)
+    menu_index = menu_index or get_menu_index()
+
+    notes = []
+    for line in delta.add:
+        item = menu_index.find_item(line.name)
+        if item is None or item.is_topping:
+            notes.append(f"Không tìm thấy món \"{line.name}\" trong menu.")
+            continue
+        quantity = max(1, min(line.quantity, 50))
+        price = item.price
+        topping_names = []
+        for topping_name in line.toppings:
+            topping = menu_index.find_item(topping_name)
+            if topping is None or not topping.is_topping:
+                notes.append(f"Không có topping \"{topping_name}\".")
+                continue
+            price += topping.price
+            topping_names.append(topping.name)
+        name = f"{item.name} (+ {', '.join(topping_names)})" if topping_names else item.name
+        current_order.add_item(name, price, quantity)
+
+    for line in delta.remove:
+        item = menu_index.find_item(line.name)
+        names = [entry["name"] for entry in current_order.items]
+        # Tên trong đơn có thể kèm topping: "Trà sữa trân châu (+ Thạch phô mai)"
+        match = next((n for n in names if item and (n == item.name or n.startswith(item.name + " (+"))), None)
+        if match is None or not current_order.remove_item(match, line.quantity):
+            notes.append(f"Đơn hàng không có món \"{line.name}\".")
+
+    if delta.special_requests:
+        current_order.add_special_request(delta.special_requests)
+
+    if delta.action == "confirm":
+        notes.append(confirm_order(current_order))
+    return "\n\n" + "\n".join(notes) if notes else ""
+
+def finish_menu_turn(user_input: str, response: Any, current_order: Order = None) -> str:
+    """Phần đuôi câu trả lời sau khi model trả lời: ghi chú đơn hàng và tóm tắt đơn"""
+    delta = extract_order_delta(response) if current_order is not None else None
+    if delta is None or (delta.action == "none" and not (delta.add or delta.remove or delta.special_requests)):
+        return format_order_summary(user_input, current_order)
+    notes = apply_order_delta(delta, current_order)
+    if delta.action in ("confirm", "cancel"):
+        return notes
+    return notes + format_order_summary(user_input, current_order, force=True)
+
+@traced("menu.turn")
+def get_menu_response(user_input: str, current_order: Order = None, history: ConversationHistory = None,
+                      client: "OpenAI" = None) -> str:
+    direct_answer = answer_from_menu(user_input)
+    if direct_answer:
+        return direct_answer + format_order_summary(user_input, current_order)
+
+    client = client or get_client()
+    request = build_menu_request(user_input, history, current_order=current_order)
+    response = scheduler.request("responses", client.responses.create, priority=scheduler.INTERACTIVE, **request)
+
+    # Tạo câu trả lời dựa trên thông tin menu, cập nhật đơn hàng theo update_order
+    final_response = response.output_text
+    summary = finish_menu_turn(user_input, response, current_order)
+    followup = order_followup(request, response, final_response, summary, current_order, history)
+    if followup is not None:
+        response = scheduler.request("responses", client.responses.create, priority=scheduler.INTERACTIVE,
+                                     **followup)
+        if history is not None:
+            history.record_response(response)
+        final_response = response.output_text
+
+    return final_response + summary
+
+@traced("menu.turn")
+def stream_menu_response(user_input: str, current_order: Order = None, history: ConversationHistory = None,
+                         on_delta: DeltaCallback = None, client: "OpenAI" = None) -> Iterator[str]:
+    """Như get_menu_response nhưng trả ra từng đoạn text ngay khi model sinh ra"""
+    direct_answer = answer_from_menu(user_input)
+    if direct_answer:
+        if on_delta:
+            on_delta(direct_answer)
+        yield direct_answer
+        summary = format_order_summary(user_input, current_order)
+    else:
+        client = client or get_client()
+        request = build_menu_request(user_input, history, current_order=current_order)
+        stream = stream_response(client, on_delta, **request)
+        yield from stream
+        summary = finish_menu_turn(user_input, stream.response, current_order)
+        followup = order_followup(request, stream.response, stream.text, summary, current_order, history)
+        if followup is not None:
+            stream = stream_response(client, on_delta, **followup)
+            yield from stream
+            if history is not None:
+                history.record_response(stream.response)
+
+    if summary:
+        if on_delta:
+            on_delta(summary)
+        yield summary
+
+def confirm_order(current_order: Order) -> str:
+    if not current_order.items:
+        return "Bạn chưa đặt món gì cả. Vui lòng đặt món trước khi xác nhận."
+
+    # Xử lý đơn hàng thành công
+    order_id = f"ORD{datetime.now().strftime('%Y%m%d%H%M%S')}"
+    response = f"Đơn hàng của bạn đã được xác nhận!\n"
+    response += f"Mã đơn hàng: {order_id}\n"
+    response += f"Tổng tiền: {current_order.total:,}đ\n"
+    response += "Cảm ơn bạn đã đặt hàng!"
+
+    # Reset đơn hàng
+    current_order.reset()
+    return response
+
+def cancel_order(current_order: Order) -> str:
+    current_order.reset()
+    return "Đơn hàng đã được hủy. Bạn có thể đặt món mới."
 
 def process_order(user_input: str, current_order: Order) -> tuple[str, Order]:
     if "xác nhận" in user_input.lower() and "có" in user_input.lower():
-        if not current_order.items:
-            return "Bạn chưa đặt món gì cả. Vui lòng đặt món trước khi xác nhận.", current_order
-        
-        # Xử lý đơn hàng thành công
-        order_id = f"ORD{datetime.now().strftime('%Y%m%d%H%M%S')}"
-        response = f"Đơn hàng của bạn đã được xác nhận!\n"
-        response += f"Mã đơn hàng: {order_id}\n"
-        response += f"Tổng tiền: {current_order.total:,}đ\n"
-        response += "Cảm ơn bạn đã đặt hàng!"
-        
-        # Reset đơn hàng
-        current_order = Order()
-        return response, current_order
+        return confirm_order(current_order), current_order
     
     elif "hủy" in user_input.lower():
-        current_order = Order()
-        return "Đơn hàng đã được hủy. Bạn có thể đặt món mới.", current_order
+        return cancel_order(current_order), current_order
     
     return "Bạn có muốn xác nhận đơn hàng không? (có/không)", current_order
 
+def print_search_results(response):
+    """In kết quả file_search và trích dẫn của một response (dùng khi gỡ lỗi)"""
+    for output_item in response.output:
+        if output_item.type == "file_search_call":
+            print("Search Results:")
+            for i, result in enumerate(output_item.results, 1):
+                print(f"Results {i}")
+                print(f"Filename: {result.filename}")
+                print(f"Score: {result.score}")
+                print(f"Text snippet: {result.text[:150]}..." if len(result.text) > 150 else f"Text snippet: {result.text}" )
+
+        if output_item.type == "message":
+            for content_item in output_item.content:
+                if content_item.type == "output_text":
+                    print("Annotation: ")
+                    for annotation in content_item.annotations:
+                        if annotation.type == "file_citation":
+                            print(f"- Citation from File: {annotation.filename}")
+
 def main():
+    load_env()
     print("Xin chào! Tôi là nhân viên phục vụ trà sữa. Tôi có thể giúp gì cho bạn?")
     print("Ví dụ:")
     print("- 'Cho tôi xem menu trà sữa'")
@@ -138,37 +406,16 @@ def main():
         # Lưu câu hỏi của người dùng
         history.add_message("user", user_input)
         
-        # Lấy câu trả lời
-        response = get_menu_response(user_input, current_order, history)
-        print("\nAI:", response)
+        # Lấy câu trả lời, in ra ngay khi từng phần được sinh
+        try:
+            response = print_stream(stream_menu_response(user_input, current_order, history))
+        except Exception as e:
+            record_error("menu_main", e)
+            response = "Xin lỗi, hệ thống đang bận, bạn thử lại sau giây lát nhé!"
+            print(response)
         
-        # Lưu câu trả lời của AI
+        # Lưu câu trả lời của AI (đơn hàng đã được cập nhật qua update_order)
         history.add_message("assistant", response)
-        
-        # Xử lý đặt món
-        if current_order.items:
-            response, current_order = process_order(user_input, current_order)
-            print("\nAI:", response)
-            history.add_message("assistant", response)
 
 if __name__ == "__main__":
     main()
-
-
-for output_item in response.output:
-
-    if output_item.type == "file_search_call":
-        print("Search Results:")
-        for i, result in enumerate(output_item.results, 1):
-            print(f"Results {i}")
-            print(f"Filename: {result.filename}")
-            print(f"Score: {result.score}")
-            print(f"Text snippet: {result.text[:150]}..." if len(result.text) > 150 else f"Text snippet: {result.text}" )
-
-    if output_item.type == "message":
-        for content_item in output_item.content:
-            if content_item.type == "output_text":
-                print("Annotation: ")
-                for annotation in content_item.annotations:
-                    if annotation.type == "file_citation":
-                        print(f"- Citation from File: {annotation.filename}")
@@ -1,12 +1,87 @@
-from openai import OpenAI
-from dotenv import load_dotenv
 from datetime import datetime
-load_dotenv()
+from typing import TYPE_CHECKING, Any, Dict, Iterator, Optional, Tuple
+import os
+import re
 
-client = OpenAI()
+from cache import SemanticCache, SingleFlight, numeric_terms
+from clients import get_client, load_env
+from scheduler import INTERACTIVE, request
+from streaming import DeltaCallback, emit, print_stream, stream_response
+from tracing import record_cache, record_error, traced
+from vntext import fold_diacritics, tokenize
+
+if TYPE_CHECKING:
+    from openai import OpenAI
+
+    from market_data import IndicatorEngine
+
+STOCK_INSTRUCTIONS = """Bạn là chuyên gia phân tích chứng khoán. Hãy phân tích và trả lời câu hỏi của người dùng dựa trên thông tin từ trang site:cafef.vn.
+                Nếu câu hỏi liên quan đến:
+                - Dòng tiền: Phân tích dựa trên báo cáo tài chính
+                - Giao dịch: Sử dụng dữ liệu từ bảng lịch sử giao dịch
+                - Định giá: So sánh với các chỉ số P/E, P/B của ngành
+                - Rủi ro: Đánh giá dựa trên biến động giá và khối lượng
+                Nếu không có đủ thông tin, hãy nêu rõ điều đó."""
+
+MARKET_DATA_INSTRUCTIONS = """Bạn là chuyên gia phân tích chứng khoán. Các số liệu giao dịch và chỉ báo kỹ thuật dưới đây đã được tính sẵn từ lịch sử giao dịch.
+                Hãy trả lời câu hỏi của người dùng bằng cách diễn giải các số liệu này (xu hướng, quá mua/quá bán, thanh khoản, mức biến động).
+                Không tự tính lại hay bịa thêm số liệu khác; nếu câu hỏi cần thông tin không có ở đây, hãy nêu rõ điều đó.
+
+{figures}"""
+
+TICKER_RE = re.compile(r"\b[A-Z][A-Z0-9]{2}\b")
+# Viết tắt ba chữ cái hay gặp trong câu hỏi tài chính nhưng không phải mã cổ phiếu
+NOT_TICKERS = {
+    "RSI", "SMA", "EMA", "ROE", "ROA", "ROI", "ROS", "EPS", "NAV", "TTM", "YOY", "QOQ",  # chỉ số
+    "VND", "USD", "EUR", "JPY", "CNY",  # tiền tệ
+    "GDP", "CPI", "FDI", "FED", "ETF", "IPO", "OTC", "ESG",  # vĩ mô, sản phẩm
+    "HNX", "HSX", "ATO", "ATC",  # sàn, phiên khớp lệnh
+    "CEO", "CFO",
+}
+# Từ đệm (đã bỏ dấu) không làm đổi nội dung câu hỏi khi so khớp cache; không gồm "ban" (bán)
+# và "ma" (đường MA) vì bỏ dấu xong chúng trùng với từ có nghĩa
+STOCK_STOPWORDS = {
+    "cua", "nay", "nhu", "the", "nao", "la", "gi", "co", "khong", "hien", "tai", "ra", "sao", "cho",
+    "toi", "hoi", "vay", "a", "nhi", "muc", "do", "thi", "duoc", "ve", "phieu", "ay",
+}
+# Tên chỉ báo: đổi chỉ báo là đổi câu hỏi, phải khớp đúng như số và mã
+INDICATOR_TERMS = {"ma", "sma", "ema", "rsi", "macd", "bollinger"}
+# Câu hỏi trả lời được chỉ bằng dữ liệu giao dịch (không cần web search)
+TECHNICAL_QUESTION_RE = re.compile(
+    r"\b(ma ?\d+|duong trung binh|sma|ema|rsi|macd|bollinger|ky thuat|xu huong|thanh khoan|khop lenh|khoi luong|giao dich"
+    r"|bien dong|rui ro|gia dong cua|gia hien tai|qua mua|qua ban|ho tro|khang cu)\b"
+)
+
+
+def stock_anchors(question: str) -> set:
+    """Số, mã cổ phiếu khác và tên chỉ báo trong câu hỏi: hai câu chỉ dùng chung câu trả lời khi
+    các từ này giống hệt nhau"""
+    anchors = set(numeric_terms(question)) | {term for term in tokenize(question) if term in INDICATOR_TERMS}
+    return anchors | {code for code in TICKER_RE.findall(question) if code not in NOT_TICKERS}
+
+
+def create_answer_cache() -> SemanticCache:
+    """Cache câu trả lời cho câu hỏi gần giống nhau trong cùng phiên giao dịch"""
+    return SemanticCache(
+        threshold=float(os.getenv("STOCK_ANSWER_SIMILARITY", 0.8)),
+        ttl=float(os.getenv("STOCK_ANSWER_CACHE_TTL", 15 * 60)),
+        stopwords=STOCK_STOPWORDS,
+        anchors=stock_anchors,
+    )
 
 class StockAnalysis:
-    def __init__(self):
+    def __init__(self, client: "OpenAI" = None, ticker: str = "VNM", market: Optional["IndicatorEngine"] = None,
+                 answer_cache: Optional[SemanticCache] = None):
+        # None: dùng client chung, chỉ tạo ở lần gọi API đầu tiên
+        self._client = client
+        self.ticker = ticker.upper()
+        self._market = market
+        self._market_checked = market is not None
+        self.answer_cache = answer_cache if answer_cache is not None else create_answer_cache()
+        self.answer_inflight = SingleFlight()
+        self._data_as_of: Dict[str, str] = {}
+        # Quá hạn chót mà gpt-4o chưa kịp trả lời thì scheduler chuyển sang model dự phòng
+        self.deadline = float(os.getenv("STOCK_ANSWER_DEADLINE", 45))
         self.tools = [
             {
                 "type": "web_search_preview",
@@ -15,28 +90,144 @@ class StockAnalysis:
             }
         ]
 
+    @property
+    def client(self) -> "OpenAI":
+        return self._client or get_client()
+
+    @property
+    def market(self) -> Optional["IndicatorEngine"]:
+        # numpy và kho dữ liệu chỉ được nạp ở câu hỏi đầu tiên
+        if not self._market_checked:
+            try:
+                from market_data import get_engine
+            except ImportError:  # chưa cài numpy: chỉ dùng web search như trước
+                get_engine = None
+            self._market = get_engine() if get_engine else None
+            self._market_checked = True
+        return self._market
+
+    def detect_ticker(self, question: str) -> str:
+        """Mã cổ phiếu được nhắc trong câu hỏi (viết hoa, có dữ liệu cục bộ), mặc định self.ticker"""
+        known = set(self.market.store.tickers()) if self.market else set()
+        candidates = [c for c in TICKER_RE.findall(question) if c not in NOT_TICKERS]
+        for candidate in candidates:
+            if candidate in known:
+                return candidate
+        return candidates[0] if candidates else self.ticker
+
+    def market_figures(self, ticker: str) -> Optional[str]:
+        """Số liệu phiên gần nhất đã tính sẵn, None nếu chưa có dữ liệu cho mã này"""
+        snapshot = self.market.snapshot(ticker) if self.market else None
+        if not snapshot:
+            return None
+        from market_data import format_snapshot
+        return format_snapshot(snapshot)
+
+    def answer_key(self, question: str) -> Tuple[str, str]:
+        """(nhóm cache, khóa gộp request) cho câu hỏi
+
+        Nhóm gồm mã và thời điểm dữ liệu (phiên cuối trong kho, hoặc ngày hiện tại nếu
+        chưa có dữ liệu), nên câu trả lời cũ tự hết hiệu lực khi có phiên mới.
+        """
+        ticker = self.detect_ticker(question)
+        snapshot = self.market.snapshot(ticker) if self.market else None
+        as_of = snapshot["as_of"] if snapshot else datetime.now().strftime("%Y-%m-%d")
+        if self._data_as_of.get(ticker) not in (None, as_of):
+            self.answer_cache.invalidate(f"{ticker}|")
+        self._data_as_of[ticker] = as_of
+        group = f"{ticker}|{as_of}"
+        return group, f"{group}|{self.answer_cache.key(self.cache_question(group, question))}"
+
+    @staticmethod
+    def cache_question(group: str, question: str) -> str:
+        # Mã của nhóm cache không cần so khớp lại; các mã khác (so sánh với mã khác) vẫn giữ
+        ticker = group.split("|", 1)[0]
+        return re.sub(rf"\b{re.escape(ticker)}\b", " ", question)
+
+    def cached_answer(self, group: str, question: str) -> Optional[str]:
+        answer = self.answer_cache.get(group, self.cache_question(group, question))
+        record_cache("stock_answer", answer is not None)
+        return answer
+
+    def store_answer(self, group: str, question: str, answer: str):
+        if answer:
+            self.answer_cache.set(group, self.cache_question(group, question), answer)
+
+    def answer_cache_stats(self) -> Dict[str, Any]:
+        stats = self.answer_cache.stats.snapshot()
+        stats["coalesced"] = self.answer_inflight.coalesced
+        return stats
+
+    def build_request(self, question: str) -> dict:
+        ticker = self.detect_ticker(question)
+        figures = self.market_figures(ticker)
+        if figures and TECHNICAL_QUESTION_RE.search(fold_diacritics(question)):
+            # Đủ dữ liệu cục bộ: model chỉ diễn giải số liệu, không cần web search
+            return {
+                "model": "gpt-4o",
+                "input": question,
+                "instructions": MARKET_DATA_INSTRUCTIONS.format(figures=figures),
+            }
+
+        # Thêm URL vào câu hỏi để tìm kiếm trên cafef.vn
+        search_query = f"{question} site:cafef.vn/du-lieu/lich-su-giao-dich-{ticker.lower()}-1.chn"
+        instructions = STOCK_INSTRUCTIONS
+        if figures:
+            instructions += f"\n\nSố liệu giao dịch đã tính sẵn (dùng trực tiếp, không cần tìm lại):\n{figures}"
+        return {
+            "model": "gpt-4o",
+            "tools": self.tools,
+            "input": search_query,
+            "instructions": instructions
+        }
+
+    def _answer(self, group: str, question: str) -> str:
+        # Một request khác có thể vừa lưu câu trả lời trong lúc chờ
+        cached = self.cached_answer(group, question)
+        if cached is not None:
+            return cached
+        response = request("responses", self.client.responses.create, priority=INTERACTIVE,
+                           deadline=self.deadline, **self.build_request(question))
+        self.store_answer(group, question, response.output_text)
+        return response.output_text
+
+    @traced("stock.turn")
     def analyze_stock(self, question: str) -> str:
         try:
-            # Thêm URL vào câu hỏi để tìm kiếm trên cafef.vn
-            search_query = f"{question} site:cafef.vn/du-lieu/lich-su-giao-dich-vnm-1.chn"
-            
-            response = client.responses.create(
-                model="gpt-4o",
-                tools=self.tools,
-                input=search_query,
-                instructions="""Bạn là chuyên gia phân tích chứng khoán. Hãy phân tích và trả lời câu hỏi của người dùng dựa trên thông tin từ trang site:cafef.vn.
-                Nếu câu hỏi liên quan đến:
-                - Dòng tiền: Phân tích dựa trên báo cáo tài chính
-                - Giao dịch: Sử dụng dữ liệu từ bảng lịch sử giao dịch
-                - Định giá: So sánh với các chỉ số P/E, P/B của ngành
-                - Rủi ro: Đánh giá dựa trên biến động giá và khối lượng
-                Nếu không có đủ thông tin, hãy nêu rõ điều đó."""
-            )
-            return response.output_text
+            group, flight_key = self.answer_key(question)
+            cached = self.cached_answer(group, question)
+            if cached is not None:
+                return cached
+            # Các câu hỏi giống nhau đến cùng lúc chỉ gọi model một lần
+            return self.answer_inflight.do(flight_key, lambda: self._answer(group, question))
         except Exception as e:
+            record_error("analyze_stock", e)
             return f"Xin lỗi, có lỗi xảy ra: {str(e)}"
 
+    @traced("stock.turn")
+    def stream_analyze_stock(self, question: str, on_delta: DeltaCallback = None) -> Iterator[str]:
+        """Như analyze_stock nhưng trả ra từng đoạn text ngay khi model sinh ra"""
+        try:
+            group, flight_key = self.answer_key(question)
+            cached = self.cached_answer(group, question)
+            if cached is None and self.answer_inflight.running(flight_key):
+                cached = self.analyze_stock(question)
+            if cached is not None:
+                yield from emit([cached], on_delta)
+                return
+            stream = stream_response(self.client, on_delta, priority=INTERACTIVE, deadline=self.deadline,
+                                     **self.build_request(question))
+            yield from stream
+            self.store_answer(group, question, stream.text)
+        except Exception as e:
+            record_error("stream_analyze_stock", e)
+            message = f"Xin lỗi, có lỗi xảy ra: {str(e)}"
+            if on_delta:
+                on_delta(message)
+            yield message
+
 def main():
+    load_env()
     print("Xin chào! Tôi là chatbot phân tích chứng khoán VNM. Tôi có thể giúp bạn phân tích:")
     print("1. Dòng tiền và khả năng chi trả cổ tức")
     print("2. Định giá cổ phiếu so với ngành")
@@ -59,8 +250,7 @@ def main():
             print("Tạm biệt! Cảm ơn bạn đã sử dụng dịch vụ phân tích chứng khoán!")
             break
             
-        response = analyzer.analyze_stock(user_input)
-        print("\nAI:", response)
+        print_stream(analyzer.stream_analyze_stock(user_input))
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,227 @@
+"""Lịch sử hội thoại giới hạn theo số token, tóm tắt dần các lượt cũ
+
+- Đếm token bằng tiktoken nếu có cài (nạp ở lần đếm đầu tiên), nếu không thì ước lượng
+  theo số byte UTF-8.
+- Khi vượt ngân sách, các lượt cũ nhất được rút gọn vào một đoạn tóm tắt (không gọi model).
+- Phần tóm tắt đơn hàng trong câu trả lời bị bỏ khỏi lịch sử vì đã có trong instructions.
+- chain_responses=True: dùng previous_response_id của Responses API, chỉ gửi các tin nhắn
+  mới kể từ response trước. Lưu ý OpenAI vẫn tính token cho toàn bộ ngữ cảnh được nối,
+  chế độ này giảm dữ liệu gửi đi chứ không giảm token bị tính phí.
+  Kết quả lời gọi hàm của response trước (add_tool_output) được gửi kèm lượt sau để
+  response được nối không còn lời gọi hàm chưa có kết quả.
+- Tin nhắn lưu dạng tuple (role, content, tokens) thay cho dict; to_state()/from_state()
+  chuyển sang dữ liệu thuần để snapshot phiên (xem session_state.py).
+- Số token gửi đi và số token tiết kiệm so với gửi nguyên văn N tin nhắn gần nhất được ghi
+  vào span của lượt (history.input_tokens, history.tokens_saved) và metric
+  history_tokens_total{kind="sent"|"saved"}.
+"""
+import re
+from collections import deque
+from typing import Any, Dict, List, NamedTuple, Optional
+
+from tracing import METRICS, Counter, current_span
+
+HISTORY_TOKENS = Counter("history_tokens_total", "Token lịch sử hội thoại gửi đi và tiết kiệm được mỗi lượt")
+METRICS.append(HISTORY_TOKENS)
+
+_encoding: Any = None
+_encoding_loaded = False
+
+# Tóm tắt đơn hàng / xác nhận do bot tự thêm vào câu trả lời
+ORDER_BLOCK_RE = re.compile(
+    r"\n*(Đơn hàng hiện tại của bạn:|Đơn hàng của bạn đã được xác nhận!).*?(\(có/không\)|Cảm ơn bạn đã đặt hàng!)",
+    re.DOTALL,
+)
+
+
+def _get_encoding() -> Any:
+    global _encoding, _encoding_loaded
+    if not _encoding_loaded:
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding("o200k_base")
+        except Exception:
+            _encoding = None
+        _encoding_loaded = True
+    return _encoding
+
+
+def count_tokens(text: str) -> int:
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text))
+    return len(text.encode("utf-8")) // 4 + 1
+
+
+def compact_message(role: str, content: str) -> str:
+    if role == "assistant":
+        content = ORDER_BLOCK_RE.sub("", content).strip()
+    return content
+
+
+def _clip(text: str, limit: int = 160) -> str:
+    text = " ".join(text.split())
+    return text if len(text) <= limit else text[:limit - 1] + "…"
+
+
+class Message(NamedTuple):
+    role: str
+    content: str
+    tokens: int
+
+    def as_dict(self) -> Dict[str, str]:
+        return {"role": self.role, "content": self.content}
+
+
+class TokenBudgetHistory:
+    """Lịch sử hội thoại giữ trong ngân sách max_tokens, có tóm tắt các lượt cũ"""
+    __slots__ = ("max_tokens", "keep_recent", "summary_tokens", "chain_responses", "_messages", "summary_lines",
+                 "last_response_id", "_pending", "_tool_outputs", "_reply_in_chain", "_naive", "turns", "last_input_tokens",
+                 "last_tokens_saved", "total_tokens_saved")
+
+    def __init__(self, max_tokens: int = 1500, keep_recent: int = 4, summary_tokens: int = 300,
+                 chain_responses: bool = False, naive_window: int = 10):
+        self.max_tokens = max_tokens
+        self.keep_recent = keep_recent
+        self.summary_tokens = min(summary_tokens, max_tokens // 4)
+        self.chain_responses = chain_responses
+        self._messages: List[Message] = []
+        self.summary_lines: List[str] = []
+        self.last_response_id: Optional[str] = None
+        self._pending: List[Message] = []
+        self._tool_outputs: List[Dict[str, Any]] = []
+        self._reply_in_chain = False
+        # Cửa sổ "gửi nguyên văn N tin nhắn" như trước đây, để tính số token tiết kiệm được
+        self._naive = deque(maxlen=naive_window)
+        self.turns = 0
+        self.last_input_tokens = 0
+        self.last_tokens_saved = 0
+        self.total_tokens_saved = 0
+
+    @property
+    def messages(self) -> List[Dict[str, str]]:
+        return [message.as_dict() for message in self._messages]
+
+    def add_message(self, role: str, content: str):
+        self._naive.append(count_tokens(content))
+        content = compact_message(role, content)
+        message = Message(role, content, count_tokens(content))
+        self._messages.append(message)
+        # Câu trả lời của model đã nằm trong response được nối, không cần gửi lại
+        if role == "assistant" and self._reply_in_chain:
+            self._reply_in_chain = False
+        elif self.chain_responses:
+            self._pending.append(message)
+        self._compact()
+
+    @staticmethod
+    def _tokens(messages: List[Message]) -> int:
+        return sum(message.tokens for message in messages)
+
+    def _compact(self):
+        # Rút gọn lượt cũ nhất vào phần tóm tắt cho tới khi vừa ngân sách
+        while len(self._messages) > self.keep_recent and (
+            self._tokens(self._messages) + count_tokens(self.summary) > self.max_tokens
+        ):
+            oldest = self._messages.pop(0)
+            speaker = "Khách" if oldest.role == "user" else "Nhân viên"
+            self.summary_lines.append(f"{speaker}: {_clip(oldest.content)}")
+            while len(self.summary_lines) > 1 and count_tokens(self.summary) > self.summary_tokens:
+                self.summary_lines.pop(0)
+
+    @property
+    def summary(self) -> str:
+        return "\n".join(self.summary_lines)
+
+    def get_messages(self) -> List[Dict[str, str]]:
+        """Tin nhắn cần gửi cho lượt tiếp theo (kèm tóm tắt nếu có)"""
+        tool_outputs = []
+        if self.chain_responses and self.last_response_id:
+            selected = list(self._pending)
+            tool_outputs = list(self._tool_outputs)
+        else:
+            selected = list(self._messages)
+            if self.summary_lines:
+                summary = f"Tóm tắt hội thoại trước đó:\n{self.summary}"
+                selected.insert(0, Message("system", summary, count_tokens(summary)))
+
+        self.turns += 1
+        self.last_input_tokens = self._tokens(selected) + sum(count_tokens(item["output"]) for item in tool_outputs)
+        self.last_tokens_saved = max(0, sum(self._naive) - self.last_input_tokens)
+        self.total_tokens_saved += self.last_tokens_saved
+        HISTORY_TOKENS.inc(self.last_input_tokens, kind="sent")
+        HISTORY_TOKENS.inc(self.last_tokens_saved, kind="saved")
+        current = current_span()
+        if current is not None:
+            current.incr("history.input_tokens", self.last_input_tokens)
+            current.incr("history.tokens_saved", self.last_tokens_saved)
+        return tool_outputs + [message.as_dict() for message in selected]
+
+    def request_options(self) -> Dict[str, Any]:
+        """Tham số thêm cho responses.create khi nối response (previous_response_id)"""
+        if self.chain_responses and self.last_response_id:
+            return {"previous_response_id": self.last_response_id}
+        return {}
+
+    def record_response(self, response: Any):
+        """Ghi nhận response vừa nhận để lượt sau chỉ gửi phần mới"""
+        response_id = getattr(response, "id", None)
+        if self.chain_responses and response_id:
+            self.last_response_id = response_id
+            self._pending = []
+            self._tool_outputs = []
+            self._reply_in_chain = True
+
+    def add_tool_output(self, output: Dict[str, Any]):
+        """Kết quả (function_call_output) cho lời gọi hàm trong response vừa ghi nhận"""
+        if self.chain_responses and self.last_response_id:
+            self._tool_outputs.append(output)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "turns": self.turns,
+            "messages": len(self._messages),
+            "summary_lines": len(self.summary_lines),
+            "last_input_tokens": self.last_input_tokens,
+            "last_tokens_saved": self.last_tokens_saved,
+            "total_tokens_saved": self.total_tokens_saved,
+        }
+
+    def __len__(self) -> int:
+        return len(self._messages)
+
+    def to_state(self) -> Dict[str, Any]:
+        # _pending luôn là phần cuối của chuỗi tin nhắn (phần đầu có thể đã bị tóm tắt): chỉ lưu số lượng
+        pending = min(len(self._pending), len(self._messages))
+        return {
+            "max_tokens": self.max_tokens,
+            "keep_recent": self.keep_recent,
+            "summary_tokens": self.summary_tokens,
+            "chain_responses": self.chain_responses,
+            "messages": [list(message) for message in self._messages],
+            "summary_lines": self.summary_lines,
+            "last_response_id": self.last_response_id,
+            "pending": pending,
+            "tool_outputs": self._tool_outputs,
+            "reply_in_chain": self._reply_in_chain,
+            "naive": list(self._naive),
+            "naive_window": self._naive.maxlen,
+            "counters": [self.turns, self.last_input_tokens, self.last_tokens_saved, self.total_tokens_saved],
+        }
+
+    @classmethod
+    def from_state(cls, state: Dict[str, Any]) -> "TokenBudgetHistory":
+        history = cls.__new__(cls)
+        history.max_tokens = state["max_tokens"]
+        history.keep_recent = state["keep_recent"]
+        history.summary_tokens = state["summary_tokens"]
+        history.chain_responses = state["chain_responses"]
+        history._messages = [Message(*message) for message in state["messages"]]
+        history.summary_lines = list(state["summary_lines"])
+        history.last_response_id = state["last_response_id"]
+        history._pending = history._messages[len(history._messages) - state["pending"]:] if state["pending"] else []
+        history._tool_outputs = list(state.get("tool_outputs", []))
+        history._reply_in_chain = state["reply_in_chain"]
+        history._naive = deque(state["naive"], maxlen=state["naive_window"])
+        history.turns, history.last_input_tokens, history.last_tokens_saved, history.total_tokens_saved = state["counters"]
+        return history
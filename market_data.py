@@ -0,0 +1,349 @@
+"""Dữ liệu giao dịch (OHLCV) cục bộ và chỉ báo kỹ thuật tính bằng NumPy
+
+Mỗi mã lưu thành một thư mục các cột nhị phân (date, open, high, low, close, volume,
+value) đọc bằng np.memmap; nạp thêm phiên mới chỉ ghi nối vào cuối file.
+
+    python market_data.py ingest VNM lich-su-vnm.csv
+    python market_data.py show VNM
+"""
+import argparse
+import csv
+import json
+import os
+import threading
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from vntext import fold_diacritics
+
+COLUMNS = ("date", "open", "high", "low", "close", "volume", "value")
+DTYPES = {"date": "datetime64[D]", "volume": "float64", "value": "float64"}
+
+# Tên cột thường gặp (đã bỏ dấu), ví dụ file tải từ cafef.vn
+COLUMN_ALIASES = {
+    "date": ("date", "ngay", "time", "trading date"),
+    "open": ("open", "gia mo cua", "mo cua"),
+    "high": ("high", "gia cao nhat", "cao nhat"),
+    "low": ("low", "gia thap nhat", "thap nhat"),
+    "close": ("close", "gia dong cua", "dong cua", "gia dieu chinh"),
+    "volume": ("volume", "kl khop lenh", "khoi luong khop lenh", "khoi luong"),
+    "value": ("value", "gt khop lenh", "gia tri khop lenh", "gia tri"),
+}
+
+
+def _column_name(header: str) -> Optional[str]:
+    folded = " ".join(fold_diacritics(header).replace("_", " ").split())
+    for column, aliases in COLUMN_ALIASES.items():
+        if folded in aliases:
+            return column
+    return None
+
+
+def _parse_number(value: str) -> float:
+    value = (value or "").strip().replace(",", "")
+    return float(value) if value else np.nan
+
+
+def _parse_date(value: str) -> np.datetime64:
+    value = value.strip()
+    if "/" in value:
+        day, month, year = value.split("/")
+        value = f"{year}-{int(month):02d}-{int(day):02d}"
+    return np.datetime64(value[:10], "D")
+
+
+def _finish_columns(data: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+    if "value" not in data:
+        data["value"] = data["close"] * data["volume"]
+    order = np.argsort(data["date"], kind="stable")
+    return {column: np.asarray(data[column], dtype=DTYPES.get(column, "float64"))[order] for column in COLUMNS}
+
+
+def read_csv(path: str) -> Dict[str, np.ndarray]:
+    """Đọc lịch sử giao dịch từ CSV (cột ngày, giá mở/cao/thấp/đóng, khối lượng, giá trị)"""
+    with open(path, encoding="utf-8-sig", newline="") as f:
+        reader = csv.reader(f)
+        headers = [_column_name(h) for h in next(reader)]
+        rows = list(reader)
+    data = {}
+    for index, column in enumerate(headers):
+        if column is None or column in data:
+            continue
+        values = [row[index] for row in rows if len(row) > index]
+        data[column] = np.array([_parse_date(v) for v in values]) if column == "date" else \
+            np.array([_parse_number(v) for v in values], dtype="float64")
+    missing = {"date", "close", "volume"} - set(data)
+    if missing:
+        raise ValueError(f"Thiếu cột {sorted(missing)} trong {path}")
+    for column in ("open", "high", "low"):
+        data.setdefault(column, data["close"])
+    return _finish_columns(data)
+
+
+def read_parquet(path: str) -> Dict[str, np.ndarray]:
+    """Đọc lịch sử giao dịch từ Parquet (cần cài pandas + pyarrow)"""
+    import pandas as pd
+
+    frame = pd.read_parquet(path)
+    frame.columns = [_column_name(str(c)) or str(c) for c in frame.columns]
+    data = {c: frame[c].to_numpy() for c in COLUMNS if c in frame.columns}
+    data["date"] = frame["date"].to_numpy().astype("datetime64[D]")
+    return _finish_columns(data)
+
+
+class MarketStore:
+    """Kho dữ liệu dạng cột trên đĩa, mỗi cột một file nhị phân đọc bằng memmap"""
+    def __init__(self, root: str):
+        self.root = root
+        self._lock = threading.Lock()
+
+    def _path(self, ticker: str, column: str = "") -> str:
+        return os.path.join(self.root, ticker.upper(), column)
+
+    def tickers(self) -> List[str]:
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(name for name in os.listdir(self.root) if os.path.exists(self._path(name, "meta.json")))
+
+    def length(self, ticker: str) -> int:
+        try:
+            with open(self._path(ticker, "meta.json"), encoding="utf-8") as f:
+                return json.load(f)["length"]
+        except FileNotFoundError:
+            return 0
+
+    def read(self, ticker: str) -> Dict[str, np.ndarray]:
+        length = self.length(ticker)
+        if not length:
+            return {}
+        return {
+            column: np.memmap(self._path(ticker, f"{column}.bin"), dtype=DTYPES.get(column, "float64"),
+                              mode="r", shape=(length,))
+            for column in COLUMNS
+        }
+
+    def append(self, ticker: str, bars: Dict[str, np.ndarray]) -> int:
+        """Ghi nối các phiên mới hơn phiên cuối đã lưu; trả về số phiên được thêm"""
+        with self._lock:
+            existing = self.read(ticker)
+            dates = bars["date"]
+            if existing:
+                keep = dates > existing["date"][-1]
+                bars = {column: values[keep] for column, values in bars.items()}
+            added = len(bars["date"])
+            if not added:
+                return 0
+            length = self.length(ticker) + added
+            os.makedirs(self._path(ticker), exist_ok=True)
+            for column in COLUMNS:
+                with open(self._path(ticker, f"{column}.bin"), "ab") as f:
+                    f.write(np.ascontiguousarray(bars[column], dtype=DTYPES.get(column, "float64")).tobytes())
+            # meta.json ghi sau cùng: nếu bị ngắt giữa chừng, phần thừa ở cuối file cột bị bỏ qua
+            tmp_path = self._path(ticker, "meta.json.tmp")
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"length": length, "columns": list(COLUMNS)}, f)
+            os.replace(tmp_path, self._path(ticker, "meta.json"))
+            return added
+
+
+# --- Chỉ báo kỹ thuật (vector hóa) ---
+
+def sma(values: np.ndarray, window: int) -> np.ndarray:
+    out = np.full(len(values), np.nan)
+    if len(values) >= window:
+        cumsum = np.cumsum(np.insert(values, 0, 0.0))
+        out[window - 1:] = (cumsum[window:] - cumsum[:-window]) / window
+    return out
+
+
+def rolling_std(values: np.ndarray, window: int) -> np.ndarray:
+    out = np.full(len(values), np.nan)
+    if len(values) >= window:
+        windows = np.lib.stride_tricks.sliding_window_view(values, window)
+        out[window - 1:] = windows.std(axis=1, ddof=0)
+    return out
+
+
+def ema(values: np.ndarray, alpha: float, initial: Optional[float] = None, block: int = 128) -> np.ndarray:
+    """EMA tính theo khối bằng công thức đóng (không lặp từng phần tử trong Python)
+
+    initial: giá trị EMA trước phần tử đầu tiên (để cập nhật tiếp khi có phiên mới).
+    """
+    values = np.asarray(values, dtype="float64")
+    out = np.empty(len(values))
+    decay = 1.0 - alpha
+    prev = values[0] if initial is None and len(values) else initial
+    for start in range(0, len(values), block):
+        chunk = values[start:start + block]
+        powers = decay ** np.arange(1, len(chunk) + 1)
+        # ema_t = decay^t * prev + alpha * sum_{i<=t} decay^(t-i) * x_i
+        out[start:start + len(chunk)] = powers * (prev + alpha * np.cumsum(chunk / powers))
+        prev = out[start + len(chunk) - 1]
+    return out
+
+
+def rsi(close: np.ndarray, period: int = 14):
+    """RSI (làm trơn Wilder); trả về (rsi, avg_gain, avg_loss) để cập nhật tiếp"""
+    change = np.diff(close, prepend=close[0])
+    gain, loss = np.clip(change, 0, None), np.clip(-change, 0, None)
+    avg_gain, avg_loss = ema(gain, 1.0 / period, 0.0), ema(loss, 1.0 / period, 0.0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        values = 100.0 - 100.0 / (1.0 + avg_gain / avg_loss)
+    values = np.where(avg_loss == 0, 100.0, values)
+    values[:period] = np.nan
+    return values, avg_gain, avg_loss
+
+
+def compute_indicators(bars: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+    close = np.asarray(bars["close"], dtype="float64")
+    ema12, ema26 = ema(close, 2 / 13), ema(close, 2 / 27)
+    macd = ema12 - ema26
+    signal = ema(macd, 2 / 10)
+    rsi14, avg_gain, avg_loss = rsi(close)
+    sma20, std20 = sma(close, 20), rolling_std(close, 20)
+    log_returns = np.diff(np.log(close), prepend=np.nan)
+    return {
+        "sma20": sma20,
+        "sma50": sma(close, 50),
+        "sma200": sma(close, 200),
+        "ema12": ema12,
+        "ema26": ema26,
+        "macd": macd,
+        "macd_signal": signal,
+        "macd_hist": macd - signal,
+        "rsi14": rsi14,
+        "rsi_avg_gain": avg_gain,
+        "rsi_avg_loss": avg_loss,
+        "bb_upper": sma20 + 2 * std20,
+        "bb_lower": sma20 - 2 * std20,
+        "volatility20": rolling_std(np.nan_to_num(log_returns), 20) * np.sqrt(252),
+        "avg_value20": sma(np.asarray(bars["value"], dtype="float64"), 20),
+        "avg_volume20": sma(np.asarray(bars["volume"], dtype="float64"), 20),
+    }
+
+
+class IndicatorEngine:
+    """Tính và lưu chỉ báo theo mã; khi có phiên mới chỉ tính phần tăng thêm"""
+    TAIL = 260  # đủ cho SMA200 và các cửa sổ trượt
+
+    def __init__(self, store: MarketStore):
+        self.store = store
+        self._cache: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def indicators(self, ticker: str) -> Dict[str, np.ndarray]:
+        ticker = ticker.upper()
+        with self._lock:
+            bars = self.store.read(ticker)
+            if not bars:
+                return {}
+            cached = self._cache.get(ticker)
+            length = len(bars["date"])
+            if cached is None or cached["length"] > length:
+                result = compute_indicators(bars)
+            elif cached["length"] == length:
+                return cached["indicators"]
+            else:
+                result = self._extend(bars, cached)
+            self._cache[ticker] = {"length": length, "indicators": result}
+            return result
+
+    def _extend(self, bars: Dict[str, np.ndarray], cached: Dict[str, Any]) -> Dict[str, np.ndarray]:
+        old = cached["indicators"]
+        start = cached["length"]
+        close = np.asarray(bars["close"], dtype="float64")
+        new_close = close[start:]
+
+        # Các EMA nối tiếp từ giá trị cuối đã tính
+        ema12 = ema(new_close, 2 / 13, old["ema12"][-1])
+        ema26 = ema(new_close, 2 / 27, old["ema26"][-1])
+        macd = ema12 - ema26
+        signal = ema(macd, 2 / 10, old["macd_signal"][-1])
+        change = np.diff(close[start - 1:])
+        avg_gain = ema(np.clip(change, 0, None), 1 / 14, old["rsi_avg_gain"][-1])
+        avg_loss = ema(np.clip(-change, 0, None), 1 / 14, old["rsi_avg_loss"][-1])
+        with np.errstate(divide="ignore", invalid="ignore"):
+            rsi14 = np.where(avg_loss == 0, 100.0, 100.0 - 100.0 / (1.0 + avg_gain / avg_loss))
+
+        # Chỉ báo theo cửa sổ trượt: tính lại trên đoạn đuôi rồi lấy phần mới
+        tail_start = max(0, start - self.TAIL)
+        tail = compute_indicators({column: values[tail_start:] for column, values in bars.items()})
+        new = {name: values[start - tail_start:] for name, values in tail.items()}
+        new.update({
+            "ema12": ema12, "ema26": ema26, "macd": macd, "macd_signal": signal, "macd_hist": macd - signal,
+            "rsi14": rsi14, "rsi_avg_gain": avg_gain, "rsi_avg_loss": avg_loss,
+        })
+        return {name: np.concatenate([old[name], new[name]]) for name in old}
+
+    def snapshot(self, ticker: str) -> Optional[Dict[str, Any]]:
+        """Số liệu của phiên gần nhất, dùng để đưa vào prompt"""
+        values = self.indicators(ticker)
+        if not values:
+            return None
+        bars = self.store.read(ticker)
+        close = bars["close"]
+        snapshot = {"ticker": ticker.upper(), "as_of": str(bars["date"][-1]), "close": float(close[-1]),
+                    "sessions": len(close)}
+        if len(close) > 1:
+            snapshot["change_pct"] = float((close[-1] / close[-2] - 1) * 100)
+        for name in ("sma20", "sma50", "sma200", "rsi14", "macd", "macd_signal", "macd_hist",
+                     "bb_upper", "bb_lower", "volatility20", "avg_value20", "avg_volume20"):
+            value = float(values[name][-1])
+            if not np.isnan(value):
+                snapshot[name] = value
+        return snapshot
+
+
+def format_snapshot(snapshot: Dict[str, Any]) -> str:
+    labels = {
+        "close": "Giá đóng cửa", "change_pct": "Thay đổi so với phiên trước (%)",
+        "sma20": "SMA20", "sma50": "SMA50", "sma200": "SMA200", "rsi14": "RSI(14)",
+        "macd": "MACD(12,26)", "macd_signal": "Đường tín hiệu MACD(9)", "macd_hist": "Histogram MACD",
+        "bb_upper": "Bollinger trên (20,2)", "bb_lower": "Bollinger dưới (20,2)",
+        "volatility20": "Biến động 20 phiên (năm hóa)", "avg_value20": "Giá trị khớp lệnh TB 20 phiên",
+        "avg_volume20": "Khối lượng khớp lệnh TB 20 phiên",
+    }
+    lines = [f"Mã {snapshot['ticker']}, dữ liệu đến phiên {snapshot['as_of']} ({snapshot['sessions']} phiên):"]
+    for name, label in labels.items():
+        if name in snapshot:
+            value = snapshot[name]
+            text = f"{value:.1%}" if name == "volatility20" else f"{value:,.2f}"
+            lines.append(f"- {label}: {text}")
+    return "\n".join(lines)
+
+
+_engine: Optional[IndicatorEngine] = None
+
+
+def get_engine() -> IndicatorEngine:
+    """Engine dùng chung, dữ liệu ở MARKET_DATA_DIR (mặc định market_data/ cạnh module)"""
+    global _engine
+    if _engine is None:
+        root = os.getenv("MARKET_DATA_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "market_data"))
+        _engine = IndicatorEngine(MarketStore(root))
+    return _engine
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Quản lý dữ liệu giao dịch cục bộ")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    ingest = subparsers.add_parser("ingest", help="Nạp lịch sử giao dịch từ CSV/Parquet")
+    ingest.add_argument("ticker")
+    ingest.add_argument("path")
+    show = subparsers.add_parser("show", help="In số liệu phiên gần nhất")
+    show.add_argument("ticker")
+    args = parser.parse_args()
+
+    engine = get_engine()
+    if args.command == "ingest":
+        bars = read_parquet(args.path) if args.path.endswith(".parquet") else read_csv(args.path)
+        added = engine.store.append(args.ticker, bars)
+        print(f"Đã thêm {added} phiên cho {args.ticker.upper()}")
+    else:
+        snapshot = engine.snapshot(args.ticker)
+        print(format_snapshot(snapshot) if snapshot else f"Chưa có dữ liệu cho {args.ticker.upper()}")
+
+
+if __name__ == "__main__":
+    main()
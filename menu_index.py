@@ -0,0 +1,168 @@
+"""Chỉ mục menu trà sữa cục bộ: trả lời ngay các câu hỏi giá/mô tả đơn giản
+
+Menu được đọc từ file JSON (danh sách món) hoặc CSV với các cột
+name, price, description, category, toppings (toppings cách nhau bằng "|"), ví dụ:
+
+    [{"name": "Trà sữa trân châu", "price": 30000, "category": "trà sữa",
+      "description": "...", "toppings": ["Trân châu đen"]}]
+
+Topping nên được khai báo là món riêng với category "topping" để có giá.
+Tìm kiếm dùng BM25 trên âm tiết đã bỏ dấu (và cặp âm tiết liền nhau).
+"""
+import csv
+import json
+import math
+import os
+import re
+import unicodedata
+from collections import Counter
+from typing import List, Optional, Tuple
+
+from vntext import fold_diacritics, tokenize
+
+# Câu hỏi giá: "giá" có dấu (trên văn bản gốc, để không nhầm "gia đình"), hoặc các cụm hỏi giá
+# trên văn bản đã bỏ dấu cho người gõ không dấu
+PRICE_WORD_RE = re.compile(r"(?<!\w)giá(?!\w)")
+PRICE_QUESTION_RE = re.compile(r"\b(gia bao nhieu|gia the nao|gia sao|bao nhieu|bao tien|nhieu tien|het bao)\b")
+DESCRIPTION_QUESTION_RE = re.compile(r"\b(mo ta|la gi|nhu the nao|the nao|co gi|vi gi|gioi thieu)\b")
+TOPPING_LIST_RE = re.compile(r"\btopping\b.*\b(nao|gi|nhung|gom)\b|\b(nhung|cac)\b.*\btopping\b")
+MENU_LIST_RE = re.compile(r"\b(xem menu|cho .*menu|menu co|danh sach mon|co nhung mon|co nhung loai)\b")
+
+
+class MenuItem:
+    def __init__(self, name: str, price: float, description: str = "", category: str = "", toppings: List[str] = None):
+        self.name = name
+        self.price = price
+        self.description = description
+        self.category = category
+        self.toppings = toppings or []
+
+    @property
+    def is_topping(self) -> bool:
+        return fold_diacritics(self.category) == "topping"
+
+    def to_snippet(self) -> str:
+        snippet = f"{self.name} ({self.category or 'món'}): {self.price:,.0f}đ"
+        if self.description:
+            snippet += f". {self.description.rstrip('.')}"
+        if self.toppings:
+            snippet += f". Topping kèm: {', '.join(self.toppings)}"
+        return snippet
+
+
+def load_menu(path: str) -> List[MenuItem]:
+    """Đọc menu từ file JSON hoặc CSV"""
+    if path.lower().endswith(".csv"):
+        with open(path, encoding="utf-8-sig", newline="") as f:
+            rows = list(csv.DictReader(f))
+        for row in rows:
+            row["toppings"] = [t.strip() for t in (row.get("toppings") or "").split("|") if t.strip()]
+    else:
+        with open(path, encoding="utf-8") as f:
+            rows = json.load(f)
+    return [
+        MenuItem(
+            name=row["name"].strip(),
+            price=_parse_price(row["price"]),
+            description=(row.get("description") or "").strip(),
+            category=(row.get("category") or "").strip(),
+            toppings=list(row.get("toppings") or []),
+        )
+        for row in rows
+    ]
+
+
+def _parse_price(value) -> float:
+    price = float(value)
+    return int(price) if price.is_integer() else price
+
+
+def _terms(text: str) -> List[str]:
+    tokens = tokenize(text)
+    return tokens + [f"{a}_{b}" for a, b in zip(tokens, tokens[1:])]
+
+
+class MenuIndex:
+    """Chỉ mục BM25 trên tên, loại, mô tả và topping của từng món"""
+    def __init__(self, items: List[MenuItem], k1: float = 1.5, b: float = 0.75):
+        self.items = items
+        self.k1 = k1
+        self.b = b
+        # Tên món được lặp lại để có trọng số cao hơn mô tả
+        self._docs = [
+            Counter(_terms(f"{item.name} {item.name} {item.category} {item.description} {' '.join(item.toppings)}"))
+            for item in items
+        ]
+        self._lengths = [sum(doc.values()) for doc in self._docs]
+        self._avg_length = sum(self._lengths) / len(self._lengths) if items else 0.0
+        df = Counter(term for doc in self._docs for term in doc)
+        n = len(items)
+        self._idf = {term: math.log(1 + (n - freq + 0.5) / (freq + 0.5)) for term, freq in df.items()}
+        self._name_tokens = [tuple(tokenize(item.name)) for item in items]
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def search(self, query: str, k: int = 3) -> List[Tuple[MenuItem, float]]:
+        terms = _terms(query)
+        scores = []
+        for item, doc, length in zip(self.items, self._docs, self._lengths):
+            score = 0.0
+            for term in terms:
+                tf = doc.get(term)
+                if tf:
+                    norm = tf + self.k1 * (1 - self.b + self.b * length / self._avg_length)
+                    score += self._idf[term] * tf * (self.k1 + 1) / norm
+            if score > 0:
+                scores.append((item, score))
+        scores.sort(key=lambda pair: pair[1], reverse=True)
+        return scores[:k]
+
+    def find_item(self, query: str) -> Optional[MenuItem]:
+        """Món được nhắc đúng tên trong câu hỏi (ưu tiên tên dài nhất), nếu có"""
+        text = f" {' '.join(tokenize(query))} "
+        best, best_length = None, 0
+        for item, name_tokens in zip(self.items, self._name_tokens):
+            if len(name_tokens) > best_length and f" {' '.join(name_tokens)} " in text:
+                best, best_length = item, len(name_tokens)
+        return best
+
+    def answer(self, question: str) -> Optional[str]:
+        """Trả lời trực tiếp câu hỏi giá/mô tả/danh sách; None nếu cần hỏi model"""
+        folded = " ".join(tokenize(question))
+        if TOPPING_LIST_RE.search(folded):
+            toppings = [item for item in self.items if item.is_topping]
+            if toppings:
+                return "Các loại topping hiện có:\n" + "\n".join(f"- {t.name}: {t.price:,.0f}đ" for t in toppings)
+        if MENU_LIST_RE.search(folded):
+            drinks = [item for item in self.items if not item.is_topping]
+            if drinks:
+                return "Menu của quán:\n" + "\n".join(f"- {d.name}: {d.price:,.0f}đ" for d in drinks)
+
+        item = self.find_item(question)
+        if item is None:
+            return None
+        if PRICE_WORD_RE.search(unicodedata.normalize("NFC", question).lower()) or PRICE_QUESTION_RE.search(folded):
+            return f"{item.name} có giá {item.price:,.0f}đ."
+        if DESCRIPTION_QUESTION_RE.search(folded) and item.description:
+            answer = f"{item.name}: {item.description}"
+            if item.toppings:
+                answer += f"\nTopping kèm: {', '.join(item.toppings)}."
+            return answer + f"\nGiá: {item.price:,.0f}đ."
+        return None
+
+    def snippets(self, question: str, k: int = 3) -> str:
+        """Các món liên quan nhất, dùng để đưa vào prompt thay cho file_search"""
+        return "\n".join(f"- {item.to_snippet()}" for item, _ in self.search(question, k))
+
+
+_index: Optional[MenuIndex] = None
+
+
+def get_menu_index() -> MenuIndex:
+    """Chỉ mục menu dùng chung, đọc từ MENU_PATH (mặc định menu.json cạnh module)"""
+    global _index
+    if _index is None:
+        path = os.getenv("MENU_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "menu.json"))
+        _index = MenuIndex(load_menu(path) if os.path.exists(path) else [])
+    return _index
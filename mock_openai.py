@@ -0,0 +1,610 @@
+"""Client giả lập OpenAI chạy cục bộ, dùng cho benchmark mà không tốn quota API
+
+- MockOpenAI: thay OpenAI() ngay trong process (chat.completions, responses, stream).
+- MockServer: cùng logic nhưng phục vụ qua HTTP (/v1/chat/completions, /v1/responses, SSE),
+  để chạy bot với client OpenAI thật: OPENAI_BASE_URL=http://127.0.0.1:8100/v1
+- files + batches: Batch API giả lập (JSONL vào, JSONL ra); batch hoàn tất ở lần
+  retrieve đầu tiên để vòng chờ của job precompute cũng được chạy thử.
+
+Độ trễ lấy theo phân phối cấu hình được ("0.5", "uniform:0.3,0.8", "normal:0.5,0.1",
+"lognormal:0.5,0.4" (trung vị, sigma), "exp:0.5"), có thể chèn lỗi 429/500/timeout
+và trả về các mục web_search_call, file_search_call, function_call như API thật.
+
+    python mock_openai.py --port 8100 --latency lognormal:0.6,0.4 --error-rate 0.02
+"""
+import argparse
+import itertools
+import json
+import math
+import os
+import random
+import threading
+import time
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple, Union
+
+ERROR_KINDS = ("rate_limit", "server", "timeout")
+ERROR_STATUS = {"rate_limit": 429, "server": 500, "timeout": 408}
+
+
+def estimate_tokens(value: Any) -> int:
+    """Ước lượng số token (~4 ký tự một token)"""
+    if not isinstance(value, str):
+        value = json.dumps(value, ensure_ascii=False, default=str)
+    return max(1, len(value) // 4)
+
+
+def sample_from_schema(schema: Dict[str, Any], defs: Optional[Dict[str, Any]] = None, array_length: int = 3) -> Any:
+    """Sinh dữ liệu hợp lệ theo JSON schema (đủ cho các schema Pydantic trong repo)"""
+    defs = defs if defs is not None else schema.get("$defs", {})
+    if "$ref" in schema:
+        return sample_from_schema(defs[schema["$ref"].split("/")[-1]], defs, array_length)
+    if "anyOf" in schema:
+        return sample_from_schema(schema["anyOf"][0], defs, array_length)
+    if "enum" in schema:
+        return schema["enum"][0]
+
+    schema_type = schema.get("type")
+    if schema_type == "object":
+        return {
+            name: sample_from_schema(prop, defs, array_length)
+            for name, prop in schema.get("properties", {}).items()
+        }
+    if schema_type == "array":
+        return [sample_from_schema(schema.get("items", {}), defs, array_length) for _ in range(array_length)]
+    if schema_type == "integer":
+        return 2
+    if schema_type == "number":
+        return 1.0
+    if schema_type == "boolean":
+        return False
+    if schema_type == "null":
+        return None
+    return schema.get("title", "mock")
+
+
+def parse_latency(spec: Union[str, float]) -> Callable[[random.Random], float]:
+    """Phân phối độ trễ (giây) từ chuỗi cấu hình, ví dụ "lognormal:0.5,0.4" """
+    if isinstance(spec, (int, float)):
+        return lambda rng: float(spec)
+    name, _, params = str(spec).partition(":")
+    if not params:
+        value = float(name)
+        return lambda rng: value
+    args = [float(p) for p in params.split(",")]
+    if name == "uniform":
+        return lambda rng: rng.uniform(args[0], args[1])
+    if name == "normal":
+        return lambda rng: max(0.0, rng.gauss(args[0], args[1]))
+    if name == "lognormal":
+        return lambda rng: rng.lognormvariate(math.log(args[0]), args[1])
+    if name == "exp":
+        return lambda rng: rng.expovariate(1.0 / args[0])
+    raise ValueError(f"Không hỗ trợ phân phối độ trễ: {spec}")
+
+
+class MockAPIError(Exception):
+    """Lỗi được chèn vào (kind: rate_limit, server hoặc timeout)"""
+    def __init__(self, kind: str):
+        super().__init__(f"Injected {kind} error")
+        self.kind = kind
+        self.status = ERROR_STATUS[kind]
+
+    def to_openai(self, url: str) -> Exception:
+        # Cùng loại exception mà SDK openai ném ra, để code xử lý lỗi chạy như thật
+        import httpx
+        import openai
+
+        request = httpx.Request("POST", url)
+        if self.kind == "timeout":
+            return openai.APITimeoutError(request=request)
+        response = httpx.Response(self.status, request=request)
+        error_class = openai.RateLimitError if self.kind == "rate_limit" else openai.InternalServerError
+        return error_class(str(self), response=response, body=None)
+
+
+class MockStats:
+    """Đếm số request và token mà client giả lập đã phục vụ"""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.requests = 0
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.errors = 0
+        self.tool_calls = 0
+        self.by_endpoint = {}
+
+    def record(self, endpoint: str, input_tokens: int, output_tokens: int, tool_calls: int = 0):
+        with self._lock:
+            self.requests += 1
+            self.input_tokens += input_tokens
+            self.output_tokens += output_tokens
+            self.tool_calls += tool_calls
+            self.by_endpoint[endpoint] = self.by_endpoint.get(endpoint, 0) + 1
+
+    def record_error(self):
+        with self._lock:
+            self.errors += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "input_tokens": self.input_tokens,
+                "output_tokens": self.output_tokens,
+                "total_tokens": self.input_tokens + self.output_tokens,
+                "errors": self.errors,
+                "tool_calls": self.tool_calls,
+                "by_endpoint": dict(self.by_endpoint),
+            }
+
+
+def _namespace(value: Any) -> Any:
+    if isinstance(value, dict):
+        return SimpleNamespace(**{k: _namespace(v) for k, v in value.items()})
+    if isinstance(value, list):
+        return [_namespace(v) for v in value]
+    return value
+
+
+def _output_text(payload: Dict[str, Any]) -> str:
+    return "".join(
+        part["text"]
+        for item in payload["output"] if item["type"] == "message"
+        for part in item["content"] if part["type"] == "output_text"
+    )
+
+
+def last_user_text(value: Any) -> str:
+    if isinstance(value, str):
+        return value
+    for message in reversed(value or []):
+        if isinstance(message, dict) and message.get("role") == "user":
+            content = message.get("content")
+            return content if isinstance(content, str) else json.dumps(content, ensure_ascii=False)
+    return ""
+
+
+class MockOpenAI:
+    """Thay thế OpenAI() với cùng giao diện chat.completions và responses
+
+    handlers: ánh xạ tên json_schema (hoặc "chat"/"text") tới hàm nhận kwargs của request
+    và trả về nội dung đầu ra (dict hoặc str). Với function tool, handler theo tên hàm trả
+    về arguments (dict) hoặc None nếu model không gọi hàm.
+    latency: số giây hoặc chuỗi phân phối (xem parse_latency); jitter chỉ áp dụng khi là số.
+    error_rate: xác suất một request lỗi, loại lỗi chọn ngẫu nhiên trong error_kinds.
+    tool_latency: thời gian thêm cho mỗi lần gọi web_search / file_search.
+    """
+    def __init__(self, latency: Union[float, str] = 0.5, jitter: float = 0.1, per_output_token: float = 0.002,
+                 handlers: Optional[Dict[str, Callable[[Dict[str, Any]], Any]]] = None, seed: int = 0,
+                 error_rate: float = 0.0, error_kinds: Tuple[str, ...] = ERROR_KINDS, tool_latency: float = 0.0):
+        if isinstance(latency, (int, float)):
+            base = float(latency)
+            self.latency = lambda rng: base + rng.uniform(-jitter, jitter)
+        else:
+            self.latency = parse_latency(latency)
+        self.per_output_token = per_output_token
+        self.handlers = handlers or {}
+        self.error_rate = error_rate
+        self.error_kinds = error_kinds
+        self.tool_latency = tool_latency
+        self.stats = MockStats()
+        self._random = random.Random(seed)
+        self._random_lock = threading.Lock()
+        self._ids = itertools.count(1)
+
+        self._files: Dict[str, Dict[str, Any]] = {}
+        self._batches: Dict[str, Dict[str, Any]] = {}
+
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create_chat_completion))
+        self.responses = SimpleNamespace(create=self._create_response)
+        self.files = SimpleNamespace(create=self._create_file, retrieve=self._retrieve_file,
+                                     content=self._file_content)
+        self.batches = SimpleNamespace(create=self._create_batch, retrieve=self._retrieve_batch)
+
+    def _base_delay(self) -> float:
+        with self._random_lock:
+            return max(0.0, self.latency(self._random))
+
+    def _maybe_fail(self):
+        if not self.error_rate:
+            return
+        with self._random_lock:
+            failed = self._random.random() < self.error_rate
+            kind = self._random.choice(self.error_kinds)
+        if failed:
+            self.stats.record_error()
+            raise MockAPIError(kind)
+
+    def _content(self, name: str, schema: Optional[Dict[str, Any]], request: Dict[str, Any], default: str) -> str:
+        handler = self.handlers.get(name)
+        if handler:
+            content = handler(request)
+        elif schema is not None:
+            content = sample_from_schema(schema)
+        else:
+            content = default
+        return content if isinstance(content, str) else json.dumps(content, ensure_ascii=False)
+
+    # --- Payload dạng JSON như API thật (dùng chung cho client giả lập và MockServer) ---
+
+    def chat_payload(self, request: Dict[str, Any], sleep: bool = True) -> Dict[str, Any]:
+        self._maybe_fail()
+        json_schema = (request.get("response_format") or {}).get("json_schema") or {}
+        content = self._content(json_schema.get("name", "chat"), json_schema.get("schema"), request, "150.000 VND")
+        input_tokens = estimate_tokens(request.get("messages"))
+        output_tokens = estimate_tokens(content)
+        if sleep:
+            time.sleep(self._base_delay() + output_tokens * self.per_output_token)
+        self.stats.record("chat.completions", input_tokens, output_tokens)
+        return {
+            "id": f"chatcmpl_mock_{next(self._ids)}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model"),
+            "choices": [{"index": 0, "finish_reason": "stop",
+                         "message": {"role": "assistant", "content": content}}],
+            "usage": {"prompt_tokens": input_tokens, "completion_tokens": output_tokens,
+                      "total_tokens": input_tokens + output_tokens},
+        }
+
+    def _tool_items(self, request: Dict[str, Any]) -> List[Dict[str, Any]]:
+        query = last_user_text(request.get("input"))[:200]
+        items = []
+        if request.get("tool_choice") == "none":
+            return items
+        for tool in request.get("tools") or []:
+            tool_type = tool.get("type", "")
+            item_id = f"mock_{next(self._ids)}"
+            if tool_type.startswith("web_search"):
+                items.append({"type": "web_search_call", "id": f"ws_{item_id}", "status": "completed",
+                              "action": {"type": "search", "query": query}})
+            elif tool_type == "file_search":
+                items.append({"type": "file_search_call", "id": f"fs_{item_id}", "status": "completed",
+                              "queries": [query],
+                              "results": [{"file_id": "file_mock", "filename": "menu.pdf", "score": 0.9,
+                                           "text": "Kết quả tìm kiếm giả lập."}]})
+            elif tool_type == "function" and tool.get("name") in self.handlers:
+                arguments = self.handlers[tool["name"]](request)
+                if arguments is not None:
+                    items.append({"type": "function_call", "id": f"fc_{item_id}", "call_id": f"call_{item_id}",
+                                  "name": tool["name"], "status": "completed",
+                                  "arguments": json.dumps(arguments, ensure_ascii=False)})
+        return items
+
+    def response_payload(self, request: Dict[str, Any], sleep: bool = True) -> Dict[str, Any]:
+        """Response hoàn chỉnh; sleep=False khi độ trễ được giả lập theo từng event của stream"""
+        self._maybe_fail()
+        text_format = (request.get("text") or {}).get("format") or {}
+        schema = text_format.get("schema") if text_format.get("type") == "json_schema" else None
+        content = self._content(text_format.get("name", "text"), schema, request, "Đây là câu trả lời giả lập.")
+        tool_items = self._tool_items(request)
+        searches = sum(item["type"] != "function_call" for item in tool_items)
+
+        input_tokens = estimate_tokens(request.get("instructions") or "") + estimate_tokens(request.get("input"))
+        output_tokens = estimate_tokens(content)
+        if sleep:
+            time.sleep(self._base_delay() + searches * self.tool_latency + output_tokens * self.per_output_token)
+        self.stats.record("responses", input_tokens, output_tokens, len(tool_items))
+
+        message = {
+            "type": "message", "id": f"msg_mock_{next(self._ids)}", "role": "assistant", "status": "completed",
+            "content": [{"type": "output_text", "text": content, "annotations": []}],
+        }
+        return {
+            "id": f"resp_mock_{next(self._ids)}",
+            "object": "response",
+            "created_at": int(time.time()),
+            "status": "completed",
+            "model": request.get("model"),
+            "output": tool_items + [message],
+            "usage": {"input_tokens": input_tokens, "output_tokens": output_tokens,
+                      "total_tokens": input_tokens + output_tokens},
+        }
+
+    def response_events(self, request: Dict[str, Any], chunk_size: int = 16) -> Iterator[Dict[str, Any]]:
+        """Event stream của Responses API: created, các delta (trễ theo số token), completed"""
+        payload = self.response_payload(request, sleep=False)
+        searches = sum(item["type"] in ("web_search_call", "file_search_call") for item in payload["output"])
+        sequence = itertools.count()
+        yield {"type": "response.created", "sequence_number": next(sequence), "response": payload}
+        # Thời gian tới token đầu tiên: độ trễ cơ bản + thời gian chạy tool
+        time.sleep(self._base_delay() + searches * self.tool_latency)
+        message = payload["output"][-1]
+        text = _output_text(payload)
+        for start in range(0, len(text), chunk_size):
+            delta = text[start:start + chunk_size]
+            time.sleep(estimate_tokens(delta) * self.per_output_token)
+            yield {"type": "response.output_text.delta", "sequence_number": next(sequence), "item_id": message["id"],
+                   "output_index": len(payload["output"]) - 1, "content_index": 0, "delta": delta}
+        yield {"type": "response.completed", "sequence_number": next(sequence), "response": payload}
+
+    # --- Files + Batch API ---
+
+    def file_payload(self, filename: str, purpose: str, content: bytes) -> Dict[str, Any]:
+        file_id = f"file_mock_{next(self._ids)}"
+        meta = {"id": file_id, "object": "file", "bytes": len(content), "created_at": int(time.time()),
+                "filename": filename, "purpose": purpose, "status": "processed"}
+        self._files[file_id] = {"meta": meta, "content": content}
+        return meta
+
+    def file_meta(self, file_id: str) -> Dict[str, Any]:
+        return self._files[file_id]["meta"]
+
+    def file_content(self, file_id: str) -> bytes:
+        return self._files[file_id]["content"]
+
+    def batch_payload(self, input_file_id: str, endpoint: str, completion_window: str = "24h",
+                      metadata: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+        if input_file_id not in self._files:
+            raise KeyError(input_file_id)
+        batch_id = f"batch_mock_{next(self._ids)}"
+        batch = {"id": batch_id, "object": "batch", "endpoint": endpoint, "input_file_id": input_file_id,
+                 "completion_window": completion_window, "status": "validating", "created_at": int(time.time()),
+                 "output_file_id": None, "error_file_id": None, "completed_at": None, "metadata": metadata,
+                 "request_counts": {"total": 0, "completed": 0, "failed": 0}}
+        self._batches[batch_id] = batch
+        return dict(batch)
+
+    def _run_batch(self, batch: Dict[str, Any]):
+        outputs, errors = [], []
+        for line in self.file_content(batch["input_file_id"]).decode("utf-8").splitlines():
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            result = {"id": f"batch_req_mock_{next(self._ids)}", "custom_id": item.get("custom_id"), "error": None}
+            try:
+                if item.get("url", batch["endpoint"]).endswith("/chat/completions"):
+                    body = self.chat_payload(item["body"], sleep=False)
+                else:
+                    body = self.response_payload(item["body"], sleep=False)
+                result["response"] = {"status_code": 200, "request_id": f"req_mock_{next(self._ids)}", "body": body}
+                outputs.append(result)
+            except MockAPIError as e:
+                result["response"] = {"status_code": e.status, "request_id": f"req_mock_{next(self._ids)}",
+                                      "body": {"error": {"message": str(e), "type": e.kind, "code": e.kind}}}
+                errors.append(result)
+
+        def store(results: List[Dict[str, Any]], name: str) -> Optional[str]:
+            if not results:
+                return None
+            data = "".join(json.dumps(r, ensure_ascii=False) + "\n" for r in results).encode("utf-8")
+            return self.file_payload(f"{batch['id']}_{name}.jsonl", "batch_output", data)["id"]
+
+        batch.update(status="completed", completed_at=int(time.time()),
+                     output_file_id=store(outputs, "output"), error_file_id=store(errors, "error"),
+                     request_counts={"total": len(outputs) + len(errors), "completed": len(outputs),
+                                     "failed": len(errors)})
+
+    def batch_status(self, batch_id: str) -> Dict[str, Any]:
+        batch = self._batches[batch_id]
+        if batch["status"] == "validating":
+            batch["status"] = "in_progress"
+        elif batch["status"] == "in_progress":
+            self._run_batch(batch)
+        return dict(batch)
+
+    # --- Giao diện giống client OpenAI ---
+
+    def _create_chat_completion(self, model: str, messages: List[Dict[str, Any]], **kwargs) -> Any:
+        try:
+            return _namespace(self.chat_payload(dict(kwargs, model=model, messages=messages)))
+        except MockAPIError as e:
+            raise e.to_openai("http://mock/v1/chat/completions") from None
+
+    def _response_namespace(self, payload: Dict[str, Any]) -> Any:
+        response = _namespace(payload)
+        response.output_text = _output_text(payload)
+        return response
+
+    def _create_response(self, model: str, input: Any, stream: bool = False, **kwargs) -> Any:
+        request = dict(kwargs, model=model, input=input)
+        try:
+            if not stream:
+                return self._response_namespace(self.response_payload(request))
+            events = self.response_events(request)
+            first = next(events)  # lỗi được chèn xảy ra ngay khi gọi, như API thật
+        except MockAPIError as e:
+            raise e.to_openai("http://mock/v1/responses") from None
+        return self._stream_events(first, events)
+
+    def _stream_events(self, first: Dict[str, Any], events: Iterator[Dict[str, Any]]):
+        for event in itertools.chain([first], events):
+            event = dict(event)
+            if "response" in event:
+                event["response"] = self._response_namespace(event["response"])
+            yield SimpleNamespace(**{k: v if k == "response" else _namespace(v) for k, v in event.items()})
+
+
+    def _create_file(self, file: Any, purpose: str, **kwargs) -> Any:
+        # Nhận các dạng FileTypes của SDK: (tên, nội dung), bytes, file object hoặc đường dẫn
+        filename = "upload.jsonl"
+        if isinstance(file, tuple):
+            filename, file = file[0], file[1]
+        if isinstance(file, (str, os.PathLike)):
+            filename = os.path.basename(file)
+            with open(file, "rb") as f:
+                content = f.read()
+        elif hasattr(file, "read"):
+            filename = os.path.basename(getattr(file, "name", filename))
+            content = file.read()
+        else:
+            content = file
+        if isinstance(content, str):
+            content = content.encode("utf-8")
+        return _namespace(self.file_payload(filename, purpose, content))
+
+    def _retrieve_file(self, file_id: str, **kwargs) -> Any:
+        return _namespace(self.file_meta(file_id))
+
+    def _file_content(self, file_id: str, **kwargs) -> Any:
+        content = self.file_content(file_id)
+        return SimpleNamespace(content=content, text=content.decode("utf-8"), read=lambda: content)
+
+    def _create_batch(self, input_file_id: str, endpoint: str, completion_window: str = "24h",
+                      metadata: Optional[Dict[str, str]] = None, **kwargs) -> Any:
+        return _namespace(self.batch_payload(input_file_id, endpoint, completion_window, metadata))
+
+    def _retrieve_batch(self, batch_id: str, **kwargs) -> Any:
+        return _namespace(self.batch_status(batch_id))
+
+
+class _MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    mock: MockOpenAI = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status: int, body: Dict[str, Any]):
+        data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_chunk(self, data: bytes):
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+    def _send_not_found(self, path: str):
+        self._send_json(404, {"error": {"message": f"unknown path {path}", "type": "invalid_request_error"}})
+
+    def _upload(self, body: bytes):
+        # multipart/form-data của files.create: trường "purpose" và "file"
+        content_type = self.headers.get("Content-Type", "")
+        message = BytesParser(policy=HTTP).parsebytes(f"Content-Type: {content_type}\r\n\r\n".encode() + body)
+        fields, filename, content = {}, "upload.jsonl", b""
+        for part in message.iter_parts():
+            name = part.get_param("name", header="content-disposition")
+            if name == "file":
+                filename = part.get_filename() or filename
+                content = part.get_payload(decode=True) or b""
+            else:
+                fields[name] = part.get_content().strip()
+        self._send_json(200, self.mock.file_payload(filename, fields.get("purpose", "batch"), content))
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length)
+        path = self.path.split("?")[0].rstrip("/")
+        if path.endswith("/files"):
+            self._upload(body)
+            return
+        try:
+            request = json.loads(body or b"{}")
+        except ValueError:
+            self._send_json(400, {"error": {"message": "invalid JSON", "type": "invalid_request_error"}})
+            return
+        try:
+            if path.endswith("/chat/completions"):
+                self._send_json(200, self.mock.chat_payload(request))
+            elif path.endswith("/responses") and request.get("stream"):
+                events = self.mock.response_events(request)
+                first = next(events)
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                for event in itertools.chain([first], events):
+                    data = json.dumps(event, ensure_ascii=False)
+                    self._send_chunk(f"event: {event['type']}\ndata: {data}\n\n".encode("utf-8"))
+                self._send_chunk(b"")
+            elif path.endswith("/responses"):
+                self._send_json(200, self.mock.response_payload(request))
+            elif path.endswith("/batches"):
+                self._send_json(200, self.mock.batch_payload(
+                    request["input_file_id"], request["endpoint"], request.get("completion_window", "24h"),
+                    request.get("metadata")))
+            else:
+                self._send_not_found(path)
+        except MockAPIError as e:
+            self._send_json(e.status, {"error": {"message": str(e), "type": e.kind, "code": e.kind}})
+        except KeyError:
+            self._send_not_found(path)
+
+    def do_GET(self):
+        parts = self.path.split("?")[0].strip("/").split("/")
+        try:
+            if len(parts) >= 3 and parts[-3] == "files" and parts[-1] == "content":
+                data = self.mock.file_content(parts[-2])
+                self.send_response(200)
+                self.send_header("Content-Type", "application/octet-stream")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+            elif len(parts) >= 2 and parts[-2] == "files":
+                self._send_json(200, self.mock.file_meta(parts[-1]))
+            elif len(parts) >= 2 and parts[-2] == "batches":
+                self._send_json(200, self.mock.batch_status(parts[-1]))
+            else:
+                self._send_not_found(self.path)
+        except KeyError:
+            self._send_not_found(self.path)
+
+
+class MockServer:
+    """Phục vụ MockOpenAI qua HTTP trong một thread nền
+
+        with MockServer(MockOpenAI(latency="lognormal:0.5,0.4")) as server:
+            client = OpenAI(base_url=server.url, api_key="mock")
+    """
+    def __init__(self, mock: MockOpenAI, host: str = "127.0.0.1", port: int = 0):
+        self.mock = mock
+        handler = type("MockHandler", (_MockHandler,), {"mock": mock})
+        self.httpd = ThreadingHTTPServer((host, port), handler)
+        self.httpd.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self) -> "MockServer":
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name="mock-openai", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self) -> "MockServer":
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Chạy server OpenAI giả lập")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--latency", default="0.5", help='Giây hoặc phân phối, ví dụ "lognormal:0.5,0.4"')
+    parser.add_argument("--per-output-token", type=float, default=0.002)
+    parser.add_argument("--tool-latency", type=float, default=0.5)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    mock = MockOpenAI(latency=args.latency, per_output_token=args.per_output_token,
+                      tool_latency=args.tool_latency, error_rate=args.error_rate)
+    server = MockServer(mock, args.host, args.port)
+    print(f"Mock OpenAI: {server.url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(json.dumps(mock.stats.snapshot(), ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
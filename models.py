@@ -0,0 +1,62 @@
+"""Các model pydantic cho structured output của các bot
+
+Chỉ import khi cần kiểm tra dữ liệu model trả về; JSON schema gửi kèm request được
+đọc sẵn từ schemas.json qua schemas.json_schema(), không cần import pydantic.
+"""
+from typing import List, Literal, Optional
+
+from pydantic import BaseModel, ConfigDict
+
+# Create the Pydantic class
+class TravelPlan(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+
+    destination: str
+    duration: str
+    number_of_people: int
+    budget: str
+    activities: List[str]
+    accommodations: List[str]
+    transportation: List[str]
+    estimated_cost: str
+
+class UserInputAnalysis(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+
+    type: Literal["planning", "inquiry", "general"]
+    intent: str
+    sentiment: Literal["positive", "negative", "neutral"]
+    destination: Optional[str]
+    duration: Optional[str]
+    number_of_people: Optional[int]
+    budget: Optional[str]
+
+class ItemPrice(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+
+    item: str
+    price: str
+
+class TravelPlanPrices(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+
+    activities: List[ItemPrice]
+    accommodations: List[ItemPrice]
+    transportation: List[ItemPrice]
+
+class OrderLine(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+
+    name: str
+    quantity: int
+    toppings: List[str]
+
+class OrderDelta(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+
+    action: Literal["none", "update", "confirm", "cancel"]
+    add: List[OrderLine]
+    remove: List[OrderLine]
+    special_requests: Optional[str]
+
+SCHEMA_MODELS = (TravelPlan, UserInputAnalysis, TravelPlanPrices, OrderDelta)
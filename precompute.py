@@ -0,0 +1,231 @@
+"""Tính trước kế hoạch du lịch cho các điểm đến phổ biến qua Batch API
+
+Ví dụ:
+    python precompute.py build --output plans.jsonl
+    python precompute.py submit plans.jsonl
+    python precompute.py collect batch_abc123 --cache-path plans.db
+    python precompute.py run --cache-path plans.db
+    python precompute.py run --mock --cache-path /tmp/plans.db --error-rate 0.05
+
+submit/collect chạy riêng dùng client thật; để thử với server giả lập (mock_openai.py)
+đặt OPENAI_BASE_URL=http://127.0.0.1:8100/v1.
+
+Mỗi dòng JSONL là một request /v1/responses giống hệt lần gọi của get_travel_plan
+(TravelAgent.plan_request) cho một tổ hợp điểm đến × thời gian × số người × ngân sách.
+custom_id là plan_cache_key của tổ hợp đó nên kết quả (đã kiểm tra theo TravelPlan) được
+nạp thẳng vào cache kế hoạch SQLite (--cache-path hoặc TRAVEL_PLAN_CACHE_PATH) mà bot đọc;
+người dùng hỏi đúng tổ hợp sẽ nhận kế hoạch ngay, không cần gọi web search.
+--mock chạy toàn bộ quy trình với MockOpenAI, không gọi API thật.
+"""
+import argparse
+import json
+import os
+import time
+from typing import Any, Dict, Iterable, List, Optional
+
+from pydantic import ValidationError
+
+from apiresponse import TravelAgent, create_plan_cache, plan_cache_key
+from clients import load_env
+from models import TravelPlan
+
+DESTINATIONS = ("Đà Lạt", "Phú Quốc", "Hạ Long", "Đà Nẵng", "Sapa", "Nha Trang")
+DURATIONS = ("2 ngày 1 đêm", "3 ngày 2 đêm", "4 ngày 3 đêm")
+PARTY_SIZES = (2, 4)
+# Mỗi mức đại diện một khoảng của budget_bucket; None: người dùng không nói ngân sách
+BUDGETS = (None, "3 triệu", "7 triệu", "15 triệu", "30 triệu")
+
+BATCH_ENDPOINT = "/v1/responses"
+TERMINAL_STATUSES = ("completed", "failed", "expired", "cancelled")
+
+
+def plan_matrix(destinations: Iterable[str] = DESTINATIONS, durations: Iterable[str] = DURATIONS,
+                party_sizes: Iterable[int] = PARTY_SIZES, budgets: Iterable[Optional[str]] = BUDGETS) -> List[Dict[str, Any]]:
+    """Các tổ hợp travel_info cần tính trước, bỏ các tổ hợp trùng khóa cache"""
+    infos = {}
+    for destination in destinations:
+        for duration in durations:
+            for people in party_sizes:
+                for budget in budgets:
+                    info = {"destination": destination, "duration": duration, "number_of_people": people,
+                            "budget": budget}
+                    infos.setdefault(plan_cache_key(info), info)
+    return list(infos.values())
+
+
+def batch_requests(agent: TravelAgent, infos: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    return [
+        {"custom_id": plan_cache_key(info), "method": "POST", "url": BATCH_ENDPOINT, "body": agent.plan_request(info)}
+        for info in infos
+    ]
+
+
+def write_jsonl(rows: Iterable[Dict[str, Any]], path: str) -> int:
+    count = 0
+    with open(path, "w", encoding="utf-8") as f:
+        for row in rows:
+            f.write(json.dumps(row, ensure_ascii=False) + "\n")
+            count += 1
+    return count
+
+
+def submit_batch(client: Any, path: str, description: str = "travel plan precompute") -> Any:
+    with open(path, "rb") as f:
+        uploaded = client.files.create(file=(os.path.basename(path), f.read()), purpose="batch")
+    return client.batches.create(input_file_id=uploaded.id, endpoint=BATCH_ENDPOINT, completion_window="24h",
+                                 metadata={"description": description})
+
+
+def wait_for_batch(client: Any, batch_id: str, poll_interval: float = 30.0, timeout: Optional[float] = None) -> Any:
+    """Chờ batch kết thúc (completed/failed/expired/cancelled)"""
+    deadline = time.monotonic() + timeout if timeout else None
+    while True:
+        batch = client.batches.retrieve(batch_id)
+        if batch.status in TERMINAL_STATUSES:
+            return batch
+        if deadline is not None and time.monotonic() >= deadline:
+            raise TimeoutError(f"Batch {batch_id} chưa xong (trạng thái {batch.status})")
+        time.sleep(poll_interval)
+
+
+def response_text(body: Dict[str, Any]) -> str:
+    """output_text của một Response ở dạng JSON thô (như trong file kết quả batch)"""
+    return "".join(
+        part.get("text", "")
+        for item in body.get("output") or [] if item.get("type") == "message"
+        for part in item.get("content") or [] if part.get("type") == "output_text"
+    )
+
+
+def read_file_lines(client: Any, file_id: Optional[str]) -> List[Dict[str, Any]]:
+    if not file_id:
+        return []
+    return [json.loads(line) for line in client.files.content(file_id).text.splitlines() if line.strip()]
+
+
+def load_results(client: Any, batch: Any, plan_cache: Any, ttl: Optional[float] = None) -> Dict[str, int]:
+    """Nạp các kế hoạch hợp lệ vào cache; trả về số lượng loaded/invalid/failed"""
+    counts = {"loaded": 0, "invalid": 0, "failed": 0}
+    for row in read_file_lines(client, batch.output_file_id):
+        response = row.get("response") or {}
+        if row.get("error") or response.get("status_code") != 200:
+            counts["failed"] += 1
+            continue
+        try:
+            plan = TravelPlan.model_validate_json(response_text(response.get("body") or {}))
+        except ValidationError:
+            counts["invalid"] += 1
+            continue
+        plan_cache.set(row["custom_id"], plan.model_dump(), ttl)
+        counts["loaded"] += 1
+    counts["failed"] += len(read_file_lines(client, batch.error_file_id))
+    return counts
+
+
+def _client(args) -> Any:
+    if getattr(args, "mock", False):
+        from mock_openai import MockOpenAI
+        return MockOpenAI(latency=0, error_rate=args.error_rate, seed=args.seed)
+    from clients import get_client
+    return get_client()
+
+
+def _plan_cache(args) -> Any:
+    if args.cache_path:
+        os.environ["TRAVEL_PLAN_CACHE_PATH"] = args.cache_path
+    if not os.getenv("TRAVEL_PLAN_CACHE_PATH"):
+        raise SystemExit("Cần --cache-path hoặc TRAVEL_PLAN_CACHE_PATH để bot đọc được kế hoạch đã tính")
+    return create_plan_cache()
+
+
+def _build(args) -> int:
+    agent = TravelAgent()  # chỉ dựng payload, client không được tạo
+    infos = plan_matrix(args.destinations, args.durations, args.party_sizes,
+                        [None if budget == "any" else budget for budget in args.budgets])
+    count = write_jsonl(batch_requests(agent, infos), args.output)
+    print(f"Đã ghi {count} request vào {args.output}")
+    return count
+
+
+def _collect(args, client: Any, batch_id: str):
+    batch = wait_for_batch(client, batch_id, args.poll_interval, args.timeout)
+    print(f"Batch {batch.id}: {batch.status}")
+    if batch.status != "completed":
+        return
+    counts = load_results(client, batch, _plan_cache(args), args.ttl)
+    print(json.dumps(counts, ensure_ascii=False))
+
+
+def cmd_build(args):
+    _build(args)
+
+
+def cmd_submit(args):
+    batch = submit_batch(_client(args), args.input)
+    print(batch.id)
+
+
+def cmd_collect(args):
+    _collect(args, _client(args), args.batch_id)
+
+
+def cmd_run(args):
+    _plan_cache(args)  # kiểm tra đường dẫn cache trước khi tốn một batch
+    _build(args)
+    client = _client(args)
+    batch = submit_batch(client, args.output)
+    print(f"Đã gửi batch {batch.id}")
+    _collect(args, client, batch.id)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    def add_client_args(command):
+        command.add_argument("--mock", action="store_true", help="Dùng MockOpenAI thay cho API thật")
+        command.add_argument("--error-rate", type=float, default=0.0, help="Tỉ lệ request lỗi khi --mock")
+        command.add_argument("--seed", type=int, default=0)
+
+    def add_matrix_args(command):
+        command.add_argument("--output", default="travel_plans_batch.jsonl")
+        command.add_argument("--destinations", nargs="+", default=list(DESTINATIONS))
+        command.add_argument("--durations", nargs="+", default=list(DURATIONS))
+        command.add_argument("--party-sizes", nargs="+", type=int, default=list(PARTY_SIZES))
+        command.add_argument("--budgets", nargs="+", default=["any" if b is None else b for b in BUDGETS],
+                             help='"any": người dùng không nói ngân sách')
+
+    def add_collect_args(command):
+        command.add_argument("--cache-path", help="File SQLite của cache kế hoạch (mặc định TRAVEL_PLAN_CACHE_PATH)")
+        command.add_argument("--ttl", type=float, default=7 * 24 * 3600, help="Thời gian giữ kế hoạch, giây")
+        command.add_argument("--poll-interval", type=float, default=30.0)
+        command.add_argument("--timeout", type=float, help="Thời gian chờ batch tối đa, giây")
+
+    build = subparsers.add_parser("build", help="Ghi file JSONL request cho Batch API")
+    add_matrix_args(build)
+    build.set_defaults(func=cmd_build)
+
+    submit = subparsers.add_parser("submit", help="Tải file JSONL lên và tạo batch")
+    submit.add_argument("input")
+    submit.set_defaults(func=cmd_submit)
+
+    collect = subparsers.add_parser("collect", help="Chờ batch xong và nạp kết quả vào cache kế hoạch")
+    collect.add_argument("batch_id")
+    add_collect_args(collect)
+    collect.set_defaults(func=cmd_collect)
+
+    run = subparsers.add_parser("run", help="build + submit + collect")
+    add_matrix_args(run)
+    add_client_args(run)
+    add_collect_args(run)
+    run.set_defaults(func=cmd_run)
+
+    args = parser.parse_args()
+    load_env()
+    if getattr(args, "mock", False):
+        args.poll_interval = min(args.poll_interval, 0.01)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+"""Chạy trước ở nền những việc nhiều khả năng lượt sau sẽ cần (đoán trước)
+
+Ví dụ: khách hỏi "Có gì thú vị ở Phú Quốc không?" thường hỏi tiếp kế hoạch cho Phú Quốc,
+nên TravelAgent tạo sẵn kế hoạch và tra giá ở mức ưu tiên SPECULATIVE (thấp nhất); lượt
+lập kế hoạch sau đó lấy thẳng từ cache. Nếu việc đoán trước còn đang chạy, lượt chat nâng
+request của nó lên mức ưu tiên của lượt (scheduler.promote) và chờ chung kết quả thay vì
+gọi lần hai; việc chưa kịp chạy thì bị bỏ để lượt chat tự gọi.
+
+- Mỗi việc có một khóa (khóa cache kế hoạch). Việc trùng khóa đang chờ, đang chạy hoặc đã
+  xong chưa được dùng thì không gửi lại.
+- Chỉ chạy khi scheduler không có request nào đang xếp hàng, để không tranh chỗ lượt chat.
+- Hủy: việc chưa chạy bị bỏ hẳn; việc đang chạy dừng trước bước tiếp theo.
+- Giới hạn lãng phí: tổng token của các việc đã chạy mà chưa được dùng trong cửa sổ
+  PREFETCH_BUDGET_WINDOW không vượt PREFETCH_TOKEN_BUDGET; hết ngân sách thì bỏ qua việc mới.
+- Tỉ lệ trúng (hit_rate) = số việc được lượt sau dùng / số việc đã chạy xong.
+
+Cấu hình qua biến môi trường:
+
+    PREFETCH_ENABLED        0 để tắt (mặc định 1)
+    PREFETCH_MAX_IN_FLIGHT  số việc chờ/chạy đồng thời tối đa (mặc định 4)
+    PREFETCH_TOKEN_BUDGET   số token được phép lãng phí trong một cửa sổ (mặc định 200000)
+    PREFETCH_BUDGET_WINDOW  độ dài cửa sổ, giây (mặc định 3600)
+    PREFETCH_TTL            kết quả không được dùng sau thời gian này tính là lãng phí, giây
+                            (mặc định 900)
+"""
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+from scheduler import get_scheduler
+from tracing import METRICS, Counter, Gauge, record_error, span, span_tokens
+
+PREFETCHES = Counter("prefetch_total", "Số việc đoán trước theo kết quả")
+PREFETCH_TOKENS = Counter("prefetch_tokens_total", "Token dùng cho việc đoán trước, theo có được dùng hay không")
+PREFETCH_IN_FLIGHT = Gauge("prefetch_in_flight", "Số việc đoán trước đang chờ/chạy")
+METRICS.extend([PREFETCHES, PREFETCH_TOKENS, PREFETCH_IN_FLIGHT])
+
+
+def scheduler_busy() -> bool:
+    return any(get_scheduler().stats()["queue_depth"].values())
+
+
+class _Task:
+    __slots__ = ("key", "future", "cancelled", "claimed", "tokens", "finished_at")
+
+    def __init__(self, key: str):
+        self.key = key
+        self.future = None
+        self.cancelled = threading.Event()
+        self.claimed = False
+        self.tokens = 0
+        self.finished_at: Optional[float] = None
+
+
+class Prefetcher:
+    """Chạy các việc đoán trước ở nền, giới hạn số việc đồng thời và số token có thể lãng phí"""
+    def __init__(self, executor: Optional[ThreadPoolExecutor] = None, max_in_flight: int = 4,
+                 token_budget: int = 200_000, window: float = 3600.0, ttl: float = 900.0, enabled: bool = True,
+                 busy: Callable[[], bool] = scheduler_busy):
+        self.max_in_flight = max_in_flight
+        self.token_budget = token_budget
+        self.window = window
+        self.ttl = ttl
+        self.enabled = enabled
+        self.busy = busy
+        self.executor = executor or ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="prefetch")
+        self._lock = threading.Lock()
+        self._tasks: Dict[str, _Task] = {}
+        # Các việc đã chạy xong trong cửa sổ ngân sách, cũ nhất trước
+        self._finished = deque()
+        self.counters = dict.fromkeys(
+            ("submitted", "completed", "hits", "wasted", "cancelled", "failed", "skipped_busy", "skipped_budget"), 0)
+
+    def _count(self, result: str):
+        self.counters[result] += 1
+        PREFETCHES.inc(result=result)
+
+    def _in_flight(self) -> int:
+        return sum(1 for task in self._tasks.values() if task.finished_at is None)
+
+    def _wasted_tokens(self, now: float) -> int:
+        while self._finished and self._finished[0].finished_at < now - self.window:
+            self._finished.popleft()
+        return sum(task.tokens for task in self._finished if not task.claimed)
+
+    def _sweep(self, now: float):
+        for key, task in list(self._tasks.items()):
+            if task.finished_at is not None and now - task.finished_at > self.ttl:
+                del self._tasks[key]
+                self._count("wasted")
+                PREFETCH_TOKENS.inc(task.tokens, used="no")
+
+    def submit(self, key: str, *steps: Callable[[], Any]) -> bool:
+        """Chạy lần lượt các bước ở nền; False nếu bị bỏ qua (trùng, bận hoặc hết ngân sách)"""
+        if not self.enabled:
+            return False
+        with self._lock:
+            now = time.monotonic()
+            self._sweep(now)
+            if key in self._tasks:
+                return False
+            if self._in_flight() >= self.max_in_flight or self.busy():
+                self._count("skipped_busy")
+                return False
+            if self._wasted_tokens(now) >= self.token_budget:
+                self._count("skipped_budget")
+                return False
+            task = self._tasks[key] = _Task(key)
+            self._count("submitted")
+            task.future = self.executor.submit(self._run, task, steps)
+            PREFETCH_IN_FLIGHT.set(self._in_flight())
+        return True
+
+    def _run(self, task: _Task, steps):
+        failed = False
+        # Span gốc riêng: token của mọi lời gọi trong các bước được cộng vào việc này
+        with span("prefetch", key=task.key) as root:
+            for step in steps:
+                if task.cancelled.is_set():
+                    break
+                try:
+                    step()
+                except Exception as e:
+                    record_error("prefetch", e)
+                    failed = True
+                    break
+        with self._lock:
+            task.tokens = span_tokens(root)
+            task.finished_at = time.monotonic()
+            self._finished.append(task)
+            if task.claimed:
+                self._tasks.pop(task.key, None)
+                PREFETCH_TOKENS.inc(task.tokens, used="yes")
+            elif failed or task.cancelled.is_set():
+                self._tasks.pop(task.key, None)
+                self._count("failed" if failed else "cancelled")
+                PREFETCH_TOKENS.inc(task.tokens, used="no")
+            if not failed and not task.cancelled.is_set():
+                self._count("completed")
+            PREFETCH_IN_FLIGHT.set(self._in_flight())
+
+    def cancel(self, key: str) -> bool:
+        """Hủy việc đoán trước chưa được dùng: chưa chạy thì bỏ, đang chạy thì dừng trước bước sau"""
+        with self._lock:
+            task = self._tasks.get(key)
+            if task is None or task.claimed or task.finished_at is not None:
+                return False
+            task.cancelled.set()
+            if task.future.cancel():
+                del self._tasks[key]
+                self._count("cancelled")
+                PREFETCH_IN_FLIGHT.set(self._in_flight())
+        return True
+
+    def claim(self, key: str) -> bool:
+        """Ghi nhận lượt hiện tại dùng kết quả đoán trước của key (tính là trúng)
+
+        Việc chưa kịp chạy thì bị bỏ và trả về False: lượt hiện tại tự gọi ở mức ưu tiên của nó.
+        """
+        with self._lock:
+            task = self._tasks.get(key)
+            if task is None or task.claimed or task.cancelled.is_set():
+                return False
+            if task.future.cancel():
+                del self._tasks[key]
+                self._count("cancelled")
+                PREFETCH_IN_FLIGHT.set(self._in_flight())
+                return False
+            task.claimed = True
+            self._count("hits")
+            if task.finished_at is not None:
+                del self._tasks[key]
+                PREFETCH_TOKENS.inc(task.tokens, used="yes")
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            now = time.monotonic()
+            self._sweep(now)
+            completed = self.counters["completed"]
+            return {
+                **self.counters,
+                "in_flight": self._in_flight(),
+                "hit_rate": self.counters["hits"] / completed if completed else 0.0,
+                "wasted_tokens": self._wasted_tokens(now),
+                "token_budget": self.token_budget,
+            }
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+_prefetcher: Optional[Prefetcher] = None
+_prefetcher_lock = threading.Lock()
+
+
+def get_prefetcher() -> Prefetcher:
+    """Prefetcher dùng chung cho cả process (ngân sách lãng phí tính chung), cấu hình từ biến môi trường"""
+    global _prefetcher
+    if _prefetcher is None:
+        with _prefetcher_lock:
+            if _prefetcher is None:
+                _prefetcher = Prefetcher(
+                    max_in_flight=int(os.getenv("PREFETCH_MAX_IN_FLIGHT", 4)),
+                    token_budget=int(os.getenv("PREFETCH_TOKEN_BUDGET", 200_000)),
+                    window=float(os.getenv("PREFETCH_BUDGET_WINDOW", 3600)),
+                    ttl=float(os.getenv("PREFETCH_TTL", 900)),
+                    enabled=os.getenv("PREFETCH_ENABLED", "1").lower() not in ("0", "false", "no"),
+                )
+    return _prefetcher
@@ -0,0 +1,658 @@
+"""Bộ điều phối request tới OpenAI dùng chung cho mọi bot
+
+- Giới hạn tốc độ bằng token bucket theo RPM/TPM; giới hạn được cập nhật từ các header
+  x-ratelimit-* của response (qua transport trong clients.py).
+- Hàng đợi ưu tiên: lượt chat (INTERACTIVE) được vào trước tra giá nền (BACKGROUND),
+  việc đoán trước (SPECULATIVE, xem prefetch.py) vào sau cùng; hàng đợi đầy hoặc không
+  kịp hạn chót thì request bị từ chối (RequestShed). Request gắn tag có thể được nâng mức
+  ưu tiên khi đang chờ bằng promote(tag, priority).
+- Thử lại với exponential backoff + jitter cho lỗi 429/408/5xx/timeout/mất kết nối,
+  tôn trọng header retry-after.
+- hedge=True: nếu request chưa xong sau khoảng p90 độ trễ đã quan sát, gửi thêm một bản
+  sao và lấy kết quả về trước. Chỉ bật khi OPENAI_HEDGE=1 và chỉ cho request nhỏ (không
+  stream, ước lượng không quá OPENAI_HEDGE_MAX_TOKENS token) vì bản sao cũng tốn token;
+  mỗi bản giữ chỗ trong giới hạn đồng thời tới khi chính nó chạy xong.
+- Khi hạn chót sắp hết (hoặc thử lại không còn kịp), chuyển sang model rẻ/nhanh hơn
+  theo OPENAI_FALLBACK_MODELS.
+
+Cấu hình qua biến môi trường:
+
+    OPENAI_RPM, OPENAI_TPM          giới hạn ban đầu (mặc định: chờ header từ API)
+    OPENAI_MAX_IN_FLIGHT            số request chạy đồng thời tối đa (mặc định 64)
+    SCHEDULER_MAX_QUEUE             số request chờ tối đa mỗi mức ưu tiên (mặc định 256)
+    SCHEDULER_MAX_RETRIES           số lần thử lại (mặc định 3)
+    OPENAI_FALLBACK_MODELS          ví dụ "gpt-4o=gpt-4o-mini,gpt-4.1=gpt-4.1-mini"
+    OPENAI_HEDGE                    1 để bật gửi bản sao cho request hedge=True (mặc định 0)
+    OPENAI_HEDGE_MAX_TOKENS         request lớn hơn thì không gửi bản sao (mặc định 1000)
+"""
+import heapq
+import itertools
+import json
+import os
+import random
+import re
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Optional
+
+from tracing import METRICS, Counter, Gauge, Histogram, acall_openai, bind, call_openai, current_span
+
+INTERACTIVE, NORMAL, BACKGROUND, SPECULATIVE = 0, 1, 2, 3
+PRIORITY_NAMES = {INTERACTIVE: "interactive", NORMAL: "normal", BACKGROUND: "background",
+                  SPECULATIVE: "speculative"}
+DEFAULT_FALLBACK_MODELS = "gpt-4o=gpt-4o-mini,gpt-4.1=gpt-4.1-mini"
+_UNSET = object()
+
+QUEUE_DEPTH = Gauge("scheduler_queue_depth", "Số request đang chờ theo mức ưu tiên")
+IN_FLIGHT = Gauge("scheduler_in_flight", "Số request đang chạy")
+SHED = Counter("scheduler_shed_total", "Số request bị từ chối vì quá tải hoặc không kịp hạn chót")
+QUEUE_WAIT = Histogram("scheduler_queue_wait_seconds", "Thời gian chờ trong hàng đợi")
+RETRIES = Counter("scheduler_retries_total", "Số lần thử lại sau lỗi")
+HEDGES = Counter("scheduler_hedges_total", "Số request gửi thêm bản sao, theo bản nào về trước")
+FALLBACKS = Counter("scheduler_fallbacks_total", "Số lần chuyển sang model dự phòng")
+METRICS.extend([QUEUE_DEPTH, IN_FLIGHT, SHED, QUEUE_WAIT, RETRIES, HEDGES, FALLBACKS])
+
+
+class RequestShed(RuntimeError):
+    """Request bị từ chối do hàng đợi đầy hoặc không thể bắt đầu trước hạn chót"""
+
+
+def _parse_reset(value: str) -> Optional[float]:
+    # Định dạng của OpenAI: "1s", "6m0s", "20ms", "1h2m3.5s"
+    if not value:
+        return None
+    total, matched = 0.0, False
+    for number, unit in re.findall(r"([\d.]+)(ms|h|m|s)", value):
+        matched = True
+        total += float(number) * {"ms": 0.001, "s": 1, "m": 60, "h": 3600}[unit]
+    return total if matched else None
+
+
+class TokenBucket:
+    """Bucket nạp đều capacity đơn vị mỗi phút; capacity None nghĩa là không giới hạn"""
+    def __init__(self, per_minute: Optional[float] = None):
+        self.capacity = per_minute
+        self.tokens = per_minute or 0.0
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        if self.capacity:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.capacity / 60)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Số giây cần chờ để có đủ amount (0 nếu đủ ngay)"""
+        if not self.capacity:
+            return 0.0
+        self._refill()
+        amount = min(amount, self.capacity)
+        return 0.0 if self.tokens >= amount else (amount - self.tokens) * 60 / self.capacity
+
+    def take(self, amount: float):
+        if self.capacity:
+            self._refill()
+            self.tokens -= amount
+
+    def update(self, limit: Optional[float], remaining: Optional[float], reset: Optional[float]):
+        """Đồng bộ với header x-ratelimit-*: giới hạn thật và lượng còn lại của API"""
+        if limit:
+            if not self.capacity:
+                # Lần đầu biết giới hạn: bắt đầu với lượng API báo còn lại
+                self.tokens = limit if remaining is None else remaining
+                self.updated = time.monotonic()
+            self.capacity = limit
+        if remaining is not None and self.capacity:
+            self._refill()
+            self.tokens = min(self.tokens, remaining)
+            if reset and remaining <= 0:
+                # API báo hết: không cấp thêm cho tới thời điểm reset
+                self.tokens = -reset * self.capacity / 60
+
+
+def estimate_request_tokens(kwargs: Dict[str, Any]) -> int:
+    """Ước lượng token một request sẽ dùng (đầu vào + trần đầu ra) để trừ vào bucket TPM"""
+    text = json.dumps({k: kwargs.get(k) for k in ("input", "messages", "instructions", "tools")},
+                      ensure_ascii=False, default=str)
+    output = kwargs.get("max_output_tokens") or kwargs.get("max_tokens") or 512
+    return len(text) // 4 + output
+
+
+def _is_retriable(error: BaseException) -> bool:
+    import openai  # đã được nạp cùng client, không import khi khởi động
+
+    if isinstance(error, (openai.APITimeoutError, openai.APIConnectionError)):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code in (408, 409, 429) or error.status_code >= 500
+    return False
+
+
+def _retry_after(error: BaseException) -> Optional[float]:
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        if "retry-after-ms" in headers:
+            return float(headers["retry-after-ms"]) / 1000
+        if "retry-after" in headers:
+            return float(headers["retry-after"])
+    except ValueError:
+        return None
+    return None
+
+
+class _Ticket:
+    __slots__ = ("priority", "seq", "tokens", "enqueued", "tag")
+
+    def __init__(self, priority: int, seq: int, tokens: int, tag: Optional[str] = None):
+        self.priority = priority
+        self.seq = seq
+        self.tokens = tokens
+        self.enqueued = time.monotonic()
+        self.tag = tag
+
+    def __lt__(self, other: "_Ticket") -> bool:
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class RequestScheduler:
+    def __init__(self, rpm: Optional[float] = None, tpm: Optional[float] = None, max_in_flight: int = 64,
+                 max_queue: int = 256, max_retries: int = 3, backoff_base: float = 0.5, backoff_cap: float = 20.0,
+                 hedge_after: float = 2.0, fallback_models: Optional[Dict[str, str]] = None,
+                 hedging: bool = False, hedge_max_tokens: int = 1000):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.hedge_after = hedge_after
+        self.hedging = hedging
+        self.hedge_max_tokens = hedge_max_tokens
+        self.fallback_models = fallback_models or {}
+        self.in_flight = 0
+        self.shed = 0
+        self._cond = threading.Condition()
+        self._queue = []
+        self._depth = {priority: 0 for priority in PRIORITY_NAMES}
+        self._seq = itertools.count()
+        # Nhãn của các request đang gọi -> mức ưu tiên hiện tại (có thể được nâng bằng promote)
+        self._tags: Dict[str, int] = {}
+        self._latencies: Dict[str, deque] = {}
+        self._random = random.Random()
+        self._hedge_pool: Optional[ThreadPoolExecutor] = None
+        self.counters = {"retries": 0, "hedges": 0, "hedge_wins": 0, "fallbacks": 0}
+
+    # --- Hàng đợi ưu tiên + token bucket ---
+
+    def _enqueue(self, priority: int, tokens: int, tag: Optional[str] = None) -> _Ticket:
+        # Request nền bị từ chối sớm hơn để chừa chỗ cho lượt chat
+        limit = self.max_queue if priority == INTERACTIVE else max(1, self.max_queue // (2 * priority))
+        if self._depth[priority] >= limit:
+            self._shed(priority, "queue_full")
+        ticket = _Ticket(priority, next(self._seq), tokens, tag)
+        heapq.heappush(self._queue, ticket)
+        self._depth[priority] += 1
+        QUEUE_DEPTH.set(self._depth[priority], priority=PRIORITY_NAMES[priority])
+        return ticket
+
+    def _dequeue(self, ticket: _Ticket):
+        self._queue.remove(ticket)
+        heapq.heapify(self._queue)
+        self._depth[ticket.priority] -= 1
+        QUEUE_DEPTH.set(self._depth[ticket.priority], priority=PRIORITY_NAMES[ticket.priority])
+        self._cond.notify_all()
+
+    def _try_admit(self, ticket: _Ticket) -> float:
+        """Cho ticket chạy nếu tới lượt; trả về 0 khi được chạy, ngược lại số giây nên chờ"""
+        if self._queue[0] is not ticket or self.in_flight >= self.max_in_flight:
+            return 0.05
+        delay = max(self.requests.wait_time(1), self.tokens.wait_time(ticket.tokens))
+        if delay > 0:
+            return delay
+        self.requests.take(1)
+        self.tokens.take(ticket.tokens)
+        self._dequeue(ticket)
+        self.in_flight += 1
+        IN_FLIGHT.set(self.in_flight)
+        QUEUE_WAIT.observe(time.monotonic() - ticket.enqueued, priority=PRIORITY_NAMES[ticket.priority])
+        return 0.0
+
+    def _shed(self, priority: int, reason: str):
+        self.shed += 1
+        SHED.inc(priority=PRIORITY_NAMES[priority], reason=reason)
+        raise RequestShed(f"Request bị từ chối ({reason})")
+
+    def acquire(self, priority: int, tokens: int, deadline: Optional[float] = None, tag: Optional[str] = None):
+        """Chờ tới lượt (đồng bộ); deadline là thời điểm time.monotonic()"""
+        with self._cond:
+            ticket = self._enqueue(priority, tokens, tag)
+            try:
+                while True:
+                    delay = self._try_admit(ticket)
+                    if delay == 0:
+                        return
+                    if deadline is not None and time.monotonic() + min(delay, 0.05) >= deadline:
+                        self._shed(ticket.priority, "deadline")
+                    self._cond.wait(min(delay, 0.5))
+            except BaseException:
+                if ticket in self._queue:
+                    self._dequeue(ticket)
+                raise
+
+    def promote(self, tag: str, priority: int) -> bool:
+        """Nâng request đang gọi có nhãn tag lên mức priority (cả vé đang chờ lẫn các lần thử lại);
+        False nếu không có request nào mang nhãn này"""
+        with self._cond:
+            if tag not in self._tags:
+                return False
+            self._tags[tag] = min(self._tags[tag], priority)
+            for ticket in self._queue:
+                if ticket.tag == tag and ticket.priority > priority:
+                    self._depth[ticket.priority] -= 1
+                    QUEUE_DEPTH.set(self._depth[ticket.priority], priority=PRIORITY_NAMES[ticket.priority])
+                    ticket.priority = priority
+                    self._depth[priority] += 1
+                    QUEUE_DEPTH.set(self._depth[priority], priority=PRIORITY_NAMES[priority])
+            heapq.heapify(self._queue)
+            self._cond.notify_all()
+        return True
+
+    async def aacquire(self, priority: int, tokens: int, deadline: Optional[float] = None):
+        """Như acquire nhưng chờ bằng asyncio.sleep, không chặn event loop"""
+        import asyncio  # chỉ server async cần; CLI đồng bộ không phải nạp asyncio
+
+        with self._cond:
+            ticket = self._enqueue(priority, tokens)
+        try:
+            while True:
+                with self._cond:
+                    delay = self._try_admit(ticket)
+                if delay == 0:
+                    return
+                if deadline is not None and time.monotonic() + min(delay, 0.05) >= deadline:
+                    with self._cond:
+                        self._shed(priority, "deadline")
+                await asyncio.sleep(min(delay, 0.05))
+        except BaseException:
+            with self._cond:
+                if ticket in self._queue:
+                    self._dequeue(ticket)
+            raise
+
+    def release(self, estimated_tokens: int = 0, response: Any = None):
+        with self._cond:
+            self.in_flight -= 1
+            IN_FLIGHT.set(self.in_flight)
+            usage = getattr(response, "usage", None)
+            total = getattr(usage, "total_tokens", None)
+            if total:
+                # Điều chỉnh phần ước lượng theo số token thực tế
+                self.tokens.take(total - estimated_tokens)
+            self._cond.notify_all()
+
+    def observe_headers(self, headers: Any):
+        """Cập nhật bucket từ header x-ratelimit-* của response"""
+        def number(name: str) -> Optional[float]:
+            try:
+                return float(headers[name]) if name in headers else None
+            except ValueError:
+                return None
+
+        with self._cond:
+            for kind, bucket in (("requests", self.requests), ("tokens", self.tokens)):
+                limit = number(f"x-ratelimit-limit-{kind}")
+                remaining = number(f"x-ratelimit-remaining-{kind}")
+                if limit is not None or remaining is not None:
+                    bucket.update(limit, remaining, _parse_reset(headers.get(f"x-ratelimit-reset-{kind}", "")))
+
+    # --- Độ trễ, backoff, model dự phòng ---
+
+    def _observe_latency(self, model: str, seconds: float):
+        with self._cond:
+            self._latencies.setdefault(model, deque(maxlen=200)).append(seconds)
+
+    def expected_latency(self, model: str, quantile: float = 0.5) -> Optional[float]:
+        with self._cond:
+            samples = sorted(self._latencies.get(model) or ())
+        if len(samples) < 5:
+            return None
+        return samples[min(len(samples) - 1, int(quantile * len(samples)))]
+
+    def _backoff(self, attempt: int, error: BaseException) -> float:
+        # Full jitter: ngẫu nhiên trong [0, base * 2^attempt], có trần
+        delay = self._random.uniform(0, min(self.backoff_cap, self.backoff_base * 2 ** attempt))
+        retry_after = _retry_after(error)
+        return max(delay, retry_after) if retry_after is not None else delay
+
+    def _pick_model(self, model: str, fallback: Optional[str], deadline: Optional[float]) -> str:
+        if not fallback or fallback == model or deadline is None:
+            return model
+        expected = self.expected_latency(model)
+        if expected is not None and time.monotonic() + expected > deadline:
+            return self._use_fallback(model, fallback, "deadline_at_risk")
+        return model
+
+    def _use_fallback(self, model: str, fallback: str, reason: str) -> str:
+        with self._cond:
+            self.counters["fallbacks"] += 1
+        FALLBACKS.inc(model=model, fallback=fallback, reason=reason)
+        span = current_span()
+        if span is not None:
+            span.set(fallback_model=fallback)
+        return fallback
+
+    def _request_kwargs(self, kwargs: Dict[str, Any], model: str, deadline: Optional[float]) -> Dict[str, Any]:
+        request = dict(kwargs, model=model)
+        if deadline is not None:
+            remaining = max(0.1, deadline - time.monotonic())
+            request["timeout"] = min(request.get("timeout") or remaining, remaining)
+        return request
+
+    # --- Gọi đồng bộ ---
+
+    def call(self, endpoint: str, create: Callable[..., Any], priority: int = INTERACTIVE,
+             deadline: Optional[float] = None, hedge: bool = False, fallback_model: Any = _UNSET,
+             tag: Optional[str] = None, **kwargs) -> Any:
+        """Gọi create(**kwargs) qua hàng đợi; deadline tính bằng giây kể từ lúc gọi
+
+        tag: nhãn để promote() nâng mức ưu tiên khi request đang chờ (ví dụ lượt chat cần
+        chính kết quả của một request đoán trước).
+        """
+        if tag is None:
+            return self._call(endpoint, create, priority, deadline, hedge, fallback_model, None, kwargs)
+        with self._cond:
+            self._tags[tag] = priority
+        try:
+            return self._call(endpoint, create, priority, deadline, hedge, fallback_model, tag, kwargs)
+        finally:
+            with self._cond:
+                self._tags.pop(tag, None)
+
+    def _call(self, endpoint: str, create: Callable[..., Any], priority: int, deadline: Optional[float],
+              hedge: bool, fallback_model: Any, tag: Optional[str], kwargs: Dict[str, Any]) -> Any:
+        end = time.monotonic() + deadline if deadline else None
+        model = kwargs.get("model", "")
+        fallback = self.fallback_models.get(model) if fallback_model is _UNSET else fallback_model
+        estimated = estimate_request_tokens(kwargs)
+        hedge = hedge and self.hedging and not kwargs.get("stream") and estimated <= self.hedge_max_tokens
+        attempt = 0
+        while True:
+            model = self._pick_model(model, fallback, end)
+            if tag is not None:
+                priority = self._tags.get(tag, priority)
+            self.acquire(priority, estimated, end, tag)
+            started = time.monotonic()
+            response, streaming = None, False
+            try:
+                request = self._request_kwargs(kwargs, model, end)
+                if hedge:
+                    # _hedged tự trả lại chỗ khi từng bản chạy xong
+                    response = self._hedged(endpoint, create, request, model, estimated)
+                else:
+                    response = call_openai(endpoint, create, **request)
+                self._observe_latency(model, time.monotonic() - started)
+                if kwargs.get("stream"):
+                    # Stream chiếm chỗ tới khi được duyệt hết
+                    streaming = True
+                    return _ReleasingStream(self, response, estimated)
+                return response
+            except Exception as e:
+                if not _is_retriable(e) or attempt >= self.max_retries:
+                    raise
+                attempt += 1
+                delay = self._backoff(attempt, e)
+                if end is not None and time.monotonic() + delay >= end:
+                    if not fallback or model == fallback:
+                        raise
+                    model = self._use_fallback(model, fallback, "retry_after_deadline")
+                    delay = 0.0
+                with self._cond:
+                    self.counters["retries"] += 1
+                RETRIES.inc(endpoint=endpoint, error=type(e).__name__)
+            finally:
+                if not streaming and not hedge:
+                    self.release(estimated, response)
+            time.sleep(delay)
+
+    def _release_when_done(self, future: Any, estimated: int):
+        # Chỗ của mỗi bản (chính/sao) chỉ được trả khi chính bản đó chạy xong
+        def done(f):
+            ok = not f.cancelled() and f.exception() is None
+            self.release(estimated, f.result() if ok else None)
+        future.add_done_callback(done)
+
+    def _hedged(self, endpoint: str, create: Callable[..., Any], request: Dict[str, Any], model: str,
+                estimated: int) -> Any:
+        """Gọi có bản sao; chỗ của bản chính (đã acquire) được trả khi bản chính xong"""
+        if self._hedge_pool is None:
+            with self._cond:
+                if self._hedge_pool is None:
+                    self._hedge_pool = ThreadPoolExecutor(max_workers=16, thread_name_prefix="hedge")
+        delay = self.expected_latency(model, 0.9) or self.hedge_after
+        try:
+            primary = self._hedge_pool.submit(bind(call_openai), endpoint, create, **request)
+        except BaseException:
+            self.release(estimated)
+            raise
+        self._release_when_done(primary, estimated)
+        done, _ = wait([primary], timeout=delay)
+        if done:
+            return primary.result()
+
+        # Bản sao cũng phải qua giới hạn tốc độ; không còn chỗ thì chỉ chờ bản chính
+        with self._cond:
+            if self.in_flight >= self.max_in_flight or self.requests.wait_time(1) > 0:
+                admitted = False
+            else:
+                self.requests.take(1)
+                self.in_flight += 1
+                admitted = True
+                self.counters["hedges"] += 1
+        if not admitted:
+            return primary.result()
+
+        try:
+            backup = self._hedge_pool.submit(bind(call_openai), endpoint, create, **request)
+        except BaseException:
+            self.release()
+            raise
+        # Bản sao chưa được tính token ước lượng: trả chỗ với estimated 0, token thực tế vẫn được trừ
+        self._release_when_done(backup, 0)
+        pending = {primary, backup}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    winner = "backup" if future is backup else "primary"
+                    HEDGES.inc(winner=winner)
+                    if winner == "backup":
+                        with self._cond:
+                            self.counters["hedge_wins"] += 1
+                    return future.result()
+                error = error or future.exception()
+        raise error
+
+    # --- Gọi async (AsyncOpenAI) ---
+
+    async def acall(self, endpoint: str, create: Callable[..., Any], priority: int = INTERACTIVE,
+                    deadline: Optional[float] = None, fallback_model: Any = _UNSET, **kwargs) -> Any:
+        import asyncio
+
+        end = time.monotonic() + deadline if deadline else None
+        model = kwargs.get("model", "")
+        fallback = self.fallback_models.get(model) if fallback_model is _UNSET else fallback_model
+        estimated = estimate_request_tokens(kwargs)
+        attempt = 0
+        while True:
+            model = self._pick_model(model, fallback, end)
+            await self.aacquire(priority, estimated, end)
+            started = time.monotonic()
+            response, streaming = None, False
+            try:
+                response = await acall_openai(endpoint, create, **self._request_kwargs(kwargs, model, end))
+                self._observe_latency(model, time.monotonic() - started)
+                if kwargs.get("stream"):
+                    streaming = True
+                    return _AsyncReleasingStream(self, response, estimated)
+                return response
+            except Exception as e:
+                if not _is_retriable(e) or attempt >= self.max_retries:
+                    raise
+                attempt += 1
+                delay = self._backoff(attempt, e)
+                if end is not None and time.monotonic() + delay >= end:
+                    if not fallback or model == fallback:
+                        raise
+                    model = self._use_fallback(model, fallback, "retry_after_deadline")
+                    delay = 0.0
+                with self._cond:
+                    self.counters["retries"] += 1
+                RETRIES.inc(endpoint=endpoint, error=type(e).__name__)
+            finally:
+                if not streaming:
+                    self.release(estimated, response)
+            await asyncio.sleep(delay)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                "queue_depth": {PRIORITY_NAMES[p]: depth for p, depth in self._depth.items()},
+                "in_flight": self.in_flight,
+                "shed": self.shed,
+                "rpm_limit": self.requests.capacity,
+                "tpm_limit": self.tokens.capacity,
+                **self.counters,
+            }
+
+
+class _StreamSlot:
+    """Event stream giữ một chỗ trong giới hạn đồng thời của scheduler
+
+    Chỗ được trả đúng một lần: khi stream chạy hết hoặc lỗi, khi close()/aclose() (hoặc
+    thoát khối with), hoặc khi object bị thu hồi mà chưa ai duyệt hay đóng.
+    """
+    def __init__(self, scheduler: "RequestScheduler", events: Any, estimated: int):
+        self._scheduler = scheduler
+        self._events = events
+        self._iterator = None
+        self._estimated = estimated
+        self._released = False
+        self.response = None
+
+    def _seen(self, event: Any) -> Any:
+        if event.type in ("response.completed", "response.incomplete"):
+            self.response = event.response
+        return event
+
+    def _release(self):
+        if not self._released:
+            self._released = True
+            self._scheduler.release(self._estimated, self.response)
+
+    def __del__(self):
+        self._release()
+
+
+class _ReleasingStream(_StreamSlot):
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> Any:
+        if self._iterator is None:
+            self._iterator = iter(self._events)
+        try:
+            return self._seen(next(self._iterator))
+        except BaseException:
+            self.close()
+            raise
+
+    def close(self):
+        try:
+            close = getattr(self._iterator if self._iterator is not None else self._events, "close", None)
+            if close is not None:
+                close()
+        finally:
+            self._release()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class _AsyncReleasingStream(_StreamSlot):
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> Any:
+        if self._iterator is None:
+            self._iterator = self._events.__aiter__()
+        try:
+            return self._seen(await self._iterator.__anext__())
+        except BaseException:
+            await self.aclose()
+            raise
+
+    async def aclose(self):
+        try:
+            aclose = getattr(self._iterator if self._iterator is not None else self._events, "aclose", None)
+            if aclose is not None:
+                await aclose()
+        finally:
+            self._release()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.aclose()
+
+
+def _parse_fallbacks(value: str) -> Dict[str, str]:
+    pairs = (item.split("=", 1) for item in value.split(",") if "=" in item)
+    return {model.strip(): fallback.strip() for model, fallback in pairs}
+
+
+_scheduler: Optional[RequestScheduler] = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler() -> RequestScheduler:
+    """Scheduler dùng chung cho cả process, cấu hình từ biến môi trường"""
+    global _scheduler
+    if _scheduler is None:
+        with _scheduler_lock:
+            if _scheduler is None:
+                rpm, tpm = os.getenv("OPENAI_RPM"), os.getenv("OPENAI_TPM")
+                _scheduler = RequestScheduler(
+                    rpm=float(rpm) if rpm else None,
+                    tpm=float(tpm) if tpm else None,
+                    max_in_flight=int(os.getenv("OPENAI_MAX_IN_FLIGHT", 64)),
+                    max_queue=int(os.getenv("SCHEDULER_MAX_QUEUE", 256)),
+                    max_retries=int(os.getenv("SCHEDULER_MAX_RETRIES", 3)),
+                    fallback_models=_parse_fallbacks(os.getenv("OPENAI_FALLBACK_MODELS", DEFAULT_FALLBACK_MODELS)),
+                    hedging=os.getenv("OPENAI_HEDGE", "0").lower() in ("1", "true", "yes"),
+                    hedge_max_tokens=int(os.getenv("OPENAI_HEDGE_MAX_TOKENS", 1000)),
+                )
+    return _scheduler
+
+
+def observe_rate_limit_headers(headers: Any):
+    """Gọi từ transport HTTP cho mọi response của OpenAI"""
+    if _scheduler is not None or "x-ratelimit-limit-requests" in headers:
+        get_scheduler().observe_headers(headers)
+
+
+def request(endpoint: str, create: Callable[..., Any], **kwargs) -> Any:
+    """scheduler.request("responses", client.responses.create, priority=..., deadline=..., model=..., ...)"""
+    return get_scheduler().call(endpoint, create, **kwargs)
+
+
+async def arequest(endpoint: str, create: Callable[..., Any], **kwargs) -> Any:
+    return await get_scheduler().acall(endpoint, create, **kwargs)
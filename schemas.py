@@ -0,0 +1,76 @@
+"""JSON schema của các model trong models.py, tính sẵn để khởi động không cần pydantic
+
+schemas.json lưu schema kèm mã băm của models.py. File chỉ được tạo lại bằng lệnh dưới
+đây (sau mỗi lần sửa models.py). Lúc chạy, file thiếu hoặc cũ chỉ gây cảnh báo: schema được
+tính từ pydantic trong bộ nhớ, không ghi đè file; kiểm tra --check (CI) mới báo lỗi.
+
+    python schemas.py           # tính lại schemas.json
+    python schemas.py --check   # thoát với mã 1 nếu schemas.json thiếu hoặc cũ
+"""
+import functools
+import hashlib
+import json
+import logging
+import os
+import sys
+from typing import Any, Dict, Optional, Tuple
+
+_DIR = os.path.dirname(os.path.abspath(__file__))
+MODELS_PATH = os.path.join(_DIR, "models.py")
+SCHEMAS_PATH = os.path.join(_DIR, "schemas.json")
+
+logger = logging.getLogger("bots")
+
+
+def _models_hash() -> str:
+    with open(MODELS_PATH, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def build_schemas() -> Dict[str, Any]:
+    from models import SCHEMA_MODELS
+    return {model.__name__: model.model_json_schema() for model in SCHEMA_MODELS}
+
+
+def write_schemas(path: str = SCHEMAS_PATH) -> Dict[str, Any]:
+    schemas = build_schemas()
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"models_sha1": _models_hash(), "schemas": schemas}, f, ensure_ascii=False, indent=1)
+        f.write("\n")
+    os.replace(tmp_path, path)
+    return schemas
+
+
+def _load_schemas() -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+    """(schema trong schemas.json, None) hoặc (None, lý do file thiếu/hỏng/không khớp models.py)"""
+    try:
+        with open(SCHEMAS_PATH, encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError) as e:
+        return None, f"không đọc được {SCHEMAS_PATH} ({e})"
+    if data.get("models_sha1") != _models_hash():
+        return None, f"{SCHEMAS_PATH} không khớp models.py"
+    return data["schemas"], None
+
+
+@functools.lru_cache(maxsize=None)
+def _all_schemas() -> Dict[str, Any]:
+    schemas, reason = _load_schemas()
+    if schemas is not None:
+        return schemas
+    logger.warning("%s; dùng schema tính từ models.py (chạy `python schemas.py` để cập nhật file)", reason)
+    return build_schemas()
+
+
+def json_schema(name: str) -> Dict[str, Any]:
+    """Schema của model name (dùng chung, không sửa trực tiếp)"""
+    return _all_schemas()[name]
+
+
+if __name__ == "__main__":
+    if "--check" in sys.argv[1:]:
+        _, reason = _load_schemas()
+        print(f"{reason}; chạy `python schemas.py`" if reason else f"{SCHEMAS_PATH} khớp models.py")
+        sys.exit(1 if reason else 0)
+    print(f"Đã ghi {len(write_schemas())} schema vào {SCHEMAS_PATH}")
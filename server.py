@@ -0,0 +1,462 @@
+"""ASGI server phục vụ đồng thời nhiều phiên chat cho cả ba bot
+
+Chạy: uvicorn server:app --workers 2
+
+POST /travel, /menu, /stock với body JSON {"session_id": "...", "message": "...", "stream": false}
+- Trả về {"session_id": "...", "reply": "..."}; "stream": true trả về text/plain theo từng đoạn.
+- Mỗi phiên giữ trạng thái riêng (AgentMemory, Order, ConversationHistory) và xử lý
+  tuần tự các câu hỏi của cùng một phiên; các phiên khác nhau chạy song song.
+- Phiên nhàn rỗi quá SESSION_TTL (hoặc khi quá MAX_SESSIONS) được đóng gói thành snapshot
+  (session_state.py) và khôi phục khi người dùng quay lại; đặt SESSION_SNAPSHOT_PATH để
+  snapshot còn sau khi khởi động lại server.
+GET /healthz, GET /stats
+GET /metrics: histogram/counter dạng Prometheus; GET /traces?limit=10: phân rã thời gian các lượt gần nhất
+"""
+import asyncio
+import json
+import os
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Any, AsyncIterator, Callable, Dict, Iterator, Optional, Tuple
+
+from clients import aclose_clients, client_metrics, get_async_client, get_client, load_env
+from apiresponse import AgentMemory, TravelAgent, coalesced_cache_stats, create_plan_cache, create_price_cache
+from cache import SingleFlight, SQLiteCache
+from datmon import (ConversationHistory, Order, answer_from_menu, build_menu_request, finish_menu_turn,
+                    format_order_summary, order_followup)
+from giachungkhoan import StockAnalysis
+from prefetch import get_prefetcher
+from scheduler import INTERACTIVE, get_scheduler
+from session_state import create_session_snapshots, pack, unpack
+from streaming import astream_response
+from tracing import bind, record_error, recent_turns, render_metrics, span
+
+if TYPE_CHECKING:
+    from openai import AsyncOpenAI, OpenAI
+
+load_env()
+
+SESSION_TTL = float(os.getenv("SESSION_TTL", 30 * 60))
+MAX_SESSIONS = int(os.getenv("MAX_SESSIONS", 10_000))
+WORKER_THREADS = int(os.getenv("WORKER_THREADS", 64))
+PRICE_THREADS = int(os.getenv("PRICE_THREADS", 64))
+
+
+class Session:
+    """Trạng thái của một phiên chat; lock đảm bảo các câu hỏi được xử lý theo thứ tự"""
+    __slots__ = ("session_id", "state", "lock", "last_seen")
+
+    def __init__(self, session_id: str, state: Dict[str, Any]):
+        self.session_id = session_id
+        self.state = state
+        self.lock = asyncio.Lock()
+        self.last_seen = time.monotonic()
+
+
+class SessionStore:
+    """Lưu phiên theo (bot, session_id); phiên nhàn rỗi quá TTL hoặc khi quá số lượng được
+    cất thành snapshot (nếu bot có codec) và khôi phục ở câu hỏi tiếp theo
+
+    codecs: {bot: (dump, restore)}, dump(state) -> dữ liệu thuần, restore(dữ liệu) -> state.
+    """
+    def __init__(self, ttl: float = SESSION_TTL, max_sessions: int = MAX_SESSIONS, snapshots: Any = None,
+                 codecs: Optional[Dict[str, Tuple[Callable[[Dict[str, Any]], Any], Callable[[Any], Dict[str, Any]]]]] = None):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.snapshots = snapshots
+        self.codecs = codecs or {}
+        self._sessions = OrderedDict()
+        self.evicted = 0
+        self.paged_out = 0
+        self.restored = 0
+        self.restore_seconds = 0.0
+
+    def get(self, bot: str, session_id: str, factory: Callable[[], Dict[str, Any]]) -> Session:
+        self._sweep()
+        key = (bot, session_id)
+        session = self._sessions.get(key)
+        if session is None:
+            state = self._restore(bot, session_id)
+            session = Session(session_id, state if state is not None else factory())
+            self._sessions[key] = session
+        self._sessions.move_to_end(key)
+        session.last_seen = time.monotonic()
+        return session
+
+    def _snapshot_key(self, bot: str, session_id: str) -> str:
+        return f"{bot}|{session_id}"
+
+    def page_out(self, bot: str, session: Session) -> bool:
+        """Cất trạng thái phiên vào kho snapshot; False nếu bot không có codec hoặc lỗi"""
+        codec = self.codecs.get(bot)
+        if codec is None or self.snapshots is None:
+            return False
+        try:
+            self.snapshots.set(self._snapshot_key(bot, session.session_id), pack(codec[0](session.state)))
+        except Exception as e:
+            record_error("session_page_out", e)
+            return False
+        self.paged_out += 1
+        return True
+
+    def _restore(self, bot: str, session_id: str) -> Optional[Dict[str, Any]]:
+        codec = self.codecs.get(bot)
+        if codec is None or self.snapshots is None:
+            return None
+        key = self._snapshot_key(bot, session_id)
+        data = self.snapshots.get(key)
+        if data is None:
+            return None
+        # Phiên lại nằm trong bộ nhớ: snapshot sẽ được ghi lại khi nó nhàn rỗi lần sau
+        self.snapshots.delete(key)
+        start = time.perf_counter()
+        try:
+            state = codec[1](unpack(data))
+        except Exception as e:
+            record_error("session_restore", e)
+            return None
+        self.restore_seconds += time.perf_counter() - start
+        self.restored += 1
+        return state
+
+    def _sweep(self):
+        now = time.monotonic()
+        # Phiên cũ nhất nằm đầu OrderedDict; bỏ qua phiên đang xử lý (lock đang giữ)
+        for key, session in list(self._sessions.items()):
+            expired = now - session.last_seen > self.ttl
+            over_limit = len(self._sessions) >= self.max_sessions
+            if not (expired or over_limit):
+                break
+            if session.lock.locked():
+                continue
+            del self._sessions[key]
+            if not self.page_out(key[0], session):
+                self.evicted += 1
+
+    def page_out_all(self):
+        """Cất mọi phiên đang nhàn rỗi (khi tắt server với kho snapshot bền vững)"""
+        for key, session in list(self._sessions.items()):
+            if not session.lock.locked() and self.page_out(key[0], session):
+                del self._sessions[key]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "active": len(self._sessions),
+            "evicted": self.evicted,
+            "paged_out": self.paged_out,
+            "restored": self.restored,
+            "restore_avg_ms": self.restore_seconds / self.restored * 1000 if self.restored else None,
+            "snapshots": len(self.snapshots) if self.snapshots is not None else 0,
+        }
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+
+class BotServer:
+    """Ứng dụng ASGI: định tuyến request tới bot và quản lý tài nguyên dùng chung"""
+    def __init__(self):
+        self.sessions = SessionStore(snapshots=create_session_snapshots(), codecs={
+            "travel": (self.dump_travel_session, self.restore_travel_session),
+            "menu": (self.dump_menu_session, self.restore_menu_session),
+        })  # phiên chứng khoán không có trạng thái riêng, không cần snapshot
+        self.client: Optional["OpenAI"] = None
+        self.async_client: Optional["AsyncOpenAI"] = None
+        self.executor: Optional[ThreadPoolExecutor] = None
+        self.price_executor: Optional[ThreadPoolExecutor] = None
+        self.plan_cache = None
+        self.price_cache = None
+        self.plan_inflight: Optional[SingleFlight] = None
+        self.price_inflight: Optional[SingleFlight] = None
+        self.stock_analysis: Optional[StockAnalysis] = None
+        # Câu hỏi chứng khoán giống nhau đang được trả lời: khóa -> Future của câu trả lời
+        self.stock_inflight: Dict[str, asyncio.Future] = {}
+        self.stock_coalesced = 0
+        self.routes = {"/travel": self.handle_travel, "/menu": self.handle_menu, "/stock": self.handle_stock}
+
+    def startup(self):
+        # Một client (và connection pool) cho mọi phiên; TravelAgent chạy đồng bộ trong thread pool
+        self.client = get_client()
+        self.async_client = get_async_client()
+        self.executor = ThreadPoolExecutor(max_workers=WORKER_THREADS, thread_name_prefix="bot")
+        # Pool riêng cho tra giá: lượt chat đang chờ giá không được chiếm chỗ của chính các lần tra giá
+        self.price_executor = ThreadPoolExecutor(max_workers=PRICE_THREADS, thread_name_prefix="price")
+        self.plan_cache = create_plan_cache()
+        self.price_cache = create_price_cache()
+        # Gộp các lần tạo kế hoạch / tra giá trùng nhau đang chạy ở mọi phiên
+        self.plan_inflight = SingleFlight()
+        self.price_inflight = SingleFlight()
+        self.stock_analysis = StockAnalysis(self.client)
+
+    async def shutdown(self):
+        if isinstance(self.sessions.snapshots, SQLiteCache):
+            self.sessions.page_out_all()
+        get_prefetcher().shutdown()
+        for executor in (self.executor, self.price_executor):
+            if executor:
+                executor.shutdown(wait=False, cancel_futures=True)
+        await aclose_clients()
+
+    # --- Bot handlers: trả về async iterator các đoạn text ---
+
+    def new_travel_session(self) -> Dict[str, Any]:
+        agent = TravelAgent(
+            client=self.client,
+            plan_cache=self.plan_cache,
+            price_cache=self.price_cache,
+            price_executor=self.price_executor,
+            price_inflight=self.price_inflight,
+            plan_inflight=self.plan_inflight,
+        )
+        return {"agent": agent}
+
+    @staticmethod
+    def dump_travel_session(state: Dict[str, Any]) -> Dict[str, Any]:
+        return state["agent"].memory.to_state()
+
+    def restore_travel_session(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        state = self.new_travel_session()
+        state["agent"].memory = AgentMemory.from_state(data, self.plan_cache)
+        return state
+
+    async def handle_travel(self, session: Session, message: str) -> AsyncIterator[str]:
+        agent = session.state["agent"]
+        async for chunk in self.iterate_in_thread(lambda: agent.stream_user_input(message)):
+            yield chunk
+
+    def new_menu_session(self) -> Dict[str, Any]:
+        return {"order": Order(), "history": ConversationHistory()}
+
+    @staticmethod
+    def dump_menu_session(state: Dict[str, Any]) -> Dict[str, Any]:
+        return {"order": state["order"].to_state(), "history": state["history"].to_state()}
+
+    @staticmethod
+    def restore_menu_session(data: Dict[str, Any]) -> Dict[str, Any]:
+        return {"order": Order.from_state(data["order"]), "history": ConversationHistory.from_state(data["history"])}
+
+    async def handle_menu(self, session: Session, message: str) -> AsyncIterator[str]:
+        state = session.state
+        history = state["history"]
+        if message.lower() == "xóa lịch sử":
+            state["history"] = ConversationHistory()
+            yield "Đã xóa lịch sử câu hỏi!"
+            return
+
+        history.add_message("user", message)
+        parts = []
+        try:
+            direct_answer = answer_from_menu(message)
+            if direct_answer:
+                parts.append(direct_answer)
+                yield direct_answer
+                summary = format_order_summary(message, state["order"])
+            else:
+                completed = {}
+                request = build_menu_request(message, history, current_order=state["order"])
+                async for chunk in astream_response(self.async_client, on_response=lambda r: completed.update(response=r), **request):
+                    parts.append(chunk)
+                    yield chunk
+                # Đơn hàng được cập nhật từ lời gọi update_order trong cùng response
+                summary = finish_menu_turn(message, completed.get("response"), state["order"])
+                followup = order_followup(request, completed.get("response"), "".join(parts), summary, state["order"], history)
+                if followup is not None:
+                    # Response chỉ có lời gọi hàm: lấy câu trả lời cho khách từ lượt gửi kết quả
+                    async for chunk in astream_response(self.async_client, on_response=lambda r: completed.update(response=r), **followup):
+                        parts.append(chunk)
+                        yield chunk
+                    history.record_response(completed.get("response"))
+            if summary:
+                parts.append(summary)
+                yield summary
+        except Exception as e:
+            # Như vòng lặp CLI: lượt của khách luôn có câu trả lời trong lịch sử, kể cả khi
+            # lỗi API hoặc RequestShed xảy ra giữa chừng lúc đang stream
+            record_error("menu_turn", e)
+            apology = "Xin lỗi, hệ thống đang bận, bạn thử lại sau giây lát nhé!"
+            if parts:
+                apology = "\n" + apology
+            parts.append(apology)
+            yield apology
+        history.add_message("assistant", "".join(parts))
+
+    def new_stock_session(self) -> Dict[str, Any]:
+        return {}
+
+    async def handle_stock(self, session: Session, message: str) -> AsyncIterator[str]:
+        analysis = self.stock_analysis
+        loop = asyncio.get_running_loop()
+        # answer_key/build_request đọc kho dữ liệu (liệt kê thư mục, memmap, numpy): chạy trong thread pool
+        group, flight_key = await loop.run_in_executor(self.executor, bind(analysis.answer_key), message)
+        cached = analysis.cached_answer(group, message)
+        if cached is None and flight_key in self.stock_inflight:
+            # Chờ câu trả lời của request giống hệt đang chạy; nếu nó lỗi thì tự gọi lại
+            self.stock_coalesced += 1
+            try:
+                cached = await asyncio.shield(self.stock_inflight[flight_key])
+            except Exception:
+                cached = None
+        if cached is not None:
+            yield cached
+            return
+
+        future = loop.create_future()
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self.stock_inflight[flight_key] = future
+        parts = []
+        try:
+            request = await loop.run_in_executor(self.executor, bind(analysis.build_request), message)
+            async for chunk in astream_response(self.async_client, priority=INTERACTIVE, deadline=analysis.deadline,
+                                                **request):
+                parts.append(chunk)
+                yield chunk
+            answer = "".join(parts)
+            analysis.store_answer(group, message, answer)
+            future.set_result(answer)
+        except Exception as e:
+            future.set_exception(e)
+            yield f"Xin lỗi, có lỗi xảy ra: {str(e)}"
+        finally:
+            if not future.done():
+                future.set_exception(RuntimeError("Request bị hủy"))
+            if self.stock_inflight.get(flight_key) is future:
+                del self.stock_inflight[flight_key]
+
+    async def iterate_in_thread(self, make_iterator: Callable[[], Iterator[str]]) -> AsyncIterator[str]:
+        """Chạy generator đồng bộ trong thread pool, chuyển từng đoạn text về event loop"""
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue()
+        done = object()
+
+        def produce():
+            try:
+                for chunk in make_iterator():
+                    loop.call_soon_threadsafe(queue.put_nowait, chunk)
+            except BaseException as e:
+                loop.call_soon_threadsafe(queue.put_nowait, e)
+            finally:
+                loop.call_soon_threadsafe(queue.put_nowait, done)
+
+        future = loop.run_in_executor(self.executor, bind(produce))
+        while True:
+            item = await queue.get()
+            if item is done:
+                break
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+        await future
+
+    # --- ASGI ---
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self.lifespan(receive, send)
+            return
+        if scope["type"] != "http":
+            return
+
+        path, method = scope["path"], scope["method"]
+        if method == "GET" and path == "/healthz":
+            await self.send_json(send, 200, {"status": "ok"})
+            return
+        if method == "GET" and path == "/stats":
+            await self.send_json(send, 200, {
+                "sessions": len(self.sessions),
+                "evicted": self.sessions.evicted,
+                "session_store": self.sessions.stats(),
+                "http": client_metrics(),
+                "travel_plans": coalesced_cache_stats(self.plan_cache, self.plan_inflight) if self.plan_cache is not None else {},
+                "travel_prices": coalesced_cache_stats(self.price_cache, self.price_inflight) if self.price_cache is not None else {},
+                "stock_answers": self.stock_analysis.answer_cache_stats() if self.stock_analysis else {},
+                "stock_coalesced": self.stock_coalesced,
+                "scheduler": get_scheduler().stats(),
+                "prefetch": get_prefetcher().stats(),
+            })
+            return
+        if method == "GET" and path == "/metrics":
+            await self.send_text(send, 200, render_metrics(), b"text/plain; version=0.0.4; charset=utf-8")
+            return
+        if method == "GET" and path == "/traces":
+            query = dict(part.split("=", 1) for part in scope.get("query_string", b"").decode().split("&") if "=" in part)
+            limit = int(query["limit"]) if query.get("limit", "").isdigit() else 10
+            await self.send_json(send, 200, {"turns": recent_turns(limit)})
+            return
+
+        handler = self.routes.get(path)
+        if handler is None or method != "POST":
+            await self.send_json(send, 404, {"error": "not found"})
+            return
+
+        try:
+            payload = json.loads(await self.read_body(receive) or b"{}")
+            message = str(payload["message"]).strip()
+        except (ValueError, KeyError, TypeError):
+            await self.send_json(send, 400, {"error": "body phải là JSON có trường 'message'"})
+            return
+
+        bot = path.strip("/")
+        session_id = str(payload.get("session_id") or uuid.uuid4().hex)
+        session = self.sessions.get(bot, session_id, getattr(self, f"new_{bot}_session"))
+
+        async with session.lock:
+            with span(f"http.{bot}", session_id=session_id, stream=bool(payload.get("stream"))):
+                if payload.get("stream"):
+                    await self.send_stream(send, session_id, handler(session, message))
+                else:
+                    parts = [chunk async for chunk in handler(session, message)]
+                    await self.send_json(send, 200, {"session_id": session_id, "reply": "".join(parts)})
+
+    async def lifespan(self, receive, send):
+        while True:
+            event = await receive()
+            if event["type"] == "lifespan.startup":
+                self.startup()
+                await send({"type": "lifespan.startup.complete"})
+            elif event["type"] == "lifespan.shutdown":
+                await self.shutdown()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    @staticmethod
+    async def read_body(receive) -> bytes:
+        body = b""
+        while True:
+            event = await receive()
+            body += event.get("body", b"")
+            if not event.get("more_body"):
+                return body
+
+    @staticmethod
+    async def send_json(send, status: int, data: Dict[str, Any]):
+        body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": [(b"content-type", b"application/json; charset=utf-8")],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+    @staticmethod
+    async def send_text(send, status: int, text: str, content_type: bytes = b"text/plain; charset=utf-8"):
+        await send({"type": "http.response.start", "status": status, "headers": [(b"content-type", content_type)]})
+        await send({"type": "http.response.body", "body": text.encode("utf-8")})
+
+    @staticmethod
+    async def send_stream(send, session_id: str, chunks: AsyncIterator[str]):
+        await send({
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [
+                (b"content-type", b"text/plain; charset=utf-8"),
+                (b"x-session-id", session_id.encode("utf-8")),
+            ],
+        })
+        async for chunk in chunks:
+            await send({"type": "http.response.body", "body": chunk.encode("utf-8"), "more_body": True})
+        await send({"type": "http.response.body", "body": b""})
+
+
+app = BotServer()
@@ -0,0 +1,59 @@
+"""Đóng gói trạng thái phiên chat thành bytes để cất khỏi bộ nhớ và khôi phục lại
+
+Các lớp trạng thái (AgentMemory, UserInfo, PlanSession, Order, TokenBudgetHistory) có
+to_state()/from_state() chuyển qua lại dữ liệu thuần (dict/list/str/số). pack() nén dữ liệu
+đó bằng msgpack nếu có cài, nếu không thì dùng JSON gọn (utf-8); bytes mở đầu bằng một byte
+định dạng nên snapshot cũ vẫn đọc được khi đổi qua lại giữa hai cách.
+
+Kho snapshot cấu hình qua biến môi trường:
+
+    SESSION_SNAPSHOT_PATH   file SQLite để giữ snapshot qua các lần khởi động lại
+                            (mặc định: chỉ giữ trong bộ nhớ)
+    SESSION_SNAPSHOT_MAX    số snapshot tối đa (mặc định 100000)
+    SESSION_SNAPSHOT_TTL    thời gian giữ snapshot, giây (mặc định 24 giờ)
+"""
+import json
+import os
+from typing import Any
+
+from cache import LRUCache, SQLiteCache
+
+try:
+    import msgpack
+except ImportError:  # chưa cài msgpack: dùng JSON
+    msgpack = None
+
+_MSGPACK = b"M"
+_JSON = b"J"
+
+
+def pack(state: Any) -> bytes:
+    if msgpack is not None:
+        return _MSGPACK + msgpack.packb(state, use_bin_type=True)
+    return _JSON + json.dumps(state, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def unpack(data: bytes) -> Any:
+    kind, body = data[:1], data[1:]
+    if kind == _MSGPACK:
+        if msgpack is None:
+            raise ValueError("Snapshot được đóng gói bằng msgpack nhưng chưa cài msgpack")
+        return msgpack.unpackb(body, raw=False, strict_map_key=False)
+    if kind == _JSON:
+        return json.loads(body)
+    raise ValueError(f"Định dạng snapshot không hợp lệ: {kind!r}")
+
+
+def _identity(value: Any) -> Any:
+    return value
+
+
+def create_session_snapshots():
+    """Kho snapshot phiên (bytes): LRU trong bộ nhớ hoặc SQLite nếu đặt SESSION_SNAPSHOT_PATH"""
+    ttl = float(os.getenv("SESSION_SNAPSHOT_TTL", 24 * 3600))
+    max_size = int(os.getenv("SESSION_SNAPSHOT_MAX", 100_000))
+    path = os.getenv("SESSION_SNAPSHOT_PATH")
+    if not path:
+        return LRUCache(max_size=max_size, ttl=ttl)
+    # bytes đã đóng gói sẵn, lưu thẳng vào cột BLOB
+    return SQLiteCache(path, ttl=ttl, max_size=max_size, table="sessions", serializer=(_identity, bytes))
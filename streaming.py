@@ -0,0 +1,102 @@
+"""Stream câu trả lời từ Responses API theo từng đoạn text (delta)
+
+on_delta là callback nhận từng đoạn text, dùng để chuyển tiếp cho web front end.
+"""
+from typing import Any, AsyncIterator, Callable, Iterable, Iterator, Optional
+
+from scheduler import arequest, request
+
+DeltaCallback = Optional[Callable[[str], None]]
+
+
+class TextStream:
+    """Bọc event stream của Responses API, chỉ trả ra các đoạn text
+
+    Sau khi duyệt hết, .response là Response hoàn chỉnh (output, usage, ...) và
+    .text là toàn bộ câu trả lời. Bỏ dở giữa chừng thì gọi close() (hoặc dùng with) để trả
+    chỗ của request cho scheduler.
+    """
+    def __init__(self, events: Iterable[Any], on_delta: DeltaCallback = None):
+        self._events = events
+        self._on_delta = on_delta
+        self._parts = []
+        self.response = None
+
+    def __iter__(self) -> Iterator[str]:
+        for event in self._events:
+            if event.type == "response.output_text.delta":
+                self._parts.append(event.delta)
+                if self._on_delta:
+                    self._on_delta(event.delta)
+                yield event.delta
+            elif event.type in ("response.completed", "response.incomplete"):
+                self.response = event.response
+            elif event.type in ("response.failed", "error"):
+                raise RuntimeError(getattr(event, "message", None) or "Response stream failed")
+
+    @property
+    def text(self) -> str:
+        return "".join(self._parts)
+
+    def close(self):
+        close = getattr(self._events, "close", None)
+        if close is not None:
+            close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def stream_response(client: Any, on_delta: DeltaCallback = None, **kwargs) -> TextStream:
+    """Gọi client.responses.create(stream=True, ...) qua scheduler và trả về TextStream
+
+    kwargs có thể kèm priority/deadline/fallback_model của scheduler.request.
+    """
+    return TextStream(request("responses", client.responses.create, stream=True, **kwargs), on_delta)
+
+
+async def astream_response(client: Any, on_delta: DeltaCallback = None,
+                           on_response: Optional[Callable[[Any], None]] = None, **kwargs) -> AsyncIterator[str]:
+    """Phiên bản async cho AsyncOpenAI: async for delta in astream_response(...)
+
+    on_response nhận Response hoàn chỉnh khi stream kết thúc.
+    """
+    events = await arequest("responses", client.responses.create, stream=True, **kwargs)
+    try:
+        async for event in events:
+            if event.type == "response.output_text.delta":
+                if on_delta:
+                    on_delta(event.delta)
+                yield event.delta
+            elif event.type in ("response.completed", "response.incomplete"):
+                if on_response:
+                    on_response(event.response)
+            elif event.type in ("response.failed", "error"):
+                raise RuntimeError(getattr(event, "message", None) or "Response stream failed")
+    finally:
+        # Người nhận bỏ dở (đóng kết nối): đóng stream để scheduler lấy lại chỗ ngay
+        aclose = getattr(events, "aclose", None)
+        if aclose is not None:
+            await aclose()
+
+
+def emit(chunks: Iterable[str], on_delta: DeltaCallback = None) -> Iterator[str]:
+    """Chuyển tiếp các đoạn text đã có sẵn qua cùng callback"""
+    for chunk in chunks:
+        if on_delta:
+            on_delta(chunk)
+        yield chunk
+
+
+def print_stream(chunks: Iterable[str], prefix: str = "\nAI: ") -> str:
+    """In từng đoạn text ngay khi nhận được (dùng cho vòng lặp CLI), trả về toàn văn"""
+    print(prefix, end="", flush=True)
+    parts = []
+    for chunk in chunks:
+        parts.append(chunk)
+        print(chunk, end="", flush=True)
+    print()
+    return "".join(parts)
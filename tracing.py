@@ -0,0 +1,426 @@
+"""Đo thời gian, token và lỗi của từng bước trong một lượt chat
+
+- span(name): đo một bước; các span lồng nhau tạo thành cây cho từng lượt (turn).
+- call_openai(...): bọc client.responses.create / chat.completions.create, ghi model, tool,
+  token vào/ra, số lần thử lại (retry) và kết quả.
+- Nếu có cài opentelemetry, mọi span được gửi sang OpenTelemetry (mặc định của OTel là
+  no-op cho tới khi cấu hình SDK/exporter); không có thì chỉ ghi số liệu nội bộ.
+- render_metrics(): histogram/counter dạng Prometheus text, server phục vụ ở GET /metrics.
+- Mỗi lượt xong có bảng phân rã thời gian (flame) trong recent_turns(); đặt TRACE_TURNS=1
+  để in ra stderr sau mỗi lượt.
+"""
+import contextvars
+import functools
+import inspect
+import logging
+import os
+import sys
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+try:
+    from opentelemetry import trace as otel_trace
+    from opentelemetry.trace import Status, StatusCode
+    _otel_tracer = otel_trace.get_tracer("response-api-bots")
+except ImportError:
+    otel_trace = None
+    _otel_tracer = None
+
+logger = logging.getLogger("bots")
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+# --- Số liệu dạng Prometheus ---
+
+def _label_text(labels: Tuple[Tuple[str, str], ...], extra: str = "") -> str:
+    parts = [f'{name}="{value}"' for name, value in labels]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Counter:
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self._values: Dict[Tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(sorted((k, str(v)) for k, v in labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            lines += [f"{self.name}{_label_text(key)} {value:g}" for key, value in sorted(self._values.items())]
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, buckets: Tuple[float, ...] = DURATION_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        self._values: Dict[Tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(sorted((k, str(v)) for k, v in labels.items()))
+        with self._lock:
+            # [số đếm theo từng bucket..., tổng, số lần]
+            entry = self._values.setdefault(key, [0] * len(self.buckets) + [0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[i] += 1
+            entry[-2] += value
+            entry[-1] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, entry in sorted(self._values.items()):
+                for bound, count in zip(self.buckets, entry):
+                    le = 'le="%g"' % bound
+                    lines.append(f"{self.name}_bucket{_label_text(key, le)} {count}")
+                le = 'le="+Inf"'
+                lines.append(f"{self.name}_bucket{_label_text(key, le)} {entry[-1]}")
+                lines.append(f"{self.name}_sum{_label_text(key)} {entry[-2]:.6f}")
+                lines.append(f"{self.name}_count{_label_text(key)} {entry[-1]}")
+        return lines
+
+
+class Gauge:
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self._values: Dict[Tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def set(self, value: float, **labels):
+        key = tuple(sorted((k, str(v)) for k, v in labels.items()))
+        with self._lock:
+            self._values[key] = value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        with self._lock:
+            lines += [f"{self.name}{_label_text(key)} {value:g}" for key, value in sorted(self._values.items())]
+        return lines
+
+
+SPAN_SECONDS = Histogram("bot_step_duration_seconds", "Thời gian từng bước xử lý")
+OPENAI_SECONDS = Histogram("openai_request_duration_seconds", "Thời gian gọi OpenAI API")
+OPENAI_TOKENS = Counter("openai_tokens_total", "Số token gửi/nhận")
+OPENAI_RETRIES = Counter("openai_retries_total", "Số lần SDK thử lại request")
+TOOL_CALLS = Counter("openai_tool_calls_total", "Số lần model dùng tool")
+CACHE_LOOKUPS = Counter("cache_lookups_total", "Số lần tra cache theo kết quả hit/miss")
+ERRORS = Counter("bot_errors_total", "Số lỗi đã được xử lý (trả câu trả lời dự phòng)")
+METRICS = [SPAN_SECONDS, OPENAI_SECONDS, OPENAI_TOKENS, OPENAI_RETRIES, TOOL_CALLS, CACHE_LOOKUPS, ERRORS]
+
+
+def render_metrics() -> str:
+    return "\n".join(line for metric in METRICS for line in metric.render()) + "\n"
+
+
+# --- Span ---
+
+class Span:
+    def __init__(self, name: str, parent: Optional["Span"] = None, attributes: Optional[Dict[str, Any]] = None):
+        self.name = name
+        self.parent = parent
+        self.attributes = dict(attributes or {})
+        self.children: List["Span"] = []
+        self.error: Optional[str] = None
+        self.start = time.perf_counter()
+        self.end_time: Optional[float] = None
+        self._otel = None
+        if _otel_tracer is not None:
+            context = otel_trace.set_span_in_context(parent._otel) if parent is not None and parent._otel else None
+            self._otel = _otel_tracer.start_span(name, context=context)
+        if parent is not None:
+            parent.children.append(self)
+
+    @property
+    def duration(self) -> float:
+        return (self.end_time or time.perf_counter()) - self.start
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def incr(self, name: str, amount: int = 1):
+        self.attributes[name] = self.attributes.get(name, 0) + amount
+
+    def record_exception(self, error: BaseException):
+        self.error = f"{type(error).__name__}: {error}"
+        if self._otel is not None:
+            self._otel.record_exception(error)
+            self._otel.set_status(Status(StatusCode.ERROR, str(error)))
+
+    def end(self):
+        if self.end_time is not None:
+            return
+        self.end_time = time.perf_counter()
+        SPAN_SECONDS.observe(self.duration, step=self.name)
+        if self._otel is not None:
+            for key, value in self.attributes.items():
+                if isinstance(value, (str, bool, int, float)):
+                    self._otel.set_attribute(key, value)
+            self._otel.end()
+        if self.parent is None:
+            _finish_turn(self)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "duration_ms": round(self.duration * 1000, 2),
+            "attributes": self.attributes,
+            "error": self.error,
+            "children": [child.to_dict() for child in self.children],
+        }
+
+
+_current: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar("current_span", default=None)
+_recent_turns = deque(maxlen=int(os.getenv("TRACE_KEEP_TURNS", 50)))
+
+
+def current_span() -> Optional[Span]:
+    return _current.get()
+
+
+class span:
+    """with span("get_travel_plan", destination=...) as s: ... (s.set(...) để thêm thuộc tính)"""
+    def __init__(self, name: str, **attributes):
+        self.name = name
+        self.attributes = attributes
+
+    def __enter__(self) -> Span:
+        self._span = Span(self.name, _current.get(), self.attributes)
+        self._token = _current.set(self._span)
+        return self._span
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc is not None and not isinstance(exc, GeneratorExit):
+            self._span.record_exception(exc)
+        try:
+            _current.reset(self._token)
+        except ValueError:
+            # Generator được kết thúc ở context khác với lúc bắt đầu
+            _current.set(self._span.parent)
+        self._span.end()
+        return False
+
+
+def traced(name: Optional[str] = None):
+    """Decorator đo thời gian hàm; với generator, span kéo dài tới khi duyệt xong"""
+    def decorator(fn):
+        step = name or fn.__name__
+        if inspect.isgeneratorfunction(fn):
+            @functools.wraps(fn)
+            def generator_wrapper(*args, **kwargs):
+                with span(step):
+                    yield from fn(*args, **kwargs)
+            return generator_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(step):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def bind(fn: Callable) -> Callable:
+    """Giữ span hiện tại khi chạy fn ở thread khác (ThreadPoolExecutor không tự chuyển context)"""
+    context = contextvars.copy_context()
+    return functools.partial(context.run, fn)
+
+
+def note_http_attempt():
+    """Gọi từ transport HTTP cho mỗi request thực sự gửi đi (kể cả khi SDK thử lại)"""
+    current = _current.get()
+    if current is not None and current.name.startswith("openai."):
+        current.incr("http.attempts")
+
+
+def record_cache(cache: str, hit: bool):
+    result = "hit" if hit else "miss"
+    CACHE_LOOKUPS.inc(cache=cache, result=result)
+    current = _current.get()
+    if current is not None:
+        current.incr(f"cache.{cache}.{result}")
+
+
+def record_error(where: str, error: BaseException):
+    """Ghi lại lỗi đã được xử lý bằng câu trả lời dự phòng (thay cho except im lặng)"""
+    ERRORS.inc(where=where, type=type(error).__name__)
+    current = _current.get()
+    if current is not None:
+        current.record_exception(error)
+    logger.warning("%s thất bại: %s: %s", where, type(error).__name__, error)
+
+
+# --- Bọc lời gọi OpenAI ---
+
+def _usage(response: Any) -> Tuple[int, int]:
+    usage = getattr(response, "usage", None)
+    if usage is None:
+        return 0, 0
+    input_tokens = getattr(usage, "input_tokens", None) or getattr(usage, "prompt_tokens", 0) or 0
+    output_tokens = getattr(usage, "output_tokens", None) or getattr(usage, "completion_tokens", 0) or 0
+    return input_tokens, output_tokens
+
+
+def _finish_call(call: Span, response: Any, error: Optional[BaseException]):
+    endpoint, model = call.attributes["endpoint"], call.attributes["model"]
+    if error is not None:
+        call.record_exception(error)
+    else:
+        input_tokens, output_tokens = _usage(response)
+        tools_used = [item.type for item in getattr(response, "output", None) or [] if item.type != "message"]
+        call.set(input_tokens=input_tokens, output_tokens=output_tokens, tools_used=",".join(tools_used))
+        OPENAI_TOKENS.inc(input_tokens, endpoint=endpoint, model=model, direction="input")
+        OPENAI_TOKENS.inc(output_tokens, endpoint=endpoint, model=model, direction="output")
+        for tool in tools_used:
+            TOOL_CALLS.inc(tool=tool)
+    retries = max(0, call.attributes.get("http.attempts", 1) - 1)
+    call.set(retries=retries)
+    if retries:
+        OPENAI_RETRIES.inc(retries, endpoint=endpoint, model=model)
+    status = "ok" if error is None else type(error).__name__
+    call.end()
+    OPENAI_SECONDS.observe(call.duration, endpoint=endpoint, model=model, status=status)
+
+
+def _start_call(endpoint: str, kwargs: Dict[str, Any]) -> Span:
+    tools = ",".join(tool.get("type", "") for tool in kwargs.get("tools") or [])
+    return Span(f"openai.{endpoint}", _current.get(),
+                {"endpoint": endpoint, "model": kwargs.get("model", ""), "tools": tools,
+                 "stream": bool(kwargs.get("stream"))})
+
+
+def call_openai(endpoint: str, create: Callable[..., Any], **kwargs) -> Any:
+    """create(**kwargs) trong một span; với stream=True span kết thúc khi stream được duyệt hết"""
+    call = _start_call(endpoint, kwargs)
+    token = _current.set(call)
+    try:
+        result = create(**kwargs)
+    except BaseException as e:
+        _current.reset(token)
+        _finish_call(call, None, e)
+        raise
+    _current.reset(token)
+    if kwargs.get("stream"):
+        return _traced_events(call, result)
+    _finish_call(call, result, None)
+    return result
+
+
+def _traced_events(call: Span, events: Any) -> Iterator[Any]:
+    response, error = None, None
+    try:
+        for event in events:
+            if event.type in ("response.completed", "response.incomplete"):
+                response = event.response
+            elif event.type == "response.output_text.delta" and "first_token_ms" not in call.attributes:
+                call.set(first_token_ms=round(call.duration * 1000, 1))
+            yield event
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        _finish_call(call, response, error if not isinstance(error, GeneratorExit) else None)
+
+
+async def acall_openai(endpoint: str, create: Callable[..., Any], **kwargs) -> Any:
+    """Phiên bản async của call_openai (AsyncOpenAI)"""
+    call = _start_call(endpoint, kwargs)
+    token = _current.set(call)
+    try:
+        result = await create(**kwargs)
+    except BaseException as e:
+        _current.reset(token)
+        _finish_call(call, None, e)
+        raise
+    _current.reset(token)
+    if kwargs.get("stream"):
+        return _atraced_events(call, result)
+    _finish_call(call, result, None)
+    return result
+
+
+async def _atraced_events(call: Span, events: Any):
+    response, error = None, None
+    try:
+        async for event in events:
+            if event.type in ("response.completed", "response.incomplete"):
+                response = event.response
+            elif event.type == "response.output_text.delta" and "first_token_ms" not in call.attributes:
+                call.set(first_token_ms=round(call.duration * 1000, 1))
+            yield event
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        _finish_call(call, response, error if not isinstance(error, GeneratorExit) else None)
+
+
+# --- Phân rã thời gian theo lượt ---
+
+def span_tokens(root: Span) -> int:
+    """Tổng token (vào + ra) của các lời gọi OpenAI nằm dưới root"""
+    own = root.attributes.get("input_tokens", 0) + root.attributes.get("output_tokens", 0)
+    return own + sum(span_tokens(child) for child in root.children)
+
+
+def flame(root: Span, indent: str = "  ") -> str:
+    """Cây các bước của một lượt với thời gian và tỉ lệ so với cả lượt"""
+    total = root.duration or 1e-9
+    lines = []
+
+    def walk(node: Span, depth: int):
+        details = [f"{node.duration * 1000:8.1f} ms", f"{node.duration / total:6.1%}"]
+        attributes = {k: v for k, v in node.attributes.items() if v not in ("", None, False)}
+        extra = " ".join(f"{k}={v}" for k, v in attributes.items())
+        line = f"{'  '.join(details)}  {indent * depth}{node.name}"
+        if extra:
+            line += f"  [{extra}]"
+        if node.error:
+            line += f"  !{node.error}"
+        lines.append(line)
+        for child in sorted(node.children, key=lambda c: c.start):
+            walk(child, depth + 1)
+
+    walk(root, 0)
+    return "\n".join(lines)
+
+
+def folded_stacks(root: Span) -> List[str]:
+    """Dạng "a;b;c micro_giây" (thời gian riêng của từng bước) cho flamegraph.pl / speedscope"""
+    lines = []
+
+    def walk(node: Span, prefix: str):
+        path = f"{prefix};{node.name}" if prefix else node.name
+        own = node.duration - sum(child.duration for child in node.children)
+        lines.append(f"{path} {max(0, int(own * 1e6))}")
+        for child in node.children:
+            walk(child, path)
+
+    walk(root, "")
+    return lines
+
+
+def _finish_turn(root: Span):
+    _recent_turns.append(root)
+    if os.getenv("TRACE_TURNS", "").lower() in ("1", "true", "yes"):
+        print(flame(root), file=sys.stderr)
+
+
+def recent_turns(limit: int = 10) -> List[Dict[str, Any]]:
+    """Các lượt gần nhất (mới nhất trước) dạng cây, kèm bảng flame dạng text"""
+    turns = list(_recent_turns)[-limit:][::-1]
+    return [dict(turn.to_dict(), flame=flame(turn)) for turn in turns]
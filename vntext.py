@@ -0,0 +1,91 @@
+"""Tiện ích xử lý văn bản tiếng Việt dùng chung cho các bot"""
+import re
+import unicodedata
+from typing import List, Optional
+
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def fold_diacritics(text: str) -> str:
+    """Bỏ dấu tiếng Việt và chuyển về chữ thường: "Đà Lạt" -> "da lat" """
+    text = text.replace("đ", "d").replace("Đ", "D")
+    decomposed = unicodedata.normalize("NFD", text)
+    stripped = "".join(ch for ch in decomposed if unicodedata.category(ch) != "Mn")
+    return unicodedata.normalize("NFC", stripped).lower()
+
+
+def tokenize(text: str) -> List[str]:
+    """Tách âm tiết (đã bỏ dấu, chữ thường)"""
+    return _WORD_RE.findall(fold_diacritics(text))
+
+
+def normalize_text(text: str) -> str:
+    """Chuẩn hóa văn bản để làm khóa so khớp: bỏ dấu, chữ thường, bỏ dấu câu"""
+    return " ".join(tokenize(text))
+
+
+_NUMBER = r"(\d+(?:[.,]\d+)?)"
+_DAYS_RE = re.compile(_NUMBER + r"\s*(ngay|n)\b")
+_NIGHTS_RE = re.compile(_NUMBER + r"\s*(dem|d)\b")
+_WEEKS_RE = re.compile(_NUMBER + r"\s*tuan\b")
+_MONEY_RE = re.compile(_NUMBER + r"\s*(trieu|tr|cu|m|nghin|ngan|k|ty|vnd|dong|d)?\b")
+_MONEY_UNITS = {
+    "trieu": 1_000_000, "tr": 1_000_000, "cu": 1_000_000, "m": 1_000_000,
+    "nghin": 1_000, "ngan": 1_000, "k": 1_000,
+    "ty": 1_000_000_000,
+}
+BUDGET_BUCKETS = (2_000_000, 5_000_000, 10_000_000, 20_000_000, 50_000_000)
+
+
+def _to_float(number: str) -> float:
+    return float(number.replace(",", "."))
+
+
+def parse_duration_days(value) -> Optional[int]:
+    """Đổi thời gian chuyến đi về số ngày: "3 ngày 2 đêm" -> 3, "2 đêm" -> 3, "1 tuần" -> 7"""
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return int(value)
+    text = fold_diacritics(str(value))
+    if "cuoi tuan" in text:
+        return 2
+    match = _DAYS_RE.search(text)
+    if match:
+        return int(_to_float(match.group(1)))
+    match = _WEEKS_RE.search(text)
+    if match:
+        return int(_to_float(match.group(1)) * 7)
+    match = _NIGHTS_RE.search(text)
+    if match:
+        return int(_to_float(match.group(1))) + 1
+    match = re.search(r"\d+", text)
+    return int(match.group()) if match else None
+
+
+def parse_budget_vnd(value) -> Optional[int]:
+    """Đổi ngân sách về số tiền VND: "5 triệu" -> 5000000, "500k" -> 500000, "5.000.000đ" -> 5000000"""
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return int(value)
+    text = fold_diacritics(str(value))
+    # "5.000.000" / "5,000,000": dấu phân cách hàng nghìn
+    text = re.sub(r"(?<=\d)[.,](?=\d{3}\b)", "", text)
+    match = _MONEY_RE.search(text)
+    if not match:
+        return None
+    return int(_to_float(match.group(1)) * _MONEY_UNITS.get(match.group(2) or "", 1))
+
+
+def budget_bucket(value) -> str:
+    """Gom ngân sách vào các khoảng cố định để các mức gần nhau dùng chung cache"""
+    amount = parse_budget_vnd(value)
+    if amount is None:
+        return "any"
+    lower = 0
+    for upper in BUDGET_BUCKETS:
+        if amount < upper:
+            return f"{lower // 1_000_000}-{upper // 1_000_000}tr"
+        lower = upper
+    return f"{lower // 1_000_000}tr+"